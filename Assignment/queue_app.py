@@ -1,158 +1,517 @@
+import csv
 import json
 import os
 import sys
-from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
-
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import queue_metrics
+from queue_metrics import instrument
+from queue_store import QueueStore, LogStore
+from queue_records import Ticket
+from queue_index import DEFAULT_LANE, DEFAULT_QUEUE, LANE_WEIGHTS, lane_of, parse_lanes, queue_of
+from queue_sqlite import SQLiteStore
+from queue_stats import parse_window
+
+DATA_DIR = os.environ.get("QUEUE_APP_DATA", os.path.join(os.path.dirname(__file__), "data"))
 DATA_FILE = os.path.join(DATA_DIR, "queue.json")
+# "json" (queue.json + append-only log) or "sqlite" (queue.db)
+BACKEND = os.environ.get("QUEUE_APP_BACKEND", "json")
+BACKENDS = {"json": LogStore, "sqlite": SQLiteStore}
+# Priority lanes and their weights, e.g. "vip=4,elderly=2,normal=1".
+LANES = parse_lanes(os.environ["QUEUE_APP_LANES"]) if os.environ.get("QUEUE_APP_LANES") else LANE_WEIGHTS
+# "global": one ticket sequence for every queue; "queue": each queue also numbers from 1.
+NUMBERING = os.environ.get("QUEUE_APP_NUMBERING", "global")
+# How long an agent may hold a claimed ticket before it goes back to the front.
+LEASE_SECONDS = float(os.environ.get("QUEUE_APP_LEASE", "300"))
+# Seconds a ticket may wait before it is cancelled as a no-show (0 = never).
+NO_SHOW_AFTER = float(os.environ.get("QUEUE_APP_NO_SHOW_AFTER", "0"))
+# Tickets per transaction (one log write and one fsync) for bulk adds and imports.
+BATCH_SIZE = 10000
+# Columns of a CSV export; an import reads name, queue and lane back.
+EXPORT_FIELDS = ("id", "name", "queue", "lane", "number", "joined_at")
+# Rows per page of the waiting list, and per window around a ticket.
+PAGE_SIZE = 50
+# Formatted local times kept by format_local before its caches start over.
+LOCAL_CACHE_SIZE = 1 << 16
+# Where operation metrics go in Prometheus text format (see queue_metrics).
+METRICS_FILE = os.environ.get("QUEUE_APP_METRICS_FILE", os.path.join(DATA_DIR, "metrics.prom"))
 
 
 def now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+# format_local's caches: finished text by ISO string, and the text around
+# the seconds by epoch minute (UTC offsets only change on a minute boundary).
+_local_texts: Dict[str, str] = {}
+_local_minutes: Dict[int, Tuple[str, str]] = {}
+
+
+def _format_epoch(seconds: int) -> str:
+    minute, second = divmod(seconds, 60)
+    parts = _local_minutes.get(minute)
+    if parts is None:
+        # Convert to local timezone for display
+        local_dt = datetime.fromtimestamp(minute * 60).astimezone()
+        parts = local_dt.strftime("%Y-%m-%d %H:%M:"), local_dt.strftime(" %Z")
+        if len(_local_minutes) >= LOCAL_CACHE_SIZE:
+            _local_minutes.clear()
+        _local_minutes[minute] = parts
+    return f"{parts[0]}{second:02d}{parts[1]}"
+
+
 def format_local(dt_iso: str) -> str:
+    text = _local_texts.get(dt_iso)
+    if text is not None:
+        return text
     try:
         dt = datetime.fromisoformat(dt_iso)
-        # Convert to local timezone for display
-        local_dt = dt.astimezone()
-        return local_dt.strftime("%Y-%m-%d %H:%M:%S %Z")
+        if dt.tzinfo is None:
+            # Already local time (and maybe in a DST gap): convert as is.
+            text = dt.astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
+        else:
+            text = _format_epoch(int(dt.timestamp() // 1))
     except Exception:
         return dt_iso
+    if len(_local_texts) >= LOCAL_CACHE_SIZE:
+        _local_texts.clear()
+    _local_texts[dt_iso] = text
+    return text
+
+
+_store: Optional[QueueStore] = None
+
+
+def get_store() -> QueueStore:
+    global _store
+    store_class = BACKENDS.get(BACKEND)
+    if store_class is None:
+        raise ValueError(f"Unknown storage backend: {BACKEND!r}")
+    if _store is None or _store.data_dir != DATA_DIR or type(_store) is not store_class:
+        if _store is not None:
+            _store.close()
+        _store = store_class(DATA_DIR, lanes=LANES, numbering=NUMBERING)
+    _store.refresh()
+    return _store
 
 
 def ensure_data_file() -> None:
-    if not os.path.isdir(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True)
-    if not os.path.exists(DATA_FILE):
-        default = {"next_id": 1, "queue": [], "history": []}
-        save_data(default)
+    get_store()
 
 
+@instrument("load_data")
 def load_data() -> Dict[str, Any]:
-    ensure_data_file()
-    with open(DATA_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    store = get_store()
+    return json.loads(json.dumps(store.state()))
 
 
+@instrument("save_data")
 def save_data(data: Dict[str, Any]) -> None:
-    if not os.path.isdir(DATA_DIR):
-        os.makedirs(DATA_DIR, exist_ok=True)
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    get_store().replace(data)
+
 
+def compact() -> None:
+    get_store().compact()
 
-def add_person(name: str) -> Dict[str, Any]:
+
+@instrument("add_person")
+def add_person(name: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
     name = name.strip()
     if not name:
         raise ValueError("Name cannot be empty.")
-    data = load_data()
-    ticket_id = data.get("next_id", 1)
-    entry = {
-        "id": ticket_id,
-        "name": name,
-        "joined_at": now_utc_iso(),
-    }
-    data.setdefault("queue", []).append(entry)
-    data["next_id"] = ticket_id + 1
-    save_data(data)
-    return entry
-
-
-def call_next() -> Optional[Dict[str, Any]]:
-    data = load_data()
-    queue: List[Dict[str, Any]] = data.get("queue", [])
-    if not queue:
-        return None
-    person = queue.pop(0)
-    person_called = dict(person)
-    person_called["called_at"] = now_utc_iso()
-    data.setdefault("history", []).append(person_called)
-    data["queue"] = queue
-    save_data(data)
-    return person_called
+    queue = queue.strip() or DEFAULT_QUEUE
+    entry = get_store().add(name, now_utc_iso(), queue, lane.strip() or DEFAULT_LANE)
+    return dict(entry)
 
 
-def get_position(ticket_id: int) -> Optional[int]:
-    data = load_data()
-    for idx, p in enumerate(data.get("queue", []), start=1):
-        if p["id"] == ticket_id:
-            return idx
-    return None
-
-
-def view_queue() -> None:
-    data = load_data()
-    queue: List[Dict[str, Any]] = data.get("queue", [])
-    count = len(queue)
-    print("")
-    print(f"Total waiting: {count}")
-    if count == 0:
-        print("Queue is empty.")
+def _add_batches(people: Iterable[Union[str, Dict[str, Any]]], queue: str, lane: str,
+                 batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    # Each batch is one store transaction: all of it is added or none.
+    people = iter(people)
+    store = get_store()
+    while True:
+        chunk = list(islice(people, batch_size))
+        if not chunk:
+            return
+        batch: List[Tuple[str, str, str, str]] = []
+        at = now_utc_iso()
+        for item in chunk:
+            if isinstance(item, str):
+                item = {"name": item}
+            name = (item.get("name") or "").strip()
+            if not name:
+                raise ValueError("Name cannot be empty.")
+            batch.append((
+                name, at, (item.get("queue") or "").strip() or queue, (item.get("lane") or "").strip() or lane,
+            ))
+        yield store.add_many(batch)
+
+
+@instrument("add_people")
+def add_people(people: Iterable[Union[str, Dict[str, Any]]], queue: str = DEFAULT_QUEUE,
+               lane: str = DEFAULT_LANE, batch_size: int = BATCH_SIZE) -> List[Dict[str, Any]]:
+    # Names, or dicts with name and optional queue/lane, added batch_size at a time.
+    added: List[Dict[str, Any]] = []
+    for batch in _add_batches(people, queue.strip() or DEFAULT_QUEUE, lane.strip() or DEFAULT_LANE, batch_size):
+        added.extend(dict(entry) for entry in batch)
+    return added
+
+
+@instrument("call_next")
+def call_next(queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+    person = get_store().call(now_utc_iso(), queue)
+    return dict(person) if person else None
+
+
+@instrument("call_next_n")
+def call_next_n(n: int, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+    # Up to n people, in call order, called in one transaction.
+    return [dict(person) for person in get_store().call_many(n, now_utc_iso(), queue)]
+
+
+@instrument("claim_next")
+def claim_next(agent_id: str, lease_seconds: float = LEASE_SECONDS,
+               queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+    # Like call_next, but the ticket stays leased to agent_id until complete
+    # or no_show; unfinished after lease_seconds, it goes back to the front.
+    agent_id = agent_id.strip()
+    if not agent_id:
+        raise ValueError("Agent id cannot be empty.")
+    person = get_store().claim(agent_id, now_utc_iso(), lease_seconds, queue)
+    return dict(person) if person else None
+
+
+@instrument("complete")
+def complete(ticket_id: int, agent_id: str) -> Optional[Dict[str, Any]]:
+    # None unless agent_id still holds the lease.
+    person = get_store().complete(ticket_id, agent_id.strip(), now_utc_iso())
+    return dict(person) if person else None
+
+
+@instrument("no_show")
+def no_show(ticket_id: int, agent_id: str) -> Optional[Dict[str, Any]]:
+    person = get_store().no_show(ticket_id, agent_id.strip(), now_utc_iso())
+    return dict(person) if person else None
+
+
+@instrument("cancel_ticket")
+def cancel_ticket(ticket_id: int) -> Optional[Dict[str, Any]]:
+    # Takes a waiting ticket out of the line; None if it is not waiting.
+    person = get_store().cancel(ticket_id, now_utc_iso())
+    return dict(person) if person else None
+
+
+@instrument("requeue_ticket")
+def requeue_ticket(ticket_id: int, position: int) -> Optional[Dict[str, Any]]:
+    # Moves a waiting ticket to position (1 = next) of its queue. It keeps
+    # its lane, so with several lanes it lands where its lane reaches first.
+    if position < 1:
+        raise ValueError("Position must be at least 1.")
+    person = get_store().requeue(ticket_id, position, now_utc_iso())
+    return dict(person) if person else None
+
+
+@instrument("expire_waiting")
+def expire_waiting(max_wait: float = NO_SHOW_AFTER) -> List[Dict[str, Any]]:
+    # Cancels everyone still waiting who joined more than max_wait seconds
+    # ago, in one write; returns them. 0 expires nobody.
+    if max_wait <= 0:
+        return []
+    now = datetime.now(timezone.utc)
+    return [dict(person) for person in get_store().expire(now.timestamp() - max_wait, now.isoformat())]
+
+
+def _is_jsonl(path: str) -> bool:
+    return path.lower().endswith((".jsonl", ".ndjson"))
+
+
+def _read_people(f: Any, jsonl: bool) -> Iterator[Union[str, Dict[str, Any]]]:
+    if jsonl:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+        return
+    rows = csv.reader(f)
+    header = next(rows, None)
+    if header is None:
         return
+    columns = [column.strip().lower() for column in header]
+    if "name" not in columns:
+        # No header row: the first column is the name.
+        yield header[0] if header else ""
+        for row in rows:
+            if row:
+                yield row[0]
+        return
+    for row in rows:
+        if row:
+            yield dict(zip(columns, row))
+
+
+@instrument("import_people")
+def import_people(path: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE,
+                  batch_size: int = BATCH_SIZE) -> int:
+    # Streams a CSV (a "name" column, optional "queue"/"lane"; or just names)
+    # or JSONL file (names or objects) into the queue; returns the count.
+    # A bad row stops the import; batches before it stay added.
+    count = 0
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        people = _read_people(f, _is_jsonl(path))
+        for batch in _add_batches(people, queue.strip() or DEFAULT_QUEUE, lane.strip() or DEFAULT_LANE, batch_size):
+            count += len(batch)
+    return count
+
+
+@instrument("export_queue")
+def export_queue(path: str, queue: Optional[str] = None) -> int:
+    # Writes waiting tickets in call order, one queue after another, as CSV
+    # or JSONL by the file extension; returns the count.
+    store = get_store()
+    names = [queue] if queue else sorted(store.queues())
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        jsonl = _is_jsonl(path)
+        if not jsonl:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_FIELDS)
+        for name in names:
+            for person in store.iter_waiting(name):
+                if jsonl:
+                    f.write(json.dumps(person, separators=(",", ":"), default=Ticket.to_dict) + "\n")
+                else:
+                    writer.writerow((
+                        person["id"], person["name"], queue_of(person), lane_of(person),
+                        person.get("number", ""), person["joined_at"],
+                    ))
+                count += 1
+    return count
+
+
+@instrument("get_position")
+def get_position(ticket_id: int) -> Optional[int]:
+    # Position within the ticket's own queue, lanes taken into account.
+    return get_store().position(ticket_id)
+
 
-    # Show next two up front
-    print("Next up:")
-    first = queue[0]
-    print(f"  1) #{first['id']} - {first['name']} (joined {format_local(first['joined_at'])})")
-    if count >= 2:
-        second = queue[1]
-        print(f"  2) #{second['id']} - {second['name']} (joined {format_local(second['joined_at'])})")
+@instrument("get_eta")
+def get_eta(ticket_id: int) -> Optional[float]:
+    # Estimated seconds until this ticket is called; None if not waiting or no calls yet.
+    store = get_store()
+    waiting = [r for r in store.find_id(ticket_id) if r["status"] == "waiting"]
+    if not waiting:
+        return None
+    return store.service_rate(queue_of(waiting[0])).eta(store.position(ticket_id))
 
-    # Full list
-    print("")
-    print("Full waiting list:")
-    for idx, person in enumerate(queue, start=1):
-        print(f"  {idx:>3}. #{person['id']:<4} {person['name']:<20} joined {format_local(person['joined_at'])}")
 
+def service_stats(queue: str = DEFAULT_QUEUE) -> Dict[str, Any]:
+    return get_store().service_rate(queue).stats()
+
+
+def subscribe(callback: Callable[[Dict[str, Any]], None], queue: Optional[str] = None) -> Callable[[], None]:
+    # One event per change (add, call, cancel, ...) with the position deltas (see queue_events);
+    # returns a function that unsubscribes.
+    return get_store().subscribe(callback, queue)
+
+
+def list_queues() -> Dict[str, int]:
+    # Queues with anyone waiting, and how many.
+    return get_store().queues()
 
-def find_person(query: str) -> List[Dict[str, Any]]:
-    data = load_data()
-    queue: List[Dict[str, Any]] = data.get("queue", [])
-    history: List[Dict[str, Any]] = data.get("history", [])
 
-    results: List[Dict[str, Any]] = []
+def ticket_label(person: Dict[str, Any]) -> str:
+    label = f"{queue_of(person)}-{person['number']}" if "number" in person else f"#{person['id']}"
+    if lane_of(person) != DEFAULT_LANE:
+        label += f" [{lane_of(person)}]"
+    return label
 
+
+def format_eta(seconds: Optional[float]) -> str:
+    return "unknown" if seconds is None else f"~{format_wait(seconds)}"
+
+
+def format_joined(person: Dict[str, Any]) -> str:
+    # A Ticket has its join time as epoch microseconds: skip the ISO text.
+    if isinstance(person, Ticket) and not (person.extra and "joined_at" in person.extra):
+        return _format_epoch(person.joined // 1000000)
+    return format_local(person["joined_at"])
+
+
+@instrument("render_queue")
+def render_queue(queue_name: str = DEFAULT_QUEUE, start: int = 0, limit: Optional[int] = None,
+                 mark: Optional[int] = None) -> str:
+    # The waiting list as one string: the next two up, then rows start+1 to
+    # start+limit (all of them if limit is None), ticket mark flagged.
+    store = get_store()
+    count = store.queues().get(queue_name, 0)
+    rate = store.service_rate(queue_name)
+    lines = [""]
+    if queue_name != DEFAULT_QUEUE:
+        lines.append(f"Queue: {queue_name}")
+    lines.append(f"Total waiting: {count}")
+    if count == 0:
+        lines.append("Queue is empty.")
+        return "\n".join(lines) + "\n"
+
+    head = list(store.iter_waiting(queue_name, 0, 2))
+    lines.append("Next up:")
+    for idx, person in enumerate(head, start=1):
+        lines.append(
+            f"  {idx}) {ticket_label(person)} - {person['name']} (joined {format_joined(person)},"
+            f" ETA {format_eta(rate.eta(idx))})"
+        )
+
+    lines.append("")
+    lines.append("Full waiting list:" if limit is None and not start else "Waiting list:")
+    rows = store.iter_waiting(queue_name, start, None if limit is None else start + limit)
+    shown = 0
+    for idx, person in enumerate(rows, start=start + 1):
+        flag = ">" if person["id"] == mark else " "
+        lines.append(
+            f" {flag}{idx:>3}. {ticket_label(person):<18} {person['name']:<20} joined {format_joined(person)}"
+            f"  ETA {format_eta(rate.eta(idx))}"
+        )
+        shown += 1
+    if limit is not None or start:
+        lines.append(f"Showing {start + 1}-{start + shown} of {count}." if shown else f"Nothing past {count}.")
+    return "\n".join(lines) + "\n"
+
+
+def page_count(queue_name: str = DEFAULT_QUEUE, page_size: int = PAGE_SIZE) -> int:
+    return max(1, -(-get_store().queues().get(queue_name, 0) // page_size))
+
+
+def view_queue(queue_name: str = DEFAULT_QUEUE, page: Optional[int] = None, page_size: int = PAGE_SIZE,
+               around: Optional[int] = None, top: Optional[int] = None) -> None:
+    # Everything by default; or the first top rows, one page (from 1), or a
+    # page-sized window centred on ticket around. Written out in one go.
+    start, limit = 0, None
+    if top is not None:
+        limit = top
+    elif around is not None:
+        waiting = [r for r in get_store().find_id(around) if r["status"] == "waiting"]
+        if not waiting or queue_of(waiting[0]) != queue_name:
+            print(f"Ticket #{around} is not waiting in queue {queue_name}.")
+            return
+        start, limit = max(0, get_position(around) - 1 - page_size // 2), page_size
+    elif page is not None:
+        start, limit = (max(page, 1) - 1) * page_size, page_size
+    sys.stdout.write(render_queue(queue_name, start, limit, mark=around))
+    sys.stdout.flush()
+
+
+@instrument("find_person")
+def find_person(query: str) -> List[Dict[str, Any]]:
+    store = get_store()
     if query.isdigit():
-        tid = int(query)
-        for p in queue:
-            if p["id"] == tid:
-                results.append({"status": "waiting", **p})
-        for p in history:
-            if p["id"] == tid:
-                results.append({"status": "called", **p})
-    else:
-        ql = query.strip().lower()
-        for p in queue:
-            if p["name"].lower() == ql:
-                results.append({"status": "waiting", **p})
-        for p in history:
-            if p["name"].lower() == ql:
-                results.append({"status": "called", **p})
+        return store.find_id(int(query))
+    return store.find_name(query.strip())
+
+
+@instrument("search_person")
+def search_person(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    # Exact, then prefix, then typo-tolerant matches; each result carries match and score.
+    return get_store().search(query.strip(), limit)
+
+
+@instrument("history_between")
+def history_between(start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+    # ISO timestamps, end exclusive; naive ones are local time, None is open-ended.
+    return get_store().called_between(*parse_window(start, end))
+
+
+@instrument("wait_stats")
+def wait_stats(start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+    # count, mean, p50, p95 and max of called_at - joined_at, in seconds
+    return get_store().wait_stats(*parse_window(start, end))
+
+
+def operation_stats() -> Dict[str, Dict[str, Any]]:
+    # Per operation: calls, errors, latency (mean, p50/p90/p99/p999, max,
+    # in microseconds) and bytes read/written, since start or reset.
+    return queue_metrics.stats()
+
+
+def export_metrics(path: Optional[str] = None) -> str:
+    # Operation metrics in Prometheus text format; returns the file written.
+    path = path or METRICS_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    queue_metrics.write_prometheus(path)
+    return path
+
+
+def format_micros(us: Optional[float]) -> str:
+    if us is None:
+        return "-"
+    if us >= 1000000:
+        return f"{us / 1000000:.2f}s"
+    if us >= 1000:
+        return f"{us / 1000:.1f}ms"
+    return f"{us:.1f}us"
+
+
+def format_bytes(count: int) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if count < 1024:
+            return f"{count:.0f}{unit}" if unit == "B" else f"{count:.1f}{unit}"
+        count /= 1024
+    return f"{count:.1f}GiB"
+
+
+def print_operation_stats(stats: Dict[str, Dict[str, Any]]) -> None:
+    if not stats:
+        print("No operations recorded." if queue_metrics.enabled else "Metrics are off (QUEUE_APP_METRICS=0).")
+        return
+    print(f"{'operation':<16} {'calls':>8} {'errors':>6} {'mean':>8} {'p50':>8} {'p99':>8} {'max':>8}"
+          f" {'read':>9} {'written':>9}")
+    for name, op in stats.items():
+        print(
+            f"{name:<16} {op['calls']:>8} {op['errors']:>6} {format_micros(op['mean_us']):>8}"
+            f" {format_micros(op['p50_us']):>8} {format_micros(op['p99_us']):>8} {format_micros(op['max_us']):>8}"
+            f" {format_bytes(op['bytes_read']):>9} {format_bytes(op['bytes_written']):>9}"
+        )
 
-    return results
+
+def format_wait(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    minutes, secs = divmod(int(round(seconds)), 60)
+    return f"{minutes}m {secs:02d}s"
+
+
+def print_wait_stats(stats: Dict[str, Any]) -> None:
+    print(f"Called: {stats['count']}")
+    if stats["count"]:
+        print(
+            f"Wait: mean {format_wait(stats['mean'])}, median {format_wait(stats['p50'])},"
+            f" p95 {format_wait(stats['p95'])}, max {format_wait(stats['max'])}"
+        )
 
 
 def print_person_results(results: List[Dict[str, Any]]) -> None:
     if not results:
         print("No matching person found.")
         return
-    data = load_data()
-    queue_ids = [p["id"] for p in data.get("queue", [])]
+    store = get_store()
 
     for r in results:
         status = r.get("status", "?")
         tid = r["id"]
         name = r["name"]
         if status == "waiting":
-            pos = queue_ids.index(tid) + 1 if tid in queue_ids else None
+            pos = store.position(tid)
             joined = format_local(r["joined_at"]) if r.get("joined_at") else "?"
-            print(f"Waiting: #{tid} - {name} at position {pos}. Joined {joined}.")
+            eta = format_eta(store.service_rate(queue_of(r)).eta(pos))
+            print(f"Waiting: {ticket_label(r)} - {name} at position {pos}, ETA {eta}. Joined {joined}.")
+        elif status == "leased":
+            called = format_local(r["called_at"]) if r.get("called_at") else "?"
+            print(f"Being served: {ticket_label(r)} - {name} by {r['agent']}. Called {called}.")
         elif status == "called":
             joined = format_local(r["joined_at"]) if r.get("joined_at") else "?"
             called = format_local(r["called_at"]) if r.get("called_at") else "?"
-            print(f"Already called: #{tid} - {name}. Joined {joined}. Called {called}.")
+            outcome = " (no show)" if r.get("outcome") == "no_show" else ""
+            print(f"Already called: {ticket_label(r)} - {name}{outcome}. Joined {joined}. Called {called}.")
         else:
             print(f"#{tid} - {name} (status unknown)")
 
@@ -161,19 +520,28 @@ def reset_all(confirm: bool = False) -> None:
     if not confirm:
         print("Reset cancelled.")
         return
-    save_data({"next_id": 1, "queue": [], "history": []})
+    get_store().reset()
     print("All data cleared.")
 
 
 def menu() -> None:
+    current = DEFAULT_QUEUE
     while True:
         print("")
         print("==== Name Tally / Queue App ====")
+        if current != DEFAULT_QUEUE:
+            print(f"(queue: {current})")
         print("1) Add new person")
         print("2) View waiting list")
         print("3) Call next person")
         print("4) Find a person (by name or ticket #)")
         print("5) Reset all data")
+        print("6) Call history and wait times")
+        print("7) Service rate")
+        print("8) Switch queue")
+        print("9) Serve at a desk")
+        print("c) Cancel or move a ticket")
+        print("s) Operation stats")
         print("0) Exit")
         choice = input("Select an option: ").strip()
 
@@ -182,29 +550,128 @@ def menu() -> None:
             if not name:
                 print("Name cannot be empty.")
                 continue
+            lane = DEFAULT_LANE
+            if len(LANES) > 1:
+                lane = input(f"Lane ({'/'.join(LANES)}, blank = {DEFAULT_LANE}): ").strip() or DEFAULT_LANE
             try:
-                entry = add_person(name)
+                entry = add_person(name, current, lane)
                 pos = get_position(entry["id"]) or "?"
-                print(f"Added: #{entry['id']} - {entry['name']} at position {pos}.")
+                eta = format_eta(get_eta(entry["id"]))
+                print(f"Added: {ticket_label(entry)} - {entry['name']} at position {pos}, ETA {eta}.")
             except ValueError as e:
                 print(f"Error: {e}")
         elif choice == "2":
-            view_queue()
+            page, pages = 1, page_count(current)
+            view_queue(current, page=page)
+            while pages > 1:
+                nav = input(f"Page {page} of {pages}: (n)ext, (p)rev, page #, (t)icket #, blank = back: ").strip().lower()
+                if not nav:
+                    break
+                if nav.startswith("t"):
+                    ticket = nav[1:].strip() or input("Ticket #: ").strip()
+                    if ticket.isdigit():
+                        view_queue(current, around=int(ticket))
+                    continue
+                if nav.isdigit():
+                    page = int(nav)
+                elif nav.startswith("n"):
+                    page += 1
+                elif nav.startswith("p"):
+                    page -= 1
+                page, pages = min(max(page, 1), page_count(current)), page_count(current)
+                view_queue(current, page=page)
         elif choice == "3":
-            person = call_next()
+            person = call_next(current)
             if not person:
                 print("Queue is empty. No one to call.")
             else:
                 print("")
                 print("Calling next:")
-                print(f"  #{person['id']} - {person['name']}")
+                print(f"  {ticket_label(person)} - {person['name']}")
         elif choice == "4":
             q = input("Enter name or ticket #: ").strip()
             results = find_person(q)
-            print_person_results(results)
+            if results or q.isdigit():
+                print_person_results(results)
+                continue
+            suggestions = search_person(q, limit=5)
+            if not suggestions:
+                print_person_results([])
+                continue
+            print("No exact match. Did you mean:")
+            print_person_results(suggestions)
         elif choice == "5":
             confirm = input("Type YES to confirm reset: ").strip()
             reset_all(confirm == "YES")
+        elif choice == "6":
+            start = input("From (YYYY-MM-DD HH:MM, blank = one hour ago): ").strip()
+            end = input("Until (YYYY-MM-DD HH:MM, blank = now): ").strip()
+            try:
+                start = start or (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+                called = history_between(start, end or None)
+                stats = wait_stats(start, end or None)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
+            print("")
+            for person in called[-20:]:
+                print(f"  {ticket_label(person):<18} {person['name']:<20} called {format_local(person['called_at'])}")
+            if len(called) > 20:
+                print(f"  ... and {len(called) - 20} earlier")
+            print_wait_stats(stats)
+        elif choice == "7":
+            stats = service_stats(current)
+            print(f"Calls observed: {stats['calls']}")
+            print(
+                f"Service time: mean {format_wait(stats['service_mean'])},"
+                f" median {format_wait(stats['service_p50'])}, p95 {format_wait(stats['service_p95'])}"
+            )
+            if stats["calls_per_hour"]:
+                print(f"Rate: {stats['calls_per_hour']:.1f} calls/hour")
+        elif choice == "8":
+            for name, count in sorted(list_queues().items()):
+                print(f"  {name:<20} {count} waiting")
+            current = input(f"Queue name (blank = {DEFAULT_QUEUE}): ").strip() or DEFAULT_QUEUE
+        elif choice == "9":
+            agent = input("Desk / agent name: ").strip()
+            if not agent:
+                print("Agent name cannot be empty.")
+                continue
+            person = claim_next(agent, queue=current)
+            if not person:
+                print("Queue is empty. No one to call.")
+                continue
+            print(f"Calling {ticket_label(person)} - {person['name']} to {agent}.")
+            outcome = input("(d)one or (n)o show [d]: ").strip().lower()
+            finish = no_show if outcome.startswith("n") else complete
+            if finish(person["id"], agent) is None:
+                print("The lease ran out and the ticket was handed to someone else.")
+        elif choice.lower() == "c":
+            ticket = input("Ticket #: ").strip()
+            if not ticket.isdigit():
+                print("Enter a ticket number.")
+                continue
+            move_to = input("New position (blank = cancel the ticket): ").strip()
+            if not move_to:
+                person = cancel_ticket(int(ticket))
+                if person:
+                    print(f"Cancelled: {ticket_label(person)} - {person['name']}.")
+            elif move_to.isdigit() and int(move_to) >= 1:
+                person = requeue_ticket(int(ticket), int(move_to))
+                if person:
+                    print(f"Moved {ticket_label(person)} - {person['name']} to position {get_position(person['id'])}.")
+            else:
+                print("Position must be a number from 1.")
+                continue
+            if not person:
+                print(f"Ticket #{ticket} is not waiting.")
+        elif choice.lower() == "s":
+            print_operation_stats(operation_stats())
+            if queue_metrics.enabled:
+                try:
+                    print(f"Prometheus metrics written to {export_metrics()}.")
+                except OSError as e:
+                    print(f"Error: {e}")
         elif choice == "0":
             print("Exiting.")
             break
@@ -212,10 +679,75 @@ def menu() -> None:
             print("Invalid option. Please choose from the menu.")
 
 
-if __name__ == "__main__":
-    try:
+def main(argv: List[str]) -> None:
+    command = argv[0] if argv else "menu"
+    if command == "serve":
+        # python queue_app.py serve [host:port | unix:/path/to/socket]
+        from queue_server import run_server, DEFAULT_ADDRESS
+        run_server(argv[1] if len(argv) > 1 else DEFAULT_ADDRESS)
+    elif command == "menu":
         ensure_data_file()
         menu()
+    elif command == "view":
+        # python queue_app.py view [queue] [page N | top N | around TICKET]
+        args = argv[1:]
+        queue_name = args.pop(0) if len(args) % 2 else DEFAULT_QUEUE
+        options = dict(zip(args[::2], args[1::2]))
+        try:
+            view_queue(queue_name, **{k: int(v) for k, v in options.items() if k in ("page", "top", "around")})
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    elif command == "stats":
+        # python queue_app.py stats [address] [prometheus FILE]: a running server's operation metrics
+        from queue_server import QueueClient, DEFAULT_ADDRESS
+        args = argv[1:]
+        address = args.pop(0) if len(args) % 2 else DEFAULT_ADDRESS
+        options = dict(zip(args[::2], args[1::2]))
+        try:
+            with QueueClient(address) as client:
+                if "prometheus" in options:
+                    with open(options["prometheus"], "w", encoding="utf-8") as f:
+                        f.write(client.prometheus_text())
+                    print(f"Prometheus metrics written to {options['prometheus']}.")
+                else:
+                    print_operation_stats(client.operation_stats())
+        except OSError as e:
+            print(f"Error: no queue server at {address} ({e})")
+            sys.exit(1)
+    elif command == "expire":
+        # python queue_app.py expire [SECONDS]: cancel tickets waiting longer (cron-friendly)
+        try:
+            max_wait = float(argv[1]) if len(argv) > 1 else NO_SHOW_AFTER
+        except ValueError:
+            print(f"Error: not a number of seconds: {argv[1]!r}")
+            sys.exit(1)
+        print(f"Expired {len(expire_waiting(max_wait))} waiting tickets.")
+    elif command == "import" and len(argv) > 1:
+        # python queue_app.py import people.csv|people.jsonl [queue] [lane]
+        try:
+            count = import_people(argv[1], *argv[2:4])
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Imported {count} people.")
+    elif command == "export" and len(argv) > 1:
+        # python queue_app.py export queue.csv|queue.jsonl [queue]
+        count = export_queue(argv[1], argv[2] if len(argv) > 2 else None)
+        print(f"Exported {count} waiting tickets.")
+    else:
+        print(f"Unknown command: {command}")
+        print(
+            "Usage: python queue_app.py [menu | serve [address] | view [queue] [page N | top N | around TICKET]"
+            " | import FILE [queue [lane]] | export FILE [queue] | stats [address] [prometheus FILE]"
+            " | expire [SECONDS]]"
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main(sys.argv[1:])
     except KeyboardInterrupt:
         print("\nInterrupted. Exiting.")
         sys.exit(0)
@@ -0,0 +1,180 @@
+"""
+Queue Async - awaitable queue_app operations for asyncio services
+
+queue_app's functions block on file I/O (a log append, and its fsync, per
+change), so calling them from a coroutine stalls the whole event loop.
+AsyncQueueStore keeps that work on one worker thread instead:
+
+- Mutations go through a single writer task. Each time round it takes every
+  request queued since the last batch, which is whatever arrived while that
+  batch was being written. A run of adds becomes one add_many and a run of
+  calls on the same queue one call_many: one log write and one fsync for all
+  of them, however many coroutines asked.
+- Reads run on the same thread, between batches, so they never see half a
+  batch and need no locking of their own.
+
+    async with AsyncQueueStore() as store:
+        ticket = await store.add_person("Ann")
+        position = await store.get_position(ticket["id"])
+
+Results are the plain dicts queue_app returns. Names and lanes are checked
+before a request is queued, so a batch only fails as a whole when the store
+does (a full disk, say). A request whose await is cancelled still runs.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import queue_app
+from queue_index import DEFAULT_LANE, DEFAULT_QUEUE
+from queue_metrics import instrument
+
+# Requests one batch takes at most; any more wait for the next one.
+MAX_BATCH = queue_app.BATCH_SIZE
+
+# (kind, arguments, future): kind is "add", "call" or a queue_app function.
+Request = Tuple[Any, tuple, "asyncio.Future[Any]"]
+
+
+def _run_key(request: Request) -> Any:
+    # Requests that can share one store call: adds, and calls on one queue.
+    kind, args, _ = request
+    if kind == "add":
+        return kind
+    if kind == "call":
+        return kind, args[0]
+    return request
+
+
+class AsyncQueueStore:
+    def __init__(self, max_batch: int = MAX_BATCH) -> None:
+        self.max_batch = max_batch
+        # Batches written and the requests they carried.
+        self.batches = 0
+        self.requests = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional["asyncio.Queue[Request]"] = None
+        self._writer: Optional["asyncio.Task[None]"] = None
+
+    async def start(self) -> None:
+        if self._writer is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="queue-store")
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def close(self) -> None:
+        """Finish every queued mutation, then stop the writer and its thread."""
+        if self._writer is None:
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+        self._writer = self._queue = self._executor = None
+
+    async def __aenter__(self) -> "AsyncQueueStore":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    # ---- the writer ----
+
+    async def _submit(self, kind: Any, *args: Any) -> Any:
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((kind, args, future))
+        return await future
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                outcomes = await loop.run_in_executor(self._executor, self._write, batch)
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, _, future), (ok, value) in zip(batch, outcomes):
+                if not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                queue.task_done()
+
+    @instrument("async_batch")
+    def _write(self, batch: List[Request]) -> List[Tuple[bool, Any]]:
+        # On the worker thread: (succeeded, result or exception) per request.
+        store = queue_app.get_store()
+        at = queue_app.now_utc_iso()
+        outcomes: List[Tuple[bool, Any]] = []
+        for key, run in groupby(batch, key=_run_key):
+            run = list(run)
+            try:
+                if key == "add":
+                    added = store.add_many([(name, at, queue, lane) for _, (name, queue, lane), _ in run])
+                    results: List[Any] = [dict(entry) for entry in added]
+                elif key[0] == "call":
+                    called = [dict(person) for person in store.call_many(len(run), at, key[1])]
+                    results = called + [None] * (len(run) - len(called))
+                else:
+                    func, args, _ = run[0]
+                    results = [func(*args)]
+                outcomes += [(True, result) for result in results]
+            except Exception as e:
+                outcomes += [(False, e)] * len(run)
+        return outcomes
+
+    # ---- mutations ----
+
+    async def add_person(self, name: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
+        name = name.strip()
+        if not name:
+            raise ValueError("Name cannot be empty.")
+        lane = lane.strip() or DEFAULT_LANE
+        if lane not in queue_app.LANES:
+            raise ValueError(f"Unknown lane: {lane!r} (lanes: {', '.join(queue_app.LANES)})")
+        return await self._submit("add", name, queue.strip() or DEFAULT_QUEUE, lane)
+
+    async def call_next(self, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        return await self._submit("call", queue)
+
+    async def cancel_ticket(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        return await self._submit(queue_app.cancel_ticket, ticket_id)
+
+    async def requeue_ticket(self, ticket_id: int, position: int) -> Optional[Dict[str, Any]]:
+        if position < 1:
+            raise ValueError("Position must be at least 1.")
+        return await self._submit(queue_app.requeue_ticket, ticket_id, position)
+
+    # ---- reads ----
+
+    async def _read(self, func: Callable[..., Any], *args: Any) -> Any:
+        await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def find_person(self, query: str) -> List[Dict[str, Any]]:
+        return await self._read(queue_app.find_person, query)
+
+    async def search_person(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return await self._read(queue_app.search_person, query, limit)
+
+    async def get_position(self, ticket_id: int) -> Optional[int]:
+        return await self._read(queue_app.get_position, ticket_id)
+
+    async def get_eta(self, ticket_id: int) -> Optional[float]:
+        return await self._read(queue_app.get_eta, ticket_id)
+
+    async def list_queues(self) -> Dict[str, int]:
+        return await self._read(queue_app.list_queues)
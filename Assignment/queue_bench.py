@@ -0,0 +1,1388 @@
+"""
+Queue Benchmarks - timing for queue_app storage
+
+Run: python queue_bench.py writes [history sizes...]
+     python queue_bench.py queue [waiting sizes...]
+     python queue_bench.py server [client counts...]
+     python queue_bench.py async [coroutine client counts...]
+     python queue_bench.py stress [processes] [tickets per process]
+     python queue_bench.py history [history sizes...]
+     python queue_bench.py names [history sizes...]
+     python queue_bench.py range [history sizes...]
+     python queue_bench.py lanes [queue counts...]
+     python queue_bench.py removal [waiting sizes...]
+     python queue_bench.py fanout [subscriber counts...]
+     python queue_bench.py claims [agents] [tickets]
+     python queue_bench.py records [waiting sizes...]
+     python queue_bench.py batch [row counts...]
+     python queue_bench.py render [waiting sizes...]
+     python queue_bench.py recovery [history sizes...]
+     python queue_bench.py metrics [call counts...]
+     python queue_bench.py suite [store sizes...] [save FILE] [baseline FILE]
+     python queue_bench.py diff BASELINE.json RESULTS.json
+
+suite seeds a store (QUEUE_APP_BACKEND) with that many waiting tickets and
+as many archived ones, in a fresh process per size, and times each public
+queue_app operation: ops/sec, p50/p99 latency and peak RSS. Results are
+saved as JSON (suite-<time>.json unless a file is named); against a
+baseline, anything more than REGRESSION_TOLERANCE worse is flagged and the
+run exits 1. diff compares two saved runs the same way.
+"""
+
+import asyncio
+import contextlib
+import csv
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+import queue_app
+import queue_metrics
+from queue_async import AsyncQueueStore
+from queue_index import DEFAULT_LANE, DEFAULT_QUEUE, LANE_WEIGHTS, QueueSet, TicketQueue
+from queue_records import RecordFile, encode_records
+from queue_server import QueueClient
+from queue_stats import summarize_waits, to_epoch
+from queue_sqlite import SQLiteStore
+from queue_store import LogStore
+
+STAMP = "2026-01-01T09:00:00+00:00"
+# Seconds a store may take to come back after a crash (recovery mode).
+RECOVERY_TARGET = 5.0
+# Nanoseconds measuring may add to one operation (metrics mode).
+METRICS_TARGET = 1000
+# Calls timed per operation and store size (suite mode); load_data copies
+# the whole store, so it gets a handful.
+SUITE_CALLS = {
+    "add_person": 2000, "call_next": 2000, "get_position": 5000,
+    "find_person": 500, "view_queue": 200, "load_data": 3,
+}
+# Worse than the baseline by more than this share: a regression.
+REGRESSION_TOLERANCE = 0.25
+# Compared metrics, and whether a bigger value is better.
+SUITE_METRICS = (("ops_per_sec", True), ("p99_us", False), ("peak_rss_mb", False))
+
+
+def seed_snapshot(data_dir: str, history_size: int) -> None:
+    history = [
+        {"id": i, "name": f"person{i}", "joined_at": STAMP, "called_at": STAMP}
+        for i in range(1, history_size + 1)
+    ]
+    data = {"next_id": history_size + 1, "queue": [], "history": history}
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, "queue.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def legacy_add(path: str, name: str) -> None:
+    # The original queue_app write path: load everything, rewrite everything.
+    with open(path, "r", encoding="utf-8") as f:
+        data: Dict[str, Any] = json.load(f)
+    ticket_id = data.get("next_id", 1)
+    data.setdefault("queue", []).append({"id": ticket_id, "name": name, "joined_at": STAMP})
+    data["next_id"] = ticket_id + 1
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def bench_writes(history_size: int, ops: int = 200) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_snapshot(tmp, history_size)
+        path = os.path.join(tmp, "queue.json")
+        start = time.perf_counter()
+        for i in range(ops):
+            legacy_add(path, f"legacy{i}")
+        legacy = (time.perf_counter() - start) / ops
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_snapshot(tmp, history_size)
+        store = LogStore(tmp)
+        start = time.perf_counter()
+        store.open()
+        startup = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(ops):
+            store.add(f"log{i}", STAMP)
+        logged = (time.perf_counter() - start) / ops
+        store.close()
+
+        start = time.perf_counter()
+        store = LogStore(tmp)
+        store.open()
+        replay = time.perf_counter() - start
+        store.close()
+
+    return {
+        "history": history_size,
+        "legacy_us": legacy * 1e6,
+        "log_us": logged * 1e6,
+        "startup_ms": startup * 1e3,
+        "replay_ms": replay * 1e3,
+    }
+
+
+def bench_queue(waiting: int, ops: int = 1000) -> Dict[str, float]:
+    entries = [{"id": i, "name": f"person{i}", "joined_at": STAMP} for i in range(1, waiting + 1)]
+    probes = [1 + (i * 7919) % waiting for i in range(ops)]
+
+    legacy = list(entries)
+    start = time.perf_counter()
+    for tid in probes:
+        next(idx for idx, p in enumerate(legacy, start=1) if p["id"] == tid)
+    legacy_pos = (time.perf_counter() - start) / ops
+    start = time.perf_counter()
+    for _ in range(ops):
+        legacy.pop(0)
+    legacy_pop = (time.perf_counter() - start) / ops
+
+    queue = TicketQueue(entries)
+    start = time.perf_counter()
+    for tid in probes:
+        queue.position(tid)
+    indexed_pos = (time.perf_counter() - start) / ops
+    start = time.perf_counter()
+    for _ in range(ops):
+        queue.popleft()
+    indexed_pop = (time.perf_counter() - start) / ops
+
+    return {
+        "waiting": waiting,
+        "legacy_pos_us": legacy_pos * 1e6,
+        "legacy_pop_us": legacy_pop * 1e6,
+        "indexed_pos_us": indexed_pos * 1e6,
+        "indexed_pop_us": indexed_pop * 1e6,
+    }
+
+
+def _load_client(args: tuple) -> int:
+    address, ops, client_no = args
+    done = 0
+    with QueueClient(address) as client:
+        for i in range(ops):
+            kind = i % 4
+            if kind == 0:
+                client.add_person(f"client{client_no}-{i}")
+            elif kind == 1:
+                client.get_position(1 + (i * 31 + client_no) % 1000)
+            elif kind == 2:
+                client.find_person(str(1 + (i * 17 + client_no) % 1000))
+            else:
+                client.call_next()
+            done += 1
+    return done
+
+
+def _start_server(data_dir: str, address: str) -> subprocess.Popen:
+    env = dict(os.environ, QUEUE_APP_DATA=data_dir)
+    here = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(here, "queue_app.py"), "serve", address],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            QueueClient(address).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return server
+
+
+def bench_server(clients: int, ops: int = 2000) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        address = "unix:" + os.path.join(tmp, "queue.sock")
+        server = _start_server(tmp, address)
+        try:
+            with multiprocessing.Pool(clients) as pool:
+                start = time.perf_counter()
+                total = sum(pool.map(_load_client, [(address, ops, n) for n in range(clients)]))
+                elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+    return {"clients": clients, "ops": total, "seconds": elapsed, "ops_per_sec": total / elapsed}
+
+
+async def _loop_stalls(stop: asyncio.Event, interval: float = 0.001) -> float:
+    # Longest the event loop went without running a 1 ms ticker, in seconds.
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def _drive_clients(clients: int, rounds: int, add: Callable, position: Callable,
+                         call: Callable) -> Dict[str, Any]:
+    # Each client: add, look up the position, call; rounds times between them.
+    latencies: List[float] = []
+
+    async def client(n: int) -> None:
+        for i in range(n, rounds, clients):
+            for step in range(3):
+                start = time.perf_counter()
+                if step == 0:
+                    ticket = await add(f"client{n}-{i}")
+                elif step == 1:
+                    await position(ticket["id"])
+                else:
+                    await call()
+                latencies.append(time.perf_counter() - start)
+
+    stop = asyncio.Event()
+    ticker = asyncio.ensure_future(_loop_stalls(stop))
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    latencies.sort()
+    return {
+        "ops_per_sec": len(latencies) / elapsed,
+        "p99_ms": latencies[max(math.ceil(0.99 * len(latencies)) - 1, 0)] * 1e3,
+        "stall_ms": await ticker * 1e3,
+    }
+
+
+def bench_async(clients: int, rounds: int = 3000) -> Dict[str, Any]:
+    async def inline_add(name: str) -> Dict[str, Any]:
+        return queue_app.add_person(name)
+
+    async def inline_position(ticket_id: int) -> Optional[int]:
+        return queue_app.get_position(ticket_id)
+
+    async def inline_call() -> Optional[Dict[str, Any]]:
+        return queue_app.call_next()
+
+    async def run() -> Dict[str, Any]:
+        inline = await _drive_clients(clients, rounds, inline_add, inline_position, inline_call)
+        async with AsyncQueueStore() as store:
+            batched = await _drive_clients(clients, rounds, store.add_person, store.get_position, store.call_next)
+            per_batch = store.requests / max(store.batches, 1)
+        return {"clients": clients, "inline": inline, "async": batched, "per_batch": per_batch}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        saved = queue_app.DATA_DIR
+        queue_app.DATA_DIR = tmp
+        try:
+            result = asyncio.run(run())
+            queue_app.get_store().close()
+        finally:
+            queue_app.DATA_DIR = saved
+    return result
+
+
+def bench_fanout(subscribers: int, changes: int = 200, waiting: int = 1000) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        address = "unix:" + os.path.join(tmp, "queue.sock")
+        server = _start_server(tmp, address)
+        try:
+            with QueueClient(address) as client:
+                for i in range(waiting):
+                    client.add_person(f"person{i}")
+
+                # Polling: every display asks for its position after each change.
+                start = time.perf_counter()
+                for i in range(subscribers):
+                    client.get_position(1 + i % waiting)
+                poll_ms = (time.perf_counter() - start) * 1e3
+
+                selector = selectors.DefaultSelector()
+                lines: Dict[socket.socket, int] = {}
+                for _ in range(subscribers):
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.connect(address[len("unix:"):])
+                    sock.sendall(b'{"op":"subscribe"}\n')
+                    selector.register(sock, selectors.EVENT_READ)
+                    lines[sock] = 0
+
+                def drain(target: int) -> None:
+                    # Events are line-delimited: read until every socket saw target lines.
+                    pending = {sock for sock, n in lines.items() if n < target}
+                    while pending:
+                        for key, _ in selector.select(timeout=10):
+                            sock = key.fileobj
+                            lines[sock] += sock.recv(1 << 16).count(b"\n")
+                            if lines[sock] >= target:
+                                pending.discard(sock)
+
+                drain(1)  # every subscription acknowledged
+                start = time.perf_counter()
+                for i in range(changes):
+                    if i % 2 == 0:
+                        client.add_person(f"new{i}")
+                    else:
+                        client.call_next()
+                drain(changes + 1)
+                elapsed = time.perf_counter() - start
+                for sock in lines:
+                    selector.unregister(sock)
+                    sock.close()
+        finally:
+            server.terminate()
+            server.wait()
+    return {
+        "subscribers": subscribers,
+        "poll_round_ms": poll_ms,
+        "event_round_ms": elapsed / changes * 1e3,
+        "deliveries_per_sec": subscribers * changes / elapsed,
+    }
+
+
+def _stress_worker(args: tuple) -> tuple:
+    data_dir, tickets, worker_no = args
+    store = LogStore(data_dir)
+    ids = [store.add(f"kiosk{worker_no}-{i}", STAMP)["id"] for i in range(tickets)]
+    fsyncs = store.fsync_count
+    store.close()
+    return ids, fsyncs
+
+
+def bench_stress(processes: int, tickets: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        LogStore(tmp).open()
+        with multiprocessing.Pool(processes) as pool:
+            start = time.perf_counter()
+            results = pool.map(_stress_worker, [(tmp, tickets, n) for n in range(processes)])
+            elapsed = time.perf_counter() - start
+        issued = [tid for ids, _ in results for tid in ids]
+        store = LogStore(tmp)
+        store.open()
+        stored = [p["id"] for p in store.waiting()]
+        store.close()
+    expected = processes * tickets
+    return {
+        "processes": processes,
+        "tickets": len(issued),
+        "duplicates": len(issued) - len(set(issued)),
+        "lost": expected - len(set(stored)),
+        "contiguous": sorted(issued) == list(range(1, expected + 1)) == stored,
+        "fsyncs": sum(f for _, f in results),
+        "seconds": elapsed,
+        "tickets_per_sec": len(issued) / elapsed,
+    }
+
+
+def _traced(build: Any) -> tuple:
+    tracemalloc.start()
+    value = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def bench_records(waiting: int, probes: int = 1000) -> Dict[str, float]:
+    entries = [
+        {"id": i, "name": f"person{i % 5000}", "joined_at": f"2026-01-01T09:{i // 60 % 60:02d}:{i % 60:02d}+00:00"}
+        for i in range(1, waiting + 1)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        # The JSON representation: queue.json as every release before wrote it.
+        legacy = os.path.join(tmp, "legacy")
+        os.makedirs(legacy)
+        with open(os.path.join(legacy, "queue.json"), "w", encoding="utf-8") as f:
+            json.dump({"next_id": waiting + 1, "queue": entries, "history": []}, f)
+        json_bytes = os.path.getsize(os.path.join(legacy, "queue.json"))
+        records_path = os.path.join(tmp, "queue.rec")
+        with open(records_path, "wb") as f:
+            f.write(encode_records(entries))
+        records_bytes = os.path.getsize(records_path)
+        del entries
+
+        start = time.perf_counter()
+        with open(os.path.join(legacy, "queue.json"), "r", encoding="utf-8") as f:
+            as_dicts = json.load(f)["queue"]
+        json_load = time.perf_counter() - start
+        start = time.perf_counter()
+        with RecordFile(records_path) as records:
+            as_tickets = records.load()
+        records_load = time.perf_counter() - start
+        del as_dicts, as_tickets
+
+        with open(os.path.join(legacy, "queue.json"), "r", encoding="utf-8") as f:
+            _, dict_mem = _traced(lambda: json.load(f)["queue"])
+        with RecordFile(records_path) as records:
+            _, ticket_mem = _traced(records.load)
+
+        with RecordFile(records_path) as records:
+            ids = [1 + (i * 7919) % waiting for i in range(probes)]
+            records.get(1)  # reads the string table
+            start = time.perf_counter()
+            for tid in ids:
+                records.get(tid)
+            lookup = (time.perf_counter() - start) / probes
+
+        # Whole-store startup, from the old snapshot and from a checkpoint.
+        start = time.perf_counter()
+        store = LogStore(legacy, fsync=False)
+        store.open()
+        store_json = time.perf_counter() - start
+        store.compact()
+        store.close()
+        start = time.perf_counter()
+        store = LogStore(legacy, fsync=False)
+        store.open()
+        store_records = time.perf_counter() - start
+        store.close()
+    return {
+        "waiting": waiting,
+        "dict_bytes": dict_mem / waiting,
+        "ticket_bytes": ticket_mem / waiting,
+        "json_file": json_bytes / waiting,
+        "records_file": records_bytes / waiting,
+        "json_load_ms": json_load * 1e3,
+        "records_load_ms": records_load * 1e3,
+        "store_json_ms": store_json * 1e3,
+        "store_records_ms": store_records * 1e3,
+        "lookup_us": lookup * 1e6,
+    }
+
+
+CLAIM_BACKENDS = {"json": LogStore, "sqlite": SQLiteStore}
+
+
+def _serve_desk(store: Any, agent: str) -> List[int]:
+    # One agent: claim, complete, repeat until the queue runs dry.
+    served = []
+    while True:
+        person = store.claim(agent, STAMP, 3600)
+        if person is None:
+            return served
+        served.append(person["id"])
+        store.complete(person["id"], agent, STAMP)
+
+
+def _desk_worker(args: tuple) -> List[int]:
+    backend, data_dir, agent = args
+    store = CLAIM_BACKENDS[backend](data_dir)
+    store.open()
+    served = _serve_desk(store, agent)
+    store.close()
+    return served
+
+
+def bench_claims(backend: str, agents: int, tickets: int, processes: bool) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CLAIM_BACKENDS[backend](tmp)
+        store.open()
+        for i in range(tickets):
+            store.add(f"person{i}", STAMP)
+        if processes:
+            store.close()
+            with multiprocessing.Pool(agents) as pool:
+                start = time.perf_counter()
+                results = pool.map(_desk_worker, [(backend, tmp, f"desk{n}") for n in range(agents)])
+                elapsed = time.perf_counter() - start
+        else:
+            results = [[] for _ in range(agents)]
+
+            def desk(n: int) -> None:
+                results[n] = _serve_desk(store, f"desk{n}")
+            threads = [threading.Thread(target=desk, args=(n,)) for n in range(agents)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            store.close()
+    served = [tid for ids in results for tid in ids]
+    return {
+        "backend": backend,
+        "mode": "processes" if processes else "threads",
+        "claims": len(served),
+        "duplicates": len(served) - len(set(served)),
+        "lost": tickets - len(set(served)),
+        "claims_per_sec": len(served) / elapsed,
+    }
+
+
+def bench_batch(backend: str, rows: int, sample: int = 1000) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        # One add, one transaction and one fsync at a time, on a sample.
+        store = CLAIM_BACKENDS[backend](os.path.join(tmp, "single"))
+        store.open()
+        count = min(rows, sample)
+        start = time.perf_counter()
+        for i in range(count):
+            store.add(f"person{i}", STAMP)
+        single = count / (time.perf_counter() - start)
+        store.close()
+
+        source = os.path.join(tmp, "people.csv")
+        with open(source, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("name", "lane"))
+            writer.writerows((f"person{i}", "vip" if i % 10 == 0 else "") for i in range(rows))
+        saved = queue_app.DATA_DIR, queue_app.BACKEND
+        queue_app.DATA_DIR, queue_app.BACKEND = os.path.join(tmp, "batch"), backend
+        try:
+            start = time.perf_counter()
+            queue_app.import_people(source)
+            imported = time.perf_counter() - start
+            start = time.perf_counter()
+            exported = queue_app.export_queue(os.path.join(tmp, "queue.jsonl"))
+            export = time.perf_counter() - start
+            called = 0
+            start = time.perf_counter()
+            while True:
+                batch = queue_app.call_next_n(queue_app.BATCH_SIZE)
+                if not batch:
+                    break
+                called += len(batch)
+            calls = time.perf_counter() - start
+            queue_app.get_store().close()
+        finally:
+            queue_app.DATA_DIR, queue_app.BACKEND = saved
+    if exported != rows or called != rows:
+        raise RuntimeError(f"{backend}: exported {exported}, called {called} of {rows}")
+    return {
+        "backend": backend,
+        "rows": rows,
+        "single_per_sec": single,
+        "import_per_sec": rows / imported,
+        "export_per_sec": rows / export,
+        "call_per_sec": rows / calls,
+    }
+
+
+def legacy_view(store: Any) -> None:
+    # The original view_queue: everything, a print and a fresh local-time
+    # conversion per row.
+    def format_local(dt_iso: str) -> str:
+        return datetime.fromisoformat(dt_iso).astimezone().strftime("%Y-%m-%d %H:%M:%S %Z")
+    queue = store.waiting()
+    rate = store.service_rate()
+    print(f"Total waiting: {len(queue)}")
+    for idx, person in enumerate(queue, start=1):
+        print(
+            f"  {idx:>3}. {queue_app.ticket_label(person):<18} {person['name']:<20} joined {format_local(person['joined_at'])}"
+            f"  ETA {queue_app.format_eta(rate.eta(idx))}"
+        )
+
+
+def bench_render(waiting: int, ops: int = 20) -> Dict[str, float]:
+    day0 = datetime(2026, 1, 1, 9, tzinfo=timezone.utc)
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        saved = queue_app.DATA_DIR
+        queue_app.DATA_DIR = tmp
+        try:
+            store = queue_app.get_store()
+            # One arrival a second, so timestamps are distinct.
+            for first in range(0, waiting, queue_app.BATCH_SIZE):
+                store.add_many(
+                    (f"person{i}", (day0 + timedelta(seconds=i)).isoformat(), "main", "normal")
+                    for i in range(first, min(first + queue_app.BATCH_SIZE, waiting))
+                )
+            timings = {}
+            views = {
+                "legacy": lambda: legacy_view(store),
+                "full": lambda: queue_app.view_queue(),
+                "page": lambda: queue_app.view_queue(page=2),
+                "top": lambda: queue_app.view_queue(top=10),
+                "around": lambda: queue_app.view_queue(around=waiting // 2),
+            }
+            with contextlib.redirect_stdout(devnull):
+                for name, view in views.items():
+                    runs = 1 if name in ("legacy", "full") else ops
+                    # Cold caches for the full list: every timestamp is new.
+                    queue_app._local_texts.clear()
+                    queue_app._local_minutes.clear()
+                    start = time.perf_counter()
+                    for _ in range(runs):
+                        view()
+                    timings[name] = (time.perf_counter() - start) / runs
+            store.close()
+        finally:
+            queue_app.DATA_DIR = saved
+    return {"waiting": waiting, **{f"{name}_ms": t * 1e3 for name, t in timings.items()}}
+
+
+def called_tickets(history_size: int, per_day: int = 20000) -> Iterator[Dict[str, Any]]:
+    day0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i in range(1, history_size + 1):
+        called = (day0 + timedelta(days=i // per_day, seconds=i % per_day)).isoformat()
+        yield {"id": i, "name": f"person{i % 50000}", "joined_at": called, "called_at": called}
+
+
+def seed_archive(data_dir: str, history_size: int, per_day: int = 20000) -> None:
+    store = LogStore(data_dir, fsync=False)
+    store.open()
+    batch = []
+    for person_called in called_tickets(history_size, per_day):
+        batch.append(person_called)
+        if len(batch) == per_day:
+            store.archive.archive(batch, 0)
+            batch = []
+    if batch:
+        store.archive.archive(batch, 0)
+    store.next_id = history_size + 1
+    store.compact()
+    store.close()
+
+
+def seed_history(history_size: int) -> None:
+    """history_size called tickets in queue_app's data directory, for its backend"""
+    if queue_app.BACKENDS.get(queue_app.BACKEND) is LogStore:
+        seed_archive(queue_app.DATA_DIR, history_size)
+    else:
+        queue_app.get_store().replace(
+            {"next_id": history_size + 1, "queue": [], "history": list(called_tickets(history_size))}
+        )
+
+
+def _crash_writer(data_dir: str) -> None:
+    store = LogStore(data_dir)
+    store.open()
+    i = 0
+    while True:
+        store.add(f"late{i}", STAMP)
+        i += 1
+
+
+def _timed_open(data_dir: str) -> tuple:
+    start = time.perf_counter()
+    store = LogStore(data_dir)
+    store.open()
+    elapsed = time.perf_counter() - start
+    found = (store.recovered_from, store._log_records, len(store.queue))
+    store.close()
+    return elapsed, found
+
+
+def bench_recovery(history_size: int, waiting: int = 10000) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_archive(tmp, history_size)
+        store = LogStore(tmp)
+        store.open()
+        store.add_many((f"person{i}", STAMP, "main", "normal") for i in range(waiting))
+        store.compact()
+        # The longest tail the compaction policy allows (the base record is
+        # one), in both the previous log and the current one.
+        tail = max(store.compact_every, waiting) - 2
+        for round in range(2):
+            if round:
+                store.compact()
+            store.add_many((f"tail{i}", STAMP, "main", "normal") for i in range(tail // 2))
+            store.call_many(tail - tail // 2, STAMP)
+        store.close()
+        results = {}
+        results["clean"] = _timed_open(tmp)
+        with open(store.log_path, "ab") as f:
+            f.write(b'{"op":"add","id":')
+        results["torn log"] = _timed_open(tmp)
+        with open(store.snapshot_path, "rb") as f:
+            intact = f.read()
+        with open(store.snapshot_path, "wb") as f:
+            f.write(intact[:len(intact) // 2])
+        results["bad checkpoint"] = _timed_open(tmp)
+        with open(store.snapshot_path, "wb") as f:
+            f.write(intact)
+        writer = multiprocessing.Process(target=_crash_writer, args=(tmp,))
+        writer.start()
+        time.sleep(0.5)
+        writer.kill()
+        writer.join()
+        results["killed writer"] = _timed_open(tmp)
+    return {"history": history_size, "waiting": waiting, "tail": tail, "results": results}
+
+
+def _per_call_ns(func: Any, calls: int, *args: Any) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        func(*args)
+    return (time.perf_counter_ns() - start) / calls
+
+
+def bench_metrics(calls: int, waiting: int = 1000) -> Dict[str, float]:
+    def plain(x: int) -> int:
+        return x
+
+    def timed(*args: Any, **kwargs: Any) -> Any:
+        # The least any Python-level timer can cost: two clock reads.
+        start = time.perf_counter_ns()
+        result = plain(*args, **kwargs)
+        time.perf_counter_ns() - start
+        return result
+    measured = queue_metrics.instrument("bench_noop")(plain)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir, queue_app.DATA_DIR = queue_app.DATA_DIR, tmp
+        enabled = queue_metrics.enabled
+        try:
+            queue_app.add_people(f"person{i}" for i in range(waiting))
+            ticket = waiting // 2
+            unmeasured = getattr(queue_app.get_position, "__wrapped__", queue_app.get_position)
+            runs = (
+                (False, "plain", plain, 1), (False, "timer", timed, 1), (False, "off", measured, 1),
+                (False, "position", unmeasured, ticket),
+                (True, "on", measured, 1), (True, "position on", queue_app.get_position, ticket),
+            )
+            # Best of five, the rounds interleaved so that a slow spell of the
+            # machine hits both sides of a difference rather than one.
+            results = {name: float("inf") for _, name, _, _ in runs}
+            for _ in range(5):
+                for on, name, func, arg in runs:
+                    queue_metrics.set_enabled(on)
+                    results[name] = min(results[name], _per_call_ns(func, calls, arg))
+        finally:
+            queue_metrics.set_enabled(enabled)
+            queue_app.get_store().close()
+            queue_app.DATA_DIR = data_dir
+    return results
+
+
+def _reset_peak_rss() -> None:
+    # Linux lets a process restart its high-water mark (VmHWM).
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss: kilobytes on Linux, bytes on macOS; it never goes down.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def _timed_calls(call: Callable[[int], Any], calls: int) -> Dict[str, Any]:
+    _reset_peak_rss()
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        call(i)
+        timings.append(time.perf_counter_ns() - start)
+    ordered = sorted(timings)
+
+    def rank(fraction: float) -> float:
+        # Nearest rank, as summarize_waits does.
+        return ordered[max(math.ceil(fraction * calls), 1) - 1] / 1000
+
+    return {
+        "calls": calls, "ops_per_sec": calls / (sum(timings) / 1e9),
+        "p50_us": rank(0.50), "p99_us": rank(0.99), "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def bench_suite(size: int, seed: int = 1) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        saved = queue_app.DATA_DIR
+        queue_app.DATA_DIR = tmp
+        try:
+            start = time.perf_counter()
+            seed_history(size)
+            store = queue_app.get_store()
+            for first in range(0, size, queue_app.BATCH_SIZE):
+                store.add_many(
+                    (f"waiting{i}", STAMP, "main", "normal")
+                    for i in range(first, min(first + queue_app.BATCH_SIZE, size))
+                )
+            seeded = time.perf_counter() - start
+            ops: Dict[str, Any] = {}
+            ops["add_person"] = _timed_calls(lambda i: queue_app.add_person(f"added{i}"), SUITE_CALLS["add_person"])
+            ops["call_next"] = _timed_calls(lambda i: queue_app.call_next(), SUITE_CALLS["call_next"])
+            # Probes spread over the whole waiting line, and over both
+            # called and waiting tickets for lookups.
+            step = max(1, size // 1000)
+            waiting = [p["id"] for p in islice(store.iter_waiting(), 0, None, step)]
+            positions = [rng.choice(waiting) for _ in range(SUITE_CALLS["get_position"])]
+            ops["get_position"] = _timed_calls(lambda i: queue_app.get_position(positions[i]),
+                                               len(positions))
+            queries = [
+                str(rng.randrange(1, size + 1)) if i % 3 == 0 else
+                f"person{rng.randrange(min(size, 50000))}" if i % 3 == 1 else
+                f"waiting{rng.randrange(size)}"
+                for i in range(SUITE_CALLS["find_person"])
+            ]
+            ops["find_person"] = _timed_calls(lambda i: queue_app.find_person(queries[i]), len(queries))
+            pages = queue_app.page_count()
+            with contextlib.redirect_stdout(devnull):
+                ops["view_queue"] = _timed_calls(
+                    lambda i: queue_app.view_queue(page=rng.randrange(1, pages + 1)), SUITE_CALLS["view_queue"],
+                )
+            ops["load_data"] = _timed_calls(lambda i: queue_app.load_data(), SUITE_CALLS["load_data"])
+            store.close()
+        finally:
+            queue_app.DATA_DIR = saved
+    return {"seed_s": seeded, "ops": ops}
+
+
+def run_suite(sizes: List[int]) -> Dict[str, Any]:
+    results: Dict[str, Any] = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "backend": queue_app.BACKEND, "calls": SUITE_CALLS, "sizes": {},
+    }
+    for size in sizes:
+        # A process per size: peak RSS and caches start from scratch.
+        with multiprocessing.Pool(1) as pool:
+            results["sizes"][str(size)] = pool.apply(bench_suite, (size,))
+    return results
+
+
+def diff_suites(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Metric changes between two suite runs; worse by more than the tolerance is a regression."""
+    rows = []
+    for size, result in current["sizes"].items():
+        base_ops = baseline.get("sizes", {}).get(size, {}).get("ops", {})
+        for op, stats in result["ops"].items():
+            for metric, higher_is_better in SUITE_METRICS:
+                old, new = base_ops.get(op, {}).get(metric), stats.get(metric)
+                if not old or new is None:
+                    continue
+                change = new / old - 1
+                worse = -change if higher_is_better else change
+                rows.append({
+                    "size": int(size), "op": op, "metric": metric, "baseline": old, "current": new,
+                    "change": change, "regression": worse > REGRESSION_TOLERANCE,
+                })
+    return rows
+
+
+def bench_history(history_size: int, ops: int = 200) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_archive(tmp, history_size)
+        tracemalloc.start()
+        start = time.perf_counter()
+        store = LogStore(tmp, fsync=False)
+        store.open()
+        open_ms = (time.perf_counter() - start) * 1e3
+        resident = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        for i in range(ops):
+            store.add(f"new{i}", STAMP)
+        add_us = (time.perf_counter() - start) / ops * 1e6
+        start = time.perf_counter()
+        for i in range(ops):
+            store.position(history_size + 1 + i)
+        pos_us = (time.perf_counter() - start) / ops * 1e6
+        probes = [1 + (i * 7919) % history_size for i in range(20)]
+        start = time.perf_counter()
+        for tid in probes:
+            store.find_id(tid)
+        find_id_ms = (time.perf_counter() - start) / len(probes) * 1e3
+        start = time.perf_counter()
+        for tid in probes:
+            store.find_name(f"person{tid % 50000}")
+        find_name_ms = (time.perf_counter() - start) / len(probes) * 1e3
+        store.close()
+    return {
+        "history": history_size, "open_ms": open_ms, "resident_kb": resident / 1024,
+        "add_us": add_us, "position_us": pos_us, "find_id_ms": find_id_ms, "find_name_ms": find_name_ms,
+    }
+
+
+def bench_names(history_size: int, ops: int = 50) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_archive(tmp, history_size)
+        store = LogStore(tmp, fsync=False)
+        store.open()
+        probes = [f"person{(i * 7919) % 50000}" for i in range(ops)]
+
+        # The original find_person: look at every stored ticket.
+        start = time.perf_counter()
+        key = probes[0]
+        [p for p in store.history() if p["name"].lower() == key]
+        scan_ms = (time.perf_counter() - start) * 1e3
+
+        start = time.perf_counter()
+        store.find_name(probes[0])
+        build_ms = (time.perf_counter() - start) * 1e3
+        timings = {}
+        for label, queries in (
+            ("exact", probes),
+            ("prefix", [p[:-2] for p in probes]),
+            ("fuzzy", [p[:3] + p[4:] for p in probes]),
+        ):
+            start = time.perf_counter()
+            for q in queries:
+                store.search(q)
+            timings[label] = (time.perf_counter() - start) / ops * 1e3
+        store.close()
+    return {"history": history_size, "scan_ms": scan_ms, "build_ms": build_ms, **timings}
+
+
+def bench_range(history_size: int, ops: int = 20) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_archive(tmp, history_size)
+        store = LogStore(tmp, fsync=False)
+        store.open()
+        day0 = to_epoch("2025-01-01T00:00:00+00:00")
+        days = max(history_size // 20000, 1)
+        hours = [day0 + (i * 7919) % (days * 86400 - 3600) for i in range(ops)]
+
+        # The original way: every history row, two ISO parses each.
+        start = time.perf_counter()
+        lo, hi = hours[0], hours[0] + 3600
+        summarize_waits(
+            to_epoch(p["called_at"]) - to_epoch(p["joined_at"])
+            for p in store.history() if lo <= to_epoch(p["called_at"]) < hi
+        )
+        scan_ms = (time.perf_counter() - start) * 1e3
+
+        timings = {}
+        for label, width in (("hour", 3600), ("day", 86400)):
+            start = time.perf_counter()
+            for at in hours:
+                store.wait_stats(at, at + width)
+            timings[f"{label}_ms"] = (time.perf_counter() - start) / ops * 1e3
+        start = time.perf_counter()
+        for at in hours:
+            store.called_between(at, at + 3600)
+        timings["rows_ms"] = (time.perf_counter() - start) / ops * 1e3
+        store.close()
+    return {"history": history_size, "scan_ms": scan_ms, **timings}
+
+
+def bench_lanes(queues: int, tickets: int = 100000, ops: int = 2000) -> Dict[str, float]:
+    lanes = list(LANE_WEIGHTS)
+    entries = [
+        {"id": i, "name": f"person{i}", "joined_at": STAMP, "queue": f"desk{i % queues}", "lane": lanes[i % len(lanes)]}
+        for i in range(1, tickets + 1)
+    ]
+    targets = [f"desk{(i * 7919) % queues}" for i in range(ops)]
+
+    # A single list scanned for the best lane of the wanted queue.
+    legacy = list(entries)
+    rank = {lane: n for n, lane in enumerate(lanes)}
+    start = time.perf_counter()
+    for name in targets[:200]:
+        best = min((p for p in legacy if p["queue"] == name), key=lambda p: (rank[p["lane"]], p["id"]), default=None)
+        if best is not None:
+            legacy.remove(best)
+    scan_us = (time.perf_counter() - start) / 200 * 1e6
+
+    queue_set = QueueSet(entries)
+    start = time.perf_counter()
+    for name in targets:
+        head = queue_set.first(name)
+        if head is not None:
+            queue_set.serve(head["id"])
+    call_us = (time.perf_counter() - start) / ops * 1e6
+    start = time.perf_counter()
+    for i in range(ops):
+        queue_set.position(entries[(i * 31) % tickets]["id"])
+    pos_us = (time.perf_counter() - start) / ops * 1e6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LogStore(tmp, fsync=False)
+        store.open()
+        for i in range(tickets // 10):
+            store.add(f"person{i}", STAMP, f"desk{i % queues}", lanes[i % len(lanes)])
+        start = time.perf_counter()
+        for name in targets:
+            store.call(STAMP, name)
+        store_us = (time.perf_counter() - start) / ops * 1e6
+        store.close()
+    return {"queues": queues, "scan_us": scan_us, "call_us": call_us, "position_us": pos_us, "store_call_us": store_us}
+
+
+def bench_removal(waiting: int, ops: int = 1000) -> Dict[str, float]:
+    entries = [{"id": i, "name": f"person{i}", "joined_at": STAMP} for i in range(1, waiting + 1)]
+    probes = [1 + (i * 7919) % waiting for i in range(ops)]
+    targets = [1 + (i * 104729) % waiting for i in range(ops)]
+
+    # The list version: rebuild it without the ticket, or pull it out and insert it elsewhere.
+    legacy = list(entries)
+    start = time.perf_counter()
+    for tid in probes[:100]:
+        legacy = [p for p in legacy if p["id"] != tid]
+    legacy_cancel = (time.perf_counter() - start) / 100
+    start = time.perf_counter()
+    for tid, position in zip(probes[100:200], targets):
+        index = next(n for n, p in enumerate(legacy) if p["id"] == tid)
+        legacy.insert(position - 1, legacy.pop(index))
+    legacy_move = (time.perf_counter() - start) / 100
+
+    queue_set = QueueSet(entries)
+    start = time.perf_counter()
+    for tid, position in zip(probes, targets):
+        queue_set.move(tid, position, waiting + 1)
+    move = (time.perf_counter() - start) / ops
+    start = time.perf_counter()
+    for tid in probes:
+        queue_set.remove(tid)
+    cancel = (time.perf_counter() - start) / ops
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LogStore(tmp, fsync=False)
+        store.open()
+        old = (datetime.fromisoformat(STAMP) - timedelta(hours=1)).isoformat()
+        stale = max(waiting // 100, 1)
+        store.add_many((f"person{i}", old if i < stale else STAMP, DEFAULT_QUEUE, DEFAULT_LANE)
+                       for i in range(waiting))
+        start = time.perf_counter()
+        for tid, position in zip(probes, targets):
+            store.requeue(tid, position, STAMP)
+        store_move = (time.perf_counter() - start) / ops
+        start = time.perf_counter()
+        for tid in probes:
+            store.cancel(tid, STAMP)
+        store_cancel = (time.perf_counter() - start) / ops
+        start = time.perf_counter()
+        expired = store.expire(to_epoch(STAMP) - 60, STAMP)
+        expire = time.perf_counter() - start
+        store.close()
+    return {
+        "waiting": waiting,
+        "legacy_cancel_us": legacy_cancel * 1e6, "legacy_move_us": legacy_move * 1e6,
+        "cancel_us": cancel * 1e6, "move_us": move * 1e6,
+        "store_cancel_us": store_cancel * 1e6, "store_move_us": store_move * 1e6,
+        "expired": len(expired), "expire_ms": expire * 1e3,
+    }
+
+
+def report_writes(sizes: List[int]) -> None:
+    print(f"{'history':>10} | {'legacy add':>12} | {'log add':>10} | {'startup':>10} | {'replay':>10}")
+    print("-" * 64)
+    for size in sizes:
+        r = bench_writes(size)
+        print(
+            f"{r['history']:>10} | {r['legacy_us']:>9.0f} us | {r['log_us']:>7.1f} us"
+            f" | {r['startup_ms']:>7.1f} ms | {r['replay_ms']:>7.1f} ms"
+        )
+
+
+def report_queue(sizes: List[int]) -> None:
+    print(f"{'waiting':>10} | {'list position':>14} | {'list pop(0)':>12} | {'index position':>15} | {'index pop':>10}")
+    print("-" * 76)
+    for size in sizes:
+        r = bench_queue(size)
+        print(
+            f"{r['waiting']:>10} | {r['legacy_pos_us']:>11.1f} us | {r['legacy_pop_us']:>9.2f} us"
+            f" | {r['indexed_pos_us']:>12.2f} us | {r['indexed_pop_us']:>7.2f} us"
+        )
+
+
+def report_server(counts: List[int]) -> None:
+    print(f"{'clients':>8} | {'ops':>8} | {'seconds':>8} | {'ops/sec':>10}")
+    print("-" * 44)
+    for count in counts:
+        r = bench_server(count)
+        print(f"{r['clients']:>8} | {r['ops']:>8} | {r['seconds']:>8.2f} | {r['ops_per_sec']:>10.0f}")
+
+
+def report_async(counts: List[int]) -> None:
+    print(f"{'clients':>8} | {'inline ops/s':>12} | {'loop stall':>10} | {'async ops/s':>11} | {'p99':>9} |"
+          f" {'loop stall':>10} | {'mutations/batch':>15}")
+    print("-" * 95)
+    for clients in counts:
+        r = bench_async(clients)
+        inline, batched = r["inline"], r["async"]
+        print(
+            f"{clients:>8} | {inline['ops_per_sec']:>12.0f} | {inline['stall_ms']:>7.1f} ms"
+            f" | {batched['ops_per_sec']:>11.0f} | {batched['p99_ms']:>6.1f} ms | {batched['stall_ms']:>7.1f} ms"
+            f" | {r['per_batch']:>15.1f}"
+        )
+
+
+def report_stress(processes: int, tickets: int) -> None:
+    r = bench_stress(processes, tickets)
+    print(f"{r['processes']} processes x {tickets} tickets = {r['tickets']} tickets in {r['seconds']:.2f}s")
+    print(f"Throughput:  {r['tickets_per_sec']:.0f} tickets/sec")
+    print(f"fsyncs:      {r['fsyncs']} ({r['tickets'] / max(r['fsyncs'], 1):.1f} tickets per fsync)")
+    print(f"Duplicates:  {r['duplicates']}")
+    print(f"Lost:        {r['lost']}")
+    print(f"Ids 1..N in queue order: {r['contiguous']}")
+    if r["duplicates"] or r["lost"] or not r["contiguous"]:
+        sys.exit(1)
+
+
+def report_history(sizes: List[int]) -> None:
+    print(f"{'history':>10} | {'open':>9} | {'memory':>10} | {'add':>9} | {'position':>9} | {'find id':>9} | {'find name':>9}")
+    print("-" * 82)
+    for size in sizes:
+        r = bench_history(size)
+        print(
+            f"{r['history']:>10} | {r['open_ms']:>6.1f} ms | {r['resident_kb']:>7.0f} KB | {r['add_us']:>6.1f} us"
+            f" | {r['position_us']:>6.2f} us | {r['find_id_ms']:>6.2f} ms | {r['find_name_ms']:>6.1f} ms"
+        )
+
+
+def report_names(sizes: List[int]) -> None:
+    print(f"{'history':>10} | {'full scan':>10} | {'index build':>11} | {'exact':>9} | {'prefix':>9} | {'fuzzy':>9}")
+    print("-" * 74)
+    for size in sizes:
+        r = bench_names(size)
+        print(
+            f"{r['history']:>10} | {r['scan_ms']:>7.0f} ms | {r['build_ms']:>8.0f} ms | {r['exact']:>6.2f} ms"
+            f" | {r['prefix']:>6.2f} ms | {r['fuzzy']:>6.2f} ms"
+        )
+
+
+def report_range(sizes: List[int]) -> None:
+    print(f"{'history':>10} | {'full scan':>10} | {'stats 1h':>9} | {'stats 1d':>9} | {'rows 1h':>9}")
+    print("-" * 60)
+    for size in sizes:
+        r = bench_range(size)
+        print(
+            f"{r['history']:>10} | {r['scan_ms']:>7.0f} ms | {r['hour_ms']:>6.2f} ms | {r['day_ms']:>6.2f} ms"
+            f" | {r['rows_ms']:>6.2f} ms"
+        )
+
+
+def report_lanes(counts: List[int]) -> None:
+    print(f"{'queues':>8} | {'list scan':>10} | {'call_next':>10} | {'position':>10} | {'store call':>10}")
+    print("-" * 62)
+    for count in counts:
+        r = bench_lanes(count)
+        print(
+            f"{r['queues']:>8} | {r['scan_us']:>7.0f} us | {r['call_us']:>7.2f} us | {r['position_us']:>7.2f} us"
+            f" | {r['store_call_us']:>7.1f} us"
+        )
+
+
+def report_removal(sizes: List[int]) -> None:
+    print(f"{'waiting':>9} | {'list cancel':>11} | {'list move':>10} | {'index cancel':>12} | {'index move':>10} |"
+          f" {'log cancel':>10} | {'log move':>9} | {'expire sweep':>18}")
+    print("-" * 108)
+    for size in sizes:
+        r = bench_removal(size)
+        print(
+            f"{r['waiting']:>9} | {r['legacy_cancel_us']:>8.0f} us | {r['legacy_move_us']:>7.0f} us"
+            f" | {r['cancel_us']:>9.2f} us | {r['move_us']:>7.2f} us | {r['store_cancel_us']:>7.1f} us"
+            f" | {r['store_move_us']:>6.1f} us | {r['expire_ms']:>6.1f} ms ({r['expired']:>5})"
+        )
+
+
+def report_fanout(counts: List[int]) -> None:
+    print(f"{'displays':>9} | {'poll everyone':>14} | {'one event':>10} | {'deliveries/sec':>15}")
+    print("-" * 58)
+    for count in counts:
+        r = bench_fanout(count)
+        print(
+            f"{r['subscribers']:>9} | {r['poll_round_ms']:>11.1f} ms | {r['event_round_ms']:>7.2f} ms"
+            f" | {r['deliveries_per_sec']:>15.0f}"
+        )
+
+
+def report_records(sizes: List[int]) -> None:
+    print(f"{'waiting':>9} | {'memory/ticket':>17} | {'disk/ticket':>13} | {'parse':>19} |"
+          f" {'LogStore.open':>21} | {'mmap get':>8}")
+    print(f"{'':>9} | {'dict':>8} {'Ticket':>8} | {'json':>6} {'rec':>6} | {'json':>9} {'rec':>9} |"
+          f" {'json':>10} {'rec':>10} | {'':>8}")
+    print("-" * 111)
+    for size in sizes:
+        r = bench_records(size)
+        print(
+            f"{r['waiting']:>9} | {r['dict_bytes']:>7.0f}B {r['ticket_bytes']:>7.0f}B |"
+            f" {r['json_file']:>5.0f}B {r['records_file']:>5.0f}B |"
+            f" {r['json_load_ms']:>7.0f}ms {r['records_load_ms']:>7.0f}ms |"
+            f" {r['store_json_ms']:>8.0f}ms {r['store_records_ms']:>8.0f}ms | {r['lookup_us']:>6.1f}us"
+        )
+
+
+def report_batch(sizes: List[int]) -> None:
+    print(f"rows/sec; batches of {queue_app.BATCH_SIZE}, single adds timed on a 1000-row sample")
+    print(f"{'rows':>9} | {'backend':>7} | {'add':>8} | {'import csv':>10} | {'speedup':>7} |"
+          f" {'export jsonl':>12} | {'call_next_n':>11}")
+    print("-" * 84)
+    for size in sizes:
+        for backend in CLAIM_BACKENDS:
+            r = bench_batch(backend, size)
+            print(
+                f"{r['rows']:>9} | {r['backend']:>7} | {r['single_per_sec']:>8.0f} | {r['import_per_sec']:>10.0f} |"
+                f" {r['import_per_sec'] / r['single_per_sec']:>6.0f}x | {r['export_per_sec']:>12.0f} |"
+                f" {r['call_per_sec']:>11.0f}"
+            )
+
+
+def report_render(sizes: List[int]) -> None:
+    print(f"{'waiting':>9} | {'full list, one print per row':>28} | {'buffered':>9} | {'page 2':>8} |"
+          f" {'top 10':>8} | {'around #':>8}")
+    print("-" * 87)
+    for size in sizes:
+        r = bench_render(size)
+        print(
+            f"{r['waiting']:>9} | {r['legacy_ms']:>25.0f} ms | {r['full_ms']:>6.0f} ms | {r['page_ms']:>5.1f} ms |"
+            f" {r['top_ms']:>5.1f} ms | {r['around_ms']:>5.1f} ms"
+        )
+
+
+def report_recovery(sizes: List[int]) -> None:
+    print(f"LogStore.open after a crash; target {RECOVERY_TARGET:.0f}s")
+    print(f"{'history':>9} | {'scenario':>14} | {'open':>8} | {'from':>15} | {'log records':>11} | {'waiting':>7}")
+    print("-" * 80)
+    slow = False
+    for size in sizes:
+        r = bench_recovery(size)
+        for scenario, (elapsed, (source, records, waiting)) in r["results"].items():
+            print(
+                f"{r['history']:>9} | {scenario:>14} | {elapsed:>6.2f} s | {os.path.basename(source or '-'):>15} |"
+                f" {records:>11} | {waiting:>7}"
+            )
+            slow = slow or elapsed > RECOVERY_TARGET
+    if slow:
+        sys.exit(1)
+
+
+def report_metrics(counts: List[int]) -> None:
+    print(f"Per-call cost of measuring; target {METRICS_TARGET} ns")
+    print(
+        f"{'calls':>9} | {'no-op':>8} | {'bare timer':>10} | {'off':>8} | {'on':>8} | {'get_position':>12}"
+        f" | {'measured':>9}"
+    )
+    print("-" * 83)
+    slow = False
+    for calls in counts:
+        r = bench_metrics(calls)
+        overhead = r["on"] - r["plain"]
+        print(
+            f"{calls:>9} | {r['plain']:>5.0f} ns | {r['timer'] - r['plain']:>+7.0f} ns |"
+            f" {r['off'] - r['plain']:>+5.0f} ns | {overhead:>+5.0f} ns |"
+            f" {r['position']:>9.0f} ns | {r['position on'] - r['position']:>+6.0f} ns"
+        )
+        slow = slow or overhead > METRICS_TARGET
+    if slow:
+        sys.exit(1)
+
+
+def report_suite(results: Dict[str, Any]) -> None:
+    print(f"queue_app on {results['backend']}, Python {results['python']}")
+    print(f"{'size':>9} | {'operation':<12} | {'calls':>6} | {'ops/sec':>10} | {'p50':>10} | {'p99':>10} | {'peak RSS':>9}")
+    print("-" * 86)
+    for size, result in results["sizes"].items():
+        for op, r in result["ops"].items():
+            rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.0f} MB"
+            print(
+                f"{size:>9} | {op:<12} | {r['calls']:>6} | {r['ops_per_sec']:>10.0f} |"
+                f" {r['p50_us']:>7.0f} us | {r['p99_us']:>7.0f} us | {rss:>9}"
+            )
+
+
+def report_diff(baseline: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    rows = diff_suites(baseline, current)
+    print(f"Against the baseline of {baseline.get('created', '?')} (tolerance {REGRESSION_TOLERANCE:.0%}):")
+    print(f"{'size':>9} | {'operation':<12} | {'metric':<11} | {'baseline':>10} | {'now':>10} | {'change':>7}")
+    print("-" * 76)
+    for r in rows:
+        flag = "  REGRESSION" if r["regression"] else ""
+        print(
+            f"{r['size']:>9} | {r['op']:<12} | {r['metric']:<11} | {r['baseline']:>10.1f} |"
+            f" {r['current']:>10.1f} | {r['change']:>+6.0%}{flag}"
+        )
+    regressions = sum(r["regression"] for r in rows)
+    print(f"{regressions} regression(s)." if regressions else "No regressions.")
+    return bool(regressions)
+
+
+def _read_results(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def suite_main(args: List[str]) -> None:
+    sizes = [int(a) for a in args if a.isdigit()]
+    words = [a for a in args if not a.isdigit()]
+    options = dict(zip(words[::2], words[1::2]))
+    results = run_suite(sizes or [1000, 100000, 1000000])
+    report_suite(results)
+    path = options.get("save") or f"suite-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved to {path}.")
+    if "baseline" in options and report_diff(_read_results(options["baseline"]), results):
+        sys.exit(1)
+
+
+def report_claims(agents: int, tickets: int) -> None:
+    print(f"{agents} agents claiming and completing {tickets} tickets")
+    print(f"{'backend':>8} | {'agents as':>9} | {'claims/sec':>10} | {'duplicates':>10} | {'lost':>5}")
+    print("-" * 55)
+    failed = False
+    for backend in CLAIM_BACKENDS:
+        for processes in (False, True):
+            r = bench_claims(backend, agents, tickets, processes)
+            print(
+                f"{r['backend']:>8} | {r['mode']:>9} | {r['claims_per_sec']:>10.0f} | {r['duplicates']:>10}"
+                f" | {r['lost']:>5}"
+            )
+            failed = failed or bool(r["duplicates"] or r["lost"])
+    if failed:
+        sys.exit(1)
+
+
+def main(argv: List[str]) -> None:
+    mode = argv[0] if argv else "writes"
+    if mode == "suite":
+        suite_main(argv[1:])
+        return
+    if mode == "diff" and len(argv) == 3:
+        if report_diff(_read_results(argv[1]), _read_results(argv[2])):
+            sys.exit(1)
+        return
+    sizes = [int(a) for a in argv[1:]]
+    if mode == "writes":
+        report_writes(sizes or [1000, 10000, 100000])
+    elif mode == "queue":
+        report_queue(sizes or [1000, 10000, 100000])
+    elif mode == "server":
+        report_server(sizes or [1, 8, 32])
+    elif mode == "async":
+        report_async(sizes or [1, 10, 100, 1000])
+    elif mode == "stress":
+        report_stress(*(sizes + [32, 10000][len(sizes):]))
+    elif mode == "history":
+        report_history(sizes or [10000, 100000, 1000000])
+    elif mode == "names":
+        report_names(sizes or [10000, 100000, 1000000])
+    elif mode == "range":
+        report_range(sizes or [10000, 100000, 1000000])
+    elif mode == "lanes":
+        report_lanes(sizes or [10, 1000, 10000])
+    elif mode == "removal":
+        report_removal(sizes or [10000, 100000])
+    elif mode == "fanout":
+        report_fanout(sizes or [10, 100, 1000])
+    elif mode == "records":
+        report_records(sizes or [10000, 100000, 1000000])
+    elif mode == "batch":
+        report_batch(sizes or [10000, 100000, 1000000])
+    elif mode == "render":
+        report_render(sizes or [1000, 10000, 100000])
+    elif mode == "recovery":
+        report_recovery(sizes or [10000, 100000, 1000000])
+    elif mode == "metrics":
+        report_metrics(sizes or [100000, 1000000])
+    elif mode == "claims":
+        report_claims(*(sizes + [50, 5000][len(sizes):]))
+    else:
+        print(f"Unknown benchmark: {mode}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
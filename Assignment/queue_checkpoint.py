@@ -0,0 +1,103 @@
+"""
+Queue Checkpoint - checksummed JSON files, replaced atomically
+
+A checkpoint is ordinary JSON whose first member is "crc32": the CRC-32 of
+every byte that follows its value. A file cut short by a crash, or damaged
+later, fails the check instead of loading half a state; files written
+before checksums existed (no "crc32") are still read.
+
+write_atomic never leaves a half-written file under the real name: it
+writes a temporary file, fsyncs it and renames it over the old one, then
+fsyncs the directory so the rename itself survives a power loss.
+keep_previous hard-links the current generation aside first (the same way
+made durable), so a reader that finds the newest checkpoint damaged has the
+one before to fall back on.
+"""
+
+import json
+import os
+import re
+import shutil
+import zlib
+from typing import Dict, Any
+
+from queue_metrics import count_read, count_written
+
+CHECKSUM_KEY = "crc32"
+_HEADER = re.compile(rb'\{"' + CHECKSUM_KEY.encode("ascii") + rb'":"([0-9a-f]{8})"')
+
+
+class CorruptCheckpoint(ValueError):
+    pass
+
+
+def encode_checked(data: Dict[str, Any]) -> bytes:
+    rest = json.dumps(data, separators=(",", ":")).encode("utf-8")[1:]
+    if rest != b"}":
+        rest = b"," + rest
+    return b'{"%s":"%08x"' % (CHECKSUM_KEY.encode("ascii"), zlib.crc32(rest)) + rest
+
+
+def decode_checked(raw: bytes) -> Dict[str, Any]:
+    match = _HEADER.match(raw)
+    if match is not None and int(match.group(1), 16) != zlib.crc32(raw[match.end():]):
+        raise CorruptCheckpoint("checksum mismatch")
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise CorruptCheckpoint(f"not valid JSON ({e})") from None
+    if not isinstance(data, dict):
+        raise CorruptCheckpoint("not a JSON object")
+    data.pop(CHECKSUM_KEY, None)
+    return data
+
+
+def read_checked(path: str) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        raw = f.read()
+    count_read(len(raw))
+    return decode_checked(raw)
+
+
+def fsync_dir(path: str) -> None:
+    """Make the renames and links done in path's directory durable."""
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        # Windows cannot open a directory; its renames need no such step.
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: str, payload: bytes, fsync: bool = True) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        count_written(len(payload))
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        fsync_dir(path)
+
+
+def keep_previous(path: str, previous_path: str, fsync: bool = True) -> None:
+    """Make previous_path the current contents of path (if any), without copying."""
+    tmp_path = f"{previous_path}.{os.getpid()}.tmp"
+    try:
+        os.link(path, tmp_path)
+    except FileNotFoundError:
+        return
+    except OSError:
+        # No hard links here: copy instead.
+        shutil.copyfile(path, tmp_path)
+        if fsync:
+            with open(tmp_path, "rb") as f:
+                os.fsync(f.fileno())
+    os.replace(tmp_path, previous_path)
+    if fsync:
+        fsync_dir(previous_path)
@@ -0,0 +1,108 @@
+"""
+Queue Events - change notifications for queue_app
+
+Stores publish one event per change, and subscribers get exactly that event
+rather than a fresh copy of the queue:
+    {"op": "add", "seq": 8, "queue": "main", "id": 7, "position": 3, "ticket": {...}}
+        Ticket 7 joined at position 3; everyone of that queue from position 3
+        on moved back one.
+    {"op": "call", "seq": 9, "queue": "main", "id": 4, "ticket": {...}}
+        Ticket 4 was called (or claimed by ticket["agent"]) from position 1;
+        everyone else in that queue moved up one.
+    {"op": "reclaim", "seq": 10, "queue": "main", "id": 2, "ticket": {...}}
+        An expired lease was handed out again; no position changes.
+    {"op": "finish", "seq": 11, "queue": "main", "id": 4, "ticket": {...}}
+        A lease was closed; ticket["outcome"] is "served" or "no_show".
+    {"op": "cancel", "seq": 12, "queue": "main", "id": 6, "position": 2, "ticket": {...}}
+        Ticket 6 left from position 2 without being called (ticket["reason"]
+        is "expired" if it waited too long); everyone behind it moved up one.
+    {"op": "requeue", "seq": 13, "queue": "main", "id": 5, "from": 1, "position": 4, "ticket": {...}}
+        Ticket 5 moved from position 1 to 4; everyone in between moved one
+        the other way.
+    {"op": "sync", "seq": 14}
+        The queue was reset, replaced or reloaded; positions must be re-read.
+    {"op": "sync", "seq": 15, "queue": "main"}
+        Positions in that queue must be re-read. Follows a cancel or requeue
+        in a queue calling from several lanes, whose stride order shifts the
+        tickets behind by more or less than one.
+seq counts the events of one bus, so a gap means something was missed.
+
+PositionTracker turns that stream into one ticket's current position.
+"""
+
+from typing import Dict, Any, Callable, Optional
+
+Event = Dict[str, Any]
+Subscriber = Callable[[Event], None]
+
+
+class EventBus:
+    def __init__(self) -> None:
+        # Queue name (None for every queue) -> subscription token -> callback.
+        self._subscribers: Dict[Optional[str], Dict[int, Subscriber]] = {}
+        self._next_token = 0
+        self.seq = 0
+
+    def __bool__(self) -> bool:
+        return any(self._subscribers.values())
+
+    def subscribe(self, callback: Subscriber, queue: Optional[str] = None) -> Callable[[], None]:
+        """Call callback with every event (of one queue, if given); returns an unsubscribe function."""
+        token = self._next_token
+        self._next_token += 1
+        self._subscribers.setdefault(queue, {})[token] = callback
+
+        def unsubscribe() -> None:
+            self._subscribers.get(queue, {}).pop(token, None)
+        return unsubscribe
+
+    def publish(self, event: Event) -> None:
+        # Runs inside the store's critical section: callbacks must be quick
+        # and must not call back into the store.
+        self.seq += 1
+        event["seq"] = self.seq
+        targets = list(self._subscribers.get(None, {}).items())
+        if "queue" in event:
+            targets += [(token, cb) for token, cb in self._subscribers.get(event["queue"], {}).items()]
+        else:
+            targets += [(token, cb) for name, subs in self._subscribers.items() if name is not None
+                        for token, cb in subs.items()]
+        for token, callback in targets:
+            try:
+                callback(event)
+            except Exception:
+                # A broken display must not hold up the queue.
+                for subs in self._subscribers.values():
+                    subs.pop(token, None)
+
+
+class PositionTracker:
+    def __init__(self, ticket_id: int, queue: str, position: Optional[int]) -> None:
+        self.ticket_id = ticket_id
+        self.queue = queue
+        self.position = position
+
+    def apply(self, event: Event) -> Optional[int]:
+        """New position after event; None once called or cancelled, or when a sync means re-read."""
+        op = event.get("op")
+        if op == "sync" and event.get("queue", self.queue) == self.queue:
+            self.position = None
+        elif self.position is None or event.get("queue") != self.queue:
+            pass
+        elif event.get("id") == self.ticket_id:
+            if op in ("call", "cancel"):
+                self.position = None
+            elif op == "requeue":
+                self.position = event["position"]
+        elif op == "add" and event["position"] <= self.position:
+            self.position += 1
+        elif op == "call":
+            self.position -= 1
+        elif op == "cancel" and event["position"] < self.position:
+            self.position -= 1
+        elif op == "requeue":
+            if event["from"] < self.position <= event["position"]:
+                self.position -= 1
+            elif event["position"] <= self.position < event["from"]:
+                self.position += 1
+        return self.position
@@ -0,0 +1,426 @@
+"""
+Queue History - date-partitioned archive of called tickets
+
+Called tickets leave LogStore's memory at each compaction and are appended
+to history/<YYYY-MM-DD>.jsonl, one segment per UTC day of called_at. With
+compression on, a day's segment is gzipped once a later day starts. The
+manifest keeps each segment's size and ticket-id range, so an id lookup
+only opens the segments that can hold it. The manifest is checksummed and
+keeps its previous generation beside it (see queue_checkpoint).
+
+names.tsv lists every archived ticket as id, segment, byte offset and name.
+It is all LogStore needs to rebuild its name index, and a match is then read
+back from its segment with a single seek.
+
+Beside each segment, <YYYY-MM-DD>.times holds (called, joined, offset) for
+its tickets as packed int64 epoch seconds in call order. Time-range queries
+bisect those arrays, so they touch neither JSON nor the days outside the
+window.
+"""
+
+import gzip
+import json
+import os
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from queue_checkpoint import CorruptCheckpoint, encode_checked, keep_previous, read_checked, write_atomic
+from queue_metrics import count_read, count_written
+from queue_stats import to_epoch
+
+SEGMENT_DIR = "history"
+MANIFEST_NAME = "manifest.json"
+PREVIOUS_MANIFEST_NAME = "manifest.prev.json"
+NAMES_NAME = "names.tsv"
+# Decompressed sealed segments kept around for read_at.
+UNPACKED_CACHE = 4
+TIMES_SUFFIX = ".times"
+# Three int64 per ticket: called, joined, byte offset.
+TIMES_ROW = 3 * 8
+# Segments whose time arrays stay in memory.
+TIMES_CACHE = 8
+
+
+def segment_key(entry: Dict[str, Any]) -> str:
+    return str(entry["called_at"])[:10]
+
+
+def _day_span(start: int, end: int) -> Tuple[str, str]:
+    # Segment keys that can hold calls in [start, end), one day of slack on
+    # each side for called_at strings written with a non-UTC offset.
+    def day(epoch: int, default: str) -> str:
+        try:
+            return datetime.fromtimestamp(epoch, timezone.utc).date().isoformat()
+        except (OverflowError, OSError, ValueError):
+            return default
+    first = day(start - 86400, "0000-00-00")
+    last = day(end + 86400, "9999-99-99")
+    return first, last
+
+
+def _encode(entry: Dict[str, Any]) -> bytes:
+    return json.dumps(entry, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class HistoryArchive:
+    def __init__(self, data_dir: str, compress: bool = False, fsync: bool = True) -> None:
+        self.dir = os.path.join(data_dir, SEGMENT_DIR)
+        self.manifest_path = os.path.join(self.dir, MANIFEST_NAME)
+        self.previous_manifest_path = os.path.join(self.dir, PREVIOUS_MANIFEST_NAME)
+        self.names_path = os.path.join(self.dir, NAMES_NAME)
+        self.compress = compress
+        self.fsync = fsync
+        # Highest log seq whose calls are archived; -1 means none yet.
+        self.archived_seq = -1
+        self.segments: Dict[str, Dict[str, Any]] = {}
+        self.index_bytes = 0
+        self._unpacked: "OrderedDict[str, bytes]" = OrderedDict()
+        self._times: "OrderedDict[str, Tuple[array, array, array]]" = OrderedDict()
+        self._manifest_stamp: Optional[Tuple[int, int]] = None
+        # False while manifest.json is known to be damaged: it must not
+        # become the previous generation.
+        self._manifest_intact = True
+        # Files replaced by sealing or unsealing, removed once the manifest
+        # no longer points at them.
+        self._obsolete: List[str] = []
+
+    # ---- manifest ----
+
+    def load(self) -> None:
+        # Cheap when nothing changed: one stat of the manifest.
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            if self._manifest_stamp is not None:
+                self.archived_seq = -1
+                self.segments = {}
+                self.index_bytes = 0
+                self._unpacked.clear()
+                self._times.clear()
+                self._manifest_stamp = None
+            return
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp == self._manifest_stamp:
+            return
+        try:
+            manifest = read_checked(self.manifest_path)
+            self._manifest_intact = True
+        except CorruptCheckpoint as e:
+            # The generation before: the store then recovers from the
+            # checkpoint that goes with it (see LogStore._recover).
+            try:
+                manifest = read_checked(self.previous_manifest_path)
+            except FileNotFoundError:
+                raise CorruptCheckpoint(f"{self.manifest_path}: {e}") from None
+            self._manifest_intact = False
+        self.archived_seq = manifest.get("archived_seq", -1)
+        self.segments = manifest.get("segments", {})
+        self.index_bytes = manifest.get("index_bytes", 0)
+        self._unpacked.clear()
+        self._times = OrderedDict(
+            (key, times) for key, times in self._times.items()
+            if key in self.segments and len(times[0]) <= self.segments[key]["count"]
+        )
+        self._manifest_stamp = stamp
+
+    def _save_manifest(self) -> None:
+        manifest = {"archived_seq": self.archived_seq, "index_bytes": self.index_bytes, "segments": self.segments}
+        if self._manifest_intact:
+            keep_previous(self.manifest_path, self.previous_manifest_path, self.fsync)
+        write_atomic(self.manifest_path, encode_checked(manifest), self.fsync)
+        self._manifest_intact = True
+        st = os.stat(self.manifest_path)
+        self._manifest_stamp = (st.st_ino, st.st_mtime_ns)
+        for path in self._obsolete:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self._obsolete = []
+
+    # ---- writing ----
+
+    def archive(self, entries: List[Dict[str, Any]], seq: int) -> None:
+        # Must run under the store's exclusive lock.
+        self.load()
+        os.makedirs(self.dir, exist_ok=True)
+        by_segment: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            by_segment.setdefault(segment_key(entry), []).append(entry)
+        index_lines: List[bytes] = []
+        for key, batch in sorted(by_segment.items()):
+            index_lines += self._append_segment(key, batch)
+        with open(self.names_path, "ab") as f:
+            f.truncate(self.index_bytes)
+            payload = b"".join(index_lines)
+            f.write(payload)
+            f.flush()
+            count_written(len(payload))
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.index_bytes = f.tell()
+        if self.compress and self.segments:
+            latest = max(self.segments)
+            for key, meta in self.segments.items():
+                if key < latest and not meta["file"].endswith(".gz"):
+                    self._seal(key)
+        self.archived_seq = max(self.archived_seq, seq)
+        self._save_manifest()
+
+    def _append_segment(self, key: str, batch: List[Dict[str, Any]]) -> List[bytes]:
+        meta = self.segments.get(key)
+        if meta is None:
+            meta = {
+                "file": f"{key}.jsonl", "count": 0, "bytes": 0,
+                "min_id": batch[0]["id"], "max_id": batch[0]["id"],
+            }
+            self.segments[key] = meta
+        elif meta["file"].endswith(".gz"):
+            # A late call for a sealed day: reopen it as a plain segment.
+            self._unseal(key)
+        if self._times_size(key) < meta["count"] * TIMES_ROW:
+            self._write_times(key, self._scan_times(key))
+        lines = [_encode(e) for e in batch]
+        index_lines = []
+        times = array("q")
+        offset = meta["bytes"]
+        for entry, line in zip(batch, lines):
+            index_lines.append(f"{entry['id']}\t{key}\t{offset}\t{json.dumps(entry['name'])}\n".encode("utf-8"))
+            times += array("q", (to_epoch(entry["called_at"]), to_epoch(entry["joined_at"]), offset))
+            offset += len(line)
+        path = os.path.join(self.dir, meta["file"])
+        with open(path, "ab") as f:
+            # Drop anything written after the last manifest (a crash mid-archive).
+            f.truncate(meta["bytes"])
+            payload = b"".join(lines)
+            f.write(payload)
+            f.flush()
+            count_written(len(payload))
+            if self.fsync:
+                os.fsync(f.fileno())
+            meta["bytes"] = f.tell()
+        with open(self._times_path(key), "ab") as f:
+            f.truncate(meta["count"] * TIMES_ROW)
+            payload = times.tobytes()
+            f.write(payload)
+            f.flush()
+            count_written(len(payload))
+            if self.fsync:
+                os.fsync(f.fileno())
+        meta["count"] += len(batch)
+        meta["min_id"] = min(meta["min_id"], min(e["id"] for e in batch))
+        meta["max_id"] = max(meta["max_id"], max(e["id"] for e in batch))
+        return index_lines
+
+    def _seal(self, key: str) -> None:
+        meta = self.segments[key]
+        plain = os.path.join(self.dir, meta["file"])
+        with open(plain, "rb") as src, open(plain + ".gz", "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+                dst.write(src.read(meta["bytes"]))
+            if self.fsync:
+                os.fsync(raw.fileno())
+        meta["file"] += ".gz"
+        meta["bytes"] = os.path.getsize(plain + ".gz")
+        self._obsolete.append(plain)
+
+    def _unseal(self, key: str) -> None:
+        meta = self.segments[key]
+        packed = os.path.join(self.dir, meta["file"])
+        with gzip.open(packed, "rb") as src:
+            data = src.read()
+        meta["file"] = meta["file"][:-len(".gz")]
+        with open(os.path.join(self.dir, meta["file"]), "wb") as dst:
+            dst.write(data)
+        meta["bytes"] = len(data)
+        self._obsolete.append(packed)
+
+    def clear(self, seq: int) -> None:
+        self.load()
+        self._obsolete += [os.path.join(self.dir, meta["file"]) for meta in self.segments.values()]
+        self._obsolete += [self._times_path(key) for key in self.segments]
+        self._obsolete.append(self.names_path)
+        self.segments = {}
+        self.index_bytes = 0
+        self._unpacked.clear()
+        self._times.clear()
+        self.archived_seq = seq
+        os.makedirs(self.dir, exist_ok=True)
+        self._save_manifest()
+
+    # ---- reading ----
+
+    def _segment_lines(self, key: str) -> Iterator[bytes]:
+        meta = self.segments[key]
+        path = os.path.join(self.dir, meta["file"])
+        if meta["file"].endswith(".gz"):
+            with gzip.open(path, "rb") as f:
+                for line in f:
+                    count_read(len(line))
+                    yield line
+            return
+        with open(path, "rb") as f:
+            remaining = meta["bytes"]
+            for line in f:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+                count_read(len(line))
+                yield line
+
+    def _read_segment(self, key: str, needle: Optional[bytes] = None) -> Iterator[Dict[str, Any]]:
+        # needle is a cheap byte-level prefilter; only matching lines get parsed.
+        for line in self._segment_lines(key):
+            if needle is None or needle in line:
+                yield json.loads(line)
+
+    def __len__(self) -> int:
+        self.load()
+        return sum(meta["count"] for meta in self.segments.values())
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        self.load()
+        for key in sorted(self.segments):
+            yield from self._read_segment(key)
+
+    def find_id(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        self.load()
+        for key in sorted(self.segments):
+            meta = self.segments[key]
+            if meta["min_id"] <= ticket_id <= meta["max_id"]:
+                for entry in self._read_segment(key, b'"id":%d,' % ticket_id):
+                    if entry["id"] == ticket_id:
+                        return entry
+        return None
+
+    def read_index(self, start: int = 0) -> Tuple[List[Tuple[int, str, int, str]], int]:
+        """(id, segment, offset, name) rows of names.tsv from byte start, and where they end"""
+        self.load()
+        rows = []
+        if start >= self.index_bytes:
+            return rows, start
+        with open(self.names_path, "rb") as f:
+            f.seek(start)
+            data = f.read(self.index_bytes - start)
+        count_read(len(data))
+        for line in data.decode("utf-8").splitlines():
+            tid, key, offset, name = line.split("\t", 3)
+            name = json.loads(name) if "\\" in name else name[1:-1]
+            rows.append((int(tid), key, int(offset), name))
+        return rows, self.index_bytes
+
+    def read_at(self, key: str, offset: int) -> Dict[str, Any]:
+        self.load()
+        return self._read_many(key, [offset])[0]
+
+    def _read_many(self, key: str, offsets: List[int]) -> List[Dict[str, Any]]:
+        meta = self.segments[key]
+        if not meta["file"].endswith(".gz"):
+            entries = []
+            with open(os.path.join(self.dir, meta["file"]), "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    line = f.readline()
+                    count_read(len(line))
+                    entries.append(json.loads(line))
+            return entries
+        data = self._unpacked.get(key)
+        if data is None:
+            with gzip.open(os.path.join(self.dir, meta["file"]), "rb") as f:
+                data = f.read()
+            count_read(len(data))
+            self._unpacked[key] = data
+            if len(self._unpacked) > UNPACKED_CACHE:
+                self._unpacked.popitem(last=False)
+        else:
+            self._unpacked.move_to_end(key)
+        return [json.loads(data[offset:data.index(b"\n", offset)]) for offset in offsets]
+
+    # ---- time index ----
+
+    def _times_path(self, key: str) -> str:
+        return os.path.join(self.dir, key + TIMES_SUFFIX)
+
+    def _times_size(self, key: str) -> int:
+        try:
+            return os.path.getsize(self._times_path(key))
+        except FileNotFoundError:
+            return 0
+
+    def _scan_times(self, key: str) -> array:
+        # Archives written before the time index existed: derive it once.
+        times = array("q")
+        offset = 0
+        for line in self._segment_lines(key):
+            entry = json.loads(line)
+            times += array("q", (to_epoch(entry["called_at"]), to_epoch(entry["joined_at"]), offset))
+            offset += len(line)
+        return times
+
+    def _write_times(self, key: str, times: array) -> None:
+        path = self._times_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        payload = times.tobytes()
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        count_written(len(payload))
+        os.replace(tmp_path, path)
+
+    def _segment_times(self, key: str) -> Tuple[array, array, array]:
+        """called, joined and offset arrays of a segment, sorted by called"""
+        count = self.segments[key]["count"]
+        cached = self._times.get(key)
+        if cached is not None and len(cached[0]) == count:
+            self._times.move_to_end(key)
+            return cached
+        flat = array("q")
+        try:
+            with open(self._times_path(key), "rb") as f:
+                raw = f.read(count * TIMES_ROW)
+            count_read(len(raw))
+            flat.frombytes(raw)
+        except FileNotFoundError:
+            pass
+        if len(flat) != count * 3:
+            flat = self._scan_times(key)
+            try:
+                self._write_times(key, flat)
+            except OSError:
+                pass
+        called, joined, offsets = flat[0::3], flat[1::3], flat[2::3]
+        if list(called) != sorted(called):
+            # Calls archived out of clock order (a clock step, or replace()).
+            order = sorted(range(count), key=called.__getitem__)
+            called = array("q", (called[i] for i in order))
+            joined = array("q", (joined[i] for i in order))
+            offsets = array("q", (offsets[i] for i in order))
+        self._times[key] = (called, joined, offsets)
+        if len(self._times) > TIMES_CACHE:
+            self._times.popitem(last=False)
+        return called, joined, offsets
+
+    def _windows(self, start: int, end: int) -> Iterator[Tuple[str, int, int, Tuple[array, array, array]]]:
+        self.load()
+        first, last = _day_span(start, end)
+        for key in sorted(self.segments):
+            if first <= key <= last:
+                times = self._segment_times(key)
+                lo, hi = bisect_left(times[0], start), bisect_left(times[0], end)
+                if lo < hi:
+                    yield key, lo, hi, times
+
+    def waits_between(self, start: int, end: int) -> List[int]:
+        """called_at - joined_at in seconds for calls in [start, end)"""
+        waits: List[int] = []
+        for _, lo, hi, (called, joined, _) in self._windows(start, end):
+            waits += map(int.__sub__, called[lo:hi], joined[lo:hi])
+        return waits
+
+    def called_between(self, start: int, end: int) -> List[Dict[str, Any]]:
+        entries: List[Dict[str, Any]] = []
+        for key, lo, hi, (_, _, offsets) in self._windows(start, end):
+            entries += self._read_many(key, list(offsets[lo:hi]))
+        return entries
@@ -0,0 +1,736 @@
+"""
+Queue Index - in-memory structures behind queue_app's lookups
+
+TicketQueue keeps the waiting list in ticket order inside a blocked sorted
+list (short sorted runs plus a Fenwick tree over their lengths), so taking
+the head is constant time and finding or removing any ticket is logarithmic.
+Tickets are ordered by seat, which is their id unless they were requeued:
+a moved ticket takes a fractional seat between its new neighbours (see
+place_seat), so a move touches nothing but the ticket itself, except now
+and then when a gap runs out of room and a few neighbours are spread out.
+
+QueueSet holds many named queues. Each ServiceQueue splits its tickets into
+priority lanes, one TicketQueue per lane, and picks the lane to call from
+with stride scheduling: a lane of weight w advances its pass by STRIDE // w
+per call, and a heap hands out the lane with the lowest pass. Passes are
+integers, so every process replaying the same log makes the same choices.
+
+NameIndex maps casefolded names to ticket ids. Prefix queries are range
+scans over the same blocked sorted list of distinct names. Typo-tolerant
+matches take candidates from a trigram -> names map and score them by edit
+similarity.
+"""
+
+import heapq
+from bisect import bisect_left
+from collections import Counter
+from difflib import SequenceMatcher
+from itertools import islice
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+BLOCK_SIZE = 512
+
+
+class SortedKeys:
+    def __init__(self, block_size: int = BLOCK_SIZE) -> None:
+        self._load = block_size
+        self._blocks: List[List[int]] = []
+        self._maxes: List[int] = []
+        self._tree: Optional[List[int]] = None
+        self._len = 0
+        self._head = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[int]:
+        for i, block in enumerate(self._blocks):
+            yield from (block[self._head:] if i == 0 else block)
+
+    # ---- Fenwick tree over block lengths ----
+
+    def _block_len(self, i: int) -> int:
+        return len(self._blocks[i]) - (self._head if i == 0 else 0)
+
+    def _build_tree(self) -> List[int]:
+        tree = [0] + [self._block_len(i) for i in range(len(self._blocks))]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+        return tree
+
+    def _tree_add(self, block: int, delta: int) -> None:
+        tree = self._tree
+        if tree is None:
+            return
+        i = block + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def _count_before(self, block: int) -> int:
+        tree = self._tree if self._tree is not None else self._build_tree()
+        total = 0
+        i = block
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    # ---- updates ----
+
+    def add(self, key: int) -> None:
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._tree = None
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._blocks[i].append(key)
+            self._maxes[i] = key
+        else:
+            block = self._blocks[i]
+            pos = bisect_left(block, key, self._head if i == 0 else 0)
+            block.insert(pos, key)
+        self._tree_add(i, 1)
+        if len(self._blocks[i]) > 2 * self._load:
+            self._split(i)
+
+    def _split(self, i: int) -> None:
+        if i == 0 and self._head:
+            del self._blocks[0][:self._head]
+            self._head = 0
+        block = self._blocks[i]
+        half = len(block) // 2
+        self._blocks.insert(i + 1, block[half:])
+        del block[half:]
+        self._maxes.insert(i, block[-1])
+        self._tree = None
+
+    def _locate(self, key: int) -> Optional[tuple]:
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return None
+        block = self._blocks[i]
+        lo = self._head if i == 0 else 0
+        j = bisect_left(block, key, lo)
+        if j == len(block) or block[j] != key:
+            return None
+        return i, j
+
+    def remove(self, key: int) -> bool:
+        found = self._locate(key)
+        if found is None:
+            return False
+        i, j = found
+        if i == 0 and j == self._head:
+            self.popleft()
+            return True
+        block = self._blocks[i]
+        del block[j]
+        self._len -= 1
+        if j == len(block) and block:
+            self._maxes[i] = block[-1]
+        self._tree_add(i, -1)
+        if self._block_len(i) == 0:
+            self._drop_block(i)
+        return True
+
+    def _drop_block(self, i: int) -> None:
+        del self._blocks[i]
+        del self._maxes[i]
+        if i == 0:
+            self._head = 0
+        self._tree = None
+
+    def popleft(self) -> int:
+        if not self._len:
+            raise IndexError("pop from empty queue")
+        # Advance a head offset instead of shifting the first block.
+        block = self._blocks[0]
+        key = block[self._head]
+        self._head += 1
+        self._len -= 1
+        self._tree_add(0, -1)
+        if self._head == len(block):
+            self._drop_block(0)
+        return key
+
+    # ---- queries ----
+
+    def first(self) -> Optional[int]:
+        return self._blocks[0][self._head] if self._len else None
+
+    def iter_from(self, key: Any) -> Iterator[Any]:
+        i = bisect_left(self._maxes, key)
+        for n in range(i, len(self._blocks)):
+            block = self._blocks[n]
+            lo = self._head if n == 0 else 0
+            yield from block[bisect_left(block, key, lo) if n == i else lo:]
+
+    def index(self, key: int) -> Optional[int]:
+        found = self._locate(key)
+        if found is None:
+            return None
+        i, j = found
+        return self._count_before(i) + j - (self._head if i == 0 else 0)
+
+    def at(self, index: int) -> Any:
+        """The key at a 0-based index; a descent of the Fenwick tree"""
+        if not 0 <= index < self._len:
+            raise IndexError("index out of range")
+        tree = self._tree if self._tree is not None else self._build_tree()
+        block = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = block + step
+            if nxt < len(tree) and tree[nxt] <= index:
+                block = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return self._blocks[block][index + (self._head if block == 0 else 0)]
+
+    def clear(self) -> None:
+        self.__init__(self._load)
+
+
+# A gap is spread out once its tickets would sit closer than this fraction
+# of their seat values: well clear of float resolution.
+SEAT_RESOLUTION = 2.0 ** -32
+
+
+def place_seat(seat_at: Callable[[int], float], count: int, rank: int, limit: int) -> Tuple[int, List[float]]:
+    """Seats for a ticket moving to rank (1-based) among count others ordered by seat.
+
+    seat_at(i) is the seat of the i-th other ticket (0-based), and limit the
+    next ticket id, which every seat stays below. Returns (first, seats):
+    seats go, in order, to the others from index first to rank - 2, the
+    moved ticket, and the others after it; usually just [the moved ticket's].
+    """
+    low = seat_at(rank - 2) if rank > 1 else None
+    high = seat_at(rank - 1) if rank <= count else limit
+    if low is None:
+        return 0, [float(high - 1)]
+    middle = (low + high) / 2
+    if low < middle < high:
+        return rank - 1, [middle]
+    # The gap is used up: spread a window of neighbours evenly over the room
+    # around them, doubling it until there is enough.
+    width = 1
+    while True:
+        first, last = max(rank - 1 - width, 0), min(rank - 1 + width, count)
+        size = last - first + 1
+        low = seat_at(first - 1) if first else seat_at(0) - size
+        high = seat_at(last) if last < count else limit
+        step = (high - low) / (size + 1)
+        if step > SEAT_RESOLUTION * max(abs(low), abs(high), 1):
+            return first, [low + step * (k + 1) for k in range(size)]
+        width *= 2
+
+
+def reseat(entry: Dict[str, Any], seat: float) -> Dict[str, Any]:
+    """A dict copy of entry ordered by seat"""
+    moved = {key: value for key, value in entry.items() if key != "seat"}
+    if seat != moved["id"]:
+        moved["seat"] = seat
+    return moved
+
+
+class TicketQueue:
+    def __init__(self, entries: Optional[List[Dict[str, Any]]] = None) -> None:
+        self._order = SortedKeys()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        # Seat -> id of requeued tickets; everyone else's seat is their id.
+        self._moved: Dict[float, int] = {}
+        for entry in entries or []:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __bool__(self) -> bool:
+        return len(self._order) > 0
+
+    def __contains__(self, ticket_id: int) -> bool:
+        return ticket_id in self._entries
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        entries = self._entries
+        if not self._moved:
+            return (entries[tid] for tid in self._order)
+        moved = self._moved
+        return (entries[moved.get(seat, seat)] for seat in self._order)
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        tid = entry["id"]
+        seat = entry.get("seat")
+        self._entries[tid] = entry
+        if seat is None:
+            self._order.add(tid)
+        else:
+            self._order.add(seat)
+            self._moved[seat] = tid
+
+    def get(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        return self._entries.get(ticket_id)
+
+    def _at(self, index: int) -> Dict[str, Any]:
+        seat = self._order.at(index)
+        return self._entries[self._moved.get(seat, seat)]
+
+    def first(self) -> Optional[Dict[str, Any]]:
+        seat = self._order.first()
+        return None if seat is None else self._entries[self._moved.get(seat, seat)]
+
+    def popleft(self) -> Dict[str, Any]:
+        seat = self._order.popleft()
+        return self._entries.pop(self._moved.pop(seat, seat))
+
+    def remove(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        entry = self._entries.pop(ticket_id, None)
+        if entry is not None:
+            seat = entry.get("seat")
+            if seat is None:
+                self._order.remove(ticket_id)
+            else:
+                self._order.remove(seat)
+                del self._moved[seat]
+        return entry
+
+    def position(self, ticket_id: int) -> Optional[int]:
+        entry = self._entries.get(ticket_id)
+        if entry is None:
+            return None
+        return self._order.index(entry.get("seat", ticket_id)) + 1
+
+    def insert(self, entry: Dict[str, Any], rank: int, limit: int,
+               make: Callable[[Dict[str, Any], float], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Put entry (not in the queue) at rank; make(entry, seat) builds each reseated entry, all returned."""
+        first, seats = place_seat(self._order.at, len(self._order), rank, limit)
+        window = [self._at(i) for i in range(first, first + len(seats) - 1)]
+        window.insert(rank - 1 - first, entry)
+        placed = []
+        for old, seat in zip(window, seats):
+            if old is not entry:
+                self.remove(old["id"])
+            new = make(old, seat)
+            self.append(new)
+            placed.append(new)
+        return placed
+
+    def stale(self, is_stale: Callable[[Dict[str, Any]], bool]) -> List[Dict[str, Any]]:
+        """Tickets is_stale picks, which must be a prefix in id order (as join times are)"""
+        found = [entry for entry in (self._entries[tid] for tid in self._moved.values()) if is_stale(entry)]
+        for seat in self._order:
+            if seat in self._moved:
+                continue
+            entry = self._entries[seat]
+            if not is_stale(entry):
+                break
+            found.append(entry)
+        return found
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+
+DEFAULT_QUEUE = "main"
+DEFAULT_LANE = "normal"
+# Lane -> weight; listing order breaks ties between equal passes.
+LANE_WEIGHTS: Dict[str, int] = {"vip": 4, "elderly": 2, "normal": 1}
+STRIDE = 1 << 20
+
+
+def queue_of(entry: Dict[str, Any]) -> str:
+    return entry.get("queue", DEFAULT_QUEUE)
+
+
+def lane_of(entry: Dict[str, Any]) -> str:
+    return entry.get("lane", DEFAULT_LANE)
+
+
+def parse_lanes(spec: str) -> Dict[str, int]:
+    """"vip=4,elderly=2,normal=1" -> {"vip": 4, "elderly": 2, "normal": 1}"""
+    weights: Dict[str, int] = {}
+    for part in spec.split(","):
+        lane, _, weight = part.strip().partition("=")
+        if lane:
+            weights[lane] = int(weight or 1)
+            if weights[lane] < 1:
+                raise ValueError(f"Lane weight must be at least 1: {part!r}")
+    weights.setdefault(DEFAULT_LANE, 1)
+    return weights
+
+
+def stride_position(rank: int, lane: str, lanes: Dict[str, Tuple[int, int]], weights: Dict[str, int]) -> int:
+    """Calls until the rank-th ticket of lane is reached, given each lane's (pass, waiting)"""
+    target = lanes[lane][0] + (rank - 1) * (STRIDE // weights.get(lane, 1))
+    mine = lane_rank(lane, weights)
+    position = rank
+    for other, (pass_, waiting) in lanes.items():
+        if other == lane or not waiting:
+            continue
+        stride = STRIDE // weights.get(other, 1)
+        gap = target - pass_
+        # The other lane's k-th ticket goes first if pass_ + k * stride is
+        # below target, or equal to it and that lane is listed first.
+        if lane_rank(other, weights) < mine:
+            ahead = gap // stride + 1 if gap >= 0 else 0
+        else:
+            ahead = (gap - 1) // stride + 1 if gap > 0 else 0
+        position += min(waiting, ahead)
+    return position
+
+
+def rank_for(position: int, lane: str, lanes: Dict[str, Tuple[int, int]], weights: Dict[str, int]) -> int:
+    """The rank in lane that comes first at or after overall position, given each lane's (pass, waiting)"""
+    # stride_position only grows with rank: a binary search over the lane.
+    lo, hi = 1, lanes[lane][1]
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if stride_position(mid, lane, lanes, weights) >= position:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def lane_rank(lane: str, weights: Dict[str, int]) -> int:
+    # Tie-break order; lanes missing from the configuration go last.
+    for n, name in enumerate(weights):
+        if name == lane:
+            return n
+    return len(weights)
+
+
+def interleave(lanes: Dict[str, Tuple[int, Iterable[Dict[str, Any]]]],
+               weights: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+    """Tickets of every lane, given as (pass, tickets in id order), in call order"""
+    def turns(lane: str, pass_: int, tickets: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        stride = STRIDE // weights.get(lane, 1)
+        rank = lane_rank(lane, weights)
+        for k, entry in enumerate(tickets):
+            yield (pass_ + k * stride, rank), entry
+    merged = heapq.merge(*(turns(lane, *state) for lane, state in lanes.items()), key=lambda turn: turn[0])
+    return (entry for _, entry in merged)
+
+
+class ServiceQueue:
+    def __init__(self, weights: Dict[str, int]) -> None:
+        self.weights = weights
+        self.lanes: Dict[str, TicketQueue] = {}
+        self.passes: Dict[str, int] = {}
+        self.vtime = 0
+        self._heap: List[Tuple[int, int, str]] = []
+        self._order = {lane: n for n, lane in enumerate(weights)}
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.lanes.values())
+
+    def _push(self, lane: str) -> None:
+        heapq.heappush(self._heap, (self.passes[lane], self._order[lane], lane))
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        lane = lane_of(entry)
+        if lane not in self.weights:
+            # Stores validate lanes on add; this only keeps replaying a log
+            # written under another lane setup from failing.
+            self.weights = {**self.weights, lane: 1}
+            self._order[lane] = len(self._order)
+        tickets = self.lanes.get(lane)
+        if tickets is None:
+            tickets = self.lanes[lane] = TicketQueue()
+        if not tickets:
+            # A lane coming back from idle starts level with the others
+            # instead of cashing in the turns it missed.
+            self.passes[lane] = max(self.passes.get(lane, 0), self.vtime)
+            self._push(lane)
+        tickets.append(entry)
+
+    def _next_lane(self) -> Optional[str]:
+        heap = self._heap
+        while heap:
+            pass_, _, lane = heap[0]
+            if self.lanes[lane] and self.passes[lane] == pass_:
+                return lane
+            heapq.heappop(heap)  # emptied by a removal, or re-pushed since
+        return None
+
+    def first(self) -> Optional[Dict[str, Any]]:
+        lane = self._next_lane()
+        return None if lane is None else self.lanes[lane].first()
+
+    def serve(self, entry: Dict[str, Any]) -> None:
+        lane = lane_of(entry)
+        self.lanes[lane].remove(entry["id"])
+        self.vtime = self.passes[lane]
+        self.passes[lane] += STRIDE // self.weights[lane]
+        if self.lanes[lane]:
+            self._push(lane)
+
+    def remove(self, entry: Dict[str, Any]) -> None:
+        self.lanes[lane_of(entry)].remove(entry["id"])
+
+    def position(self, entry: Dict[str, Any]) -> int:
+        lane = lane_of(entry)
+        rank = self.lanes[lane].position(entry["id"])
+        if len(self.lanes) == 1:
+            return rank
+        lanes = {name: (self.passes[name], len(q)) for name, q in self.lanes.items()}
+        return stride_position(rank, lane, lanes, self.weights)
+
+    def interleaved(self) -> bool:
+        """Whether more than one lane has tickets waiting."""
+        return sum(1 for q in self.lanes.values() if q) > 1
+
+    def move(self, entry: Dict[str, Any], position: int, limit: int,
+             make: Callable[[Dict[str, Any], float], Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Move a waiting ticket as close to position as its lane allows; the reseated entries."""
+        lane = lane_of(entry)
+        tickets = self.lanes[lane]
+        tickets.remove(entry["id"])
+        count = len(tickets)
+        if len(self.lanes) == 1:
+            rank = min(max(position, 1), count + 1)
+        else:
+            lanes = {name: (self.passes[name], len(q)) for name, q in self.lanes.items()}
+            lanes[lane] = (self.passes[lane], count + 1)
+            rank = rank_for(position, lane, lanes, self.weights)
+        return tickets.insert(entry, rank, limit, make)
+
+    def in_service_order(self) -> Iterator[Dict[str, Any]]:
+        return interleave({lane: (self.passes[lane], q) for lane, q in self.lanes.items()}, self.weights)
+
+    def schedule(self) -> Dict[str, Any]:
+        return {"vtime": self.vtime, "passes": dict(self.passes)}
+
+    def restore(self, schedule: Dict[str, Any]) -> None:
+        self.vtime = schedule.get("vtime", 0)
+        self.passes.update(schedule.get("passes", {}))
+        self._heap = []
+        for lane, tickets in self.lanes.items():
+            if tickets:
+                self._push(lane)
+
+
+class QueueSet:
+    """Every waiting ticket, by named queue and lane; keyed by global ticket id."""
+
+    def __init__(self, entries: Optional[List[Dict[str, Any]]] = None,
+                 weights: Optional[Dict[str, int]] = None) -> None:
+        self.weights = weights or LANE_WEIGHTS
+        self.queues: Dict[str, ServiceQueue] = {}
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        for entry in entries or []:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return bool(self._entries)
+
+    def __contains__(self, ticket_id: int) -> bool:
+        return ticket_id in self._entries
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for queue in self.queues.values():
+            for tickets in queue.lanes.values():
+                yield from tickets
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        name = queue_of(entry)
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = ServiceQueue(self.weights)
+        queue.append(entry)
+        self._entries[entry["id"]] = entry
+
+    def get(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        return self._entries.get(ticket_id)
+
+    def first(self, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        found = self.queues.get(queue)
+        return None if found is None else found.first()
+
+    def _take(self, ticket_id: int, served: bool) -> Optional[Dict[str, Any]]:
+        entry = self._entries.pop(ticket_id, None)
+        if entry is None:
+            return None
+        name = queue_of(entry)
+        queue = self.queues[name]
+        if served:
+            queue.serve(entry)
+        else:
+            queue.remove(entry)
+        if not len(queue):
+            # An idle queue starts over; thousands of counters stay cheap.
+            del self.queues[name]
+        return entry
+
+    def serve(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        """Remove a ticket because it was called, charging its lane a turn."""
+        return self._take(ticket_id, served=True)
+
+    def remove(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        return self._take(ticket_id, served=False)
+
+    def position(self, ticket_id: int) -> Optional[int]:
+        entry = self._entries.get(ticket_id)
+        if entry is None:
+            return None
+        return self.queues[queue_of(entry)].position(entry)
+
+    def interleaved(self, queue: str = DEFAULT_QUEUE) -> bool:
+        """Whether queue calls from more than one lane; then a cancel or requeue
+        can shift the tickets behind it by more or less than one."""
+        found = self.queues.get(queue)
+        return found is not None and found.interleaved()
+
+    def move(self, ticket_id: int, position: int, limit: int,
+             make: Callable[[Dict[str, Any], float], Dict[str, Any]] = reseat) -> Optional[Dict[str, Any]]:
+        """Requeue a waiting ticket at position (1 = next) of its queue; its new entry.
+
+        limit is the next ticket id: seats stay below it, so later tickets
+        still join behind. make(entry, seat) builds a reseated entry.
+        """
+        entry = self._entries.get(ticket_id)
+        if entry is None:
+            return None
+        for placed in self.queues[queue_of(entry)].move(entry, position, limit, make):
+            self._entries[placed["id"]] = placed
+        return self._entries[ticket_id]
+
+    def stale(self, is_stale: Callable[[Dict[str, Any]], bool]) -> List[Dict[str, Any]]:
+        """Waiting tickets is_stale picks; it must pick a prefix of each lane in id order"""
+        return [entry for queue in self.queues.values() for tickets in queue.lanes.values()
+                for entry in tickets.stale(is_stale)]
+
+    def waiting(self, queue: str = DEFAULT_QUEUE, start: int = 0, stop: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Tickets start to stop (list indices) of queue in call order; the merge stops at stop."""
+        found = self.queues.get(queue)
+        return [] if found is None else list(islice(found.in_service_order(), start, stop))
+
+    def counts(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in self.queues.items()}
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        return list(self)
+
+    def schedule(self) -> Dict[str, Dict[str, Any]]:
+        return {name: queue.schedule() for name, queue in self.queues.items()}
+
+    def restore(self, schedule: Dict[str, Dict[str, Any]]) -> None:
+        for name, state in schedule.items():
+            if name in self.queues:
+                self.queues[name].restore(state)
+
+
+FUZZY_THRESHOLD = 0.6
+# Trigrams shared by more names than this only refine scores, they do not
+# nominate candidates (think "son" or "  a").
+FUZZY_MAX_POSTING = 2000
+
+
+def name_key(name: str) -> str:
+    return name.strip().casefold()
+
+
+def trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(query: str, key: str) -> float:
+    return SequenceMatcher(None, query, key).ratio()
+
+
+def prefix_score(query: str, key: str) -> float:
+    # Always above any fuzzy score, closer to 1 the more of the name was typed.
+    return 0.5 + 0.5 * len(query) / len(key)
+
+
+class NameIndex:
+    def __init__(self) -> None:
+        self._ids: Dict[str, List[int]] = {}
+        self._names = SortedKeys()
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, name: str, ticket_id: int) -> None:
+        key = name_key(name)
+        ids = self._ids.get(key)
+        if ids is not None:
+            ids.append(ticket_id)
+            return
+        self._ids[key] = [ticket_id]
+        self._names.add(key)
+        for gram in trigrams(key):
+            self._grams.setdefault(gram, set()).add(key)
+
+    def remove(self, name: str, ticket_id: int) -> None:
+        key = name_key(name)
+        ids = self._ids.get(key)
+        if ids is None or ticket_id not in ids:
+            return
+        ids.remove(ticket_id)
+        if ids:
+            return
+        del self._ids[key]
+        self._names.remove(key)
+        for gram in trigrams(key):
+            names = self._grams[gram]
+            names.discard(key)
+            if not names:
+                del self._grams[gram]
+
+    def exact(self, key: str) -> List[int]:
+        return list(self._ids.get(key, ()))
+
+    def prefixed(self, key: str, limit: int) -> List[str]:
+        found = []
+        for name in self._names.iter_from(key):
+            if not name.startswith(key) or len(found) >= limit:
+                break
+            found.append(name)
+        return found
+
+    def similar(self, key: str, limit: int) -> List[Tuple[float, str]]:
+        query_grams = trigrams(key)
+        postings = sorted((self._grams.get(g, set()) for g in query_grams), key=len)
+        votes: Counter = Counter()
+        for n, names in enumerate(postings):
+            if n >= 2 and len(names) > FUZZY_MAX_POSTING:
+                break
+            votes.update(names)
+        scored = [(similarity(key, name), name) for name, _ in votes.most_common(limit * 8)]
+        scored = [(score, name) for score, name in scored if score >= FUZZY_THRESHOLD]
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:limit]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float, str]]:
+        return rank_names(name_key(query), key_exists=self._ids.__contains__,
+                          prefixed=self.prefixed, similar=self.similar, limit=limit)
+
+
+def rank_names(key: str, key_exists, prefixed, similar, limit: int) -> List[Tuple[str, float, str]]:
+    """(name key, score, "exact" | "prefix" | "fuzzy") best first, one row per name"""
+    if not key:
+        return []
+    ranked: List[Tuple[str, float, str]] = []
+    if key_exists(key):
+        ranked.append((key, 1.0, "exact"))
+    prefixes = [(prefix_score(key, name), name) for name in prefixed(key, limit + 1) if name != key]
+    prefixes.sort(key=lambda pair: (-pair[0], pair[1]))
+    ranked += [(name, score, "prefix") for score, name in prefixes]
+    seen = {name for name, _, _ in ranked}
+    if len(ranked) < limit:
+        ranked += [(name, 0.5 * score, "fuzzy") for score, name in similar(key, limit) if name not in seen]
+    return ranked[:limit]
@@ -0,0 +1,317 @@
+"""
+Queue Metrics - operation counters and latency histograms for queue_app
+
+instrument(name) wraps a function so every call counts towards operation
+name: calls, errors, bytes read and written, and a latency histogram.
+Histograms are HDR-style: bucket edges are log-linear, 16 sub-buckets per
+power of two, so any latency from 1 ns to about 18 minutes lands in a
+bucket less than 1/16 (6.25%) wider than itself, and recording one is an
+index computation and an increment. Percentiles report the upper edge of
+their bucket.
+
+Bytes are counted where the stores touch files (log, checkpoints, record
+files, history archive) into one per-thread total, written bytes shifted
+above read ones; an instrumented call takes the difference across itself,
+so a call nested in another counts towards both, and a call that touched no
+file pays one comparison for it. SQLite does its own I/O, which is not
+counted.
+
+Set QUEUE_APP_METRICS=0 to leave functions instrumented after that
+unwrapped altogether (set_enabled(True) cannot measure them later), or call
+set_enabled(False) to turn measuring off; an instrumented call then costs
+one flag check. prometheus_text() renders everything in the Prometheus text
+format, and write_prometheus() replaces a file with it atomically (what the
+node exporter's textfile collector expects).
+"""
+
+import os
+import threading
+from functools import wraps
+from time import perf_counter_ns
+from typing import Dict, Any, Callable, List, Optional, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Sub-buckets per power of two, as a bit count (16 -> 6.25% resolution).
+SUB_BITS = 4
+SUB_COUNT = 1 << SUB_BITS
+# Latencies past 2 ** MAX_BITS ns (about 18 minutes) share the last bucket.
+MAX_BITS = 40
+BUCKETS = (MAX_BITS - SUB_BITS) * SUB_COUNT + 2 * SUB_COUNT
+PERCENTILES = (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("p999", 0.999))
+# Prometheus "le" bounds: powers of two from ~1 us to ~17 s, all bucket edges.
+EXPORT_BOUNDS = tuple(1 << bits for bits in range(10, 35))
+PROMETHEUS_PREFIX = "queue_app"
+# Written bytes sit this many bits above read ones in _ThreadState.io.
+WRITTEN_SHIFT = 64
+READ_MASK = (1 << WRITTEN_SHIFT) - 1
+
+enabled = os.environ.get("QUEUE_APP_METRICS", "1") != "0"
+
+
+class _ThreadState:
+    # Running byte totals of one thread: read + written << WRITTEN_SHIFT, so
+    # one read tells whether a call did any I/O.
+    __slots__ = ("io",)
+
+    def __init__(self) -> None:
+        self.io = 0
+
+
+class _Local(threading.local):
+    def __init__(self) -> None:
+        self.state = _ThreadState()
+
+
+_local = _Local()
+
+
+def count_read(n: int) -> None:
+    """Storage code: n bytes were read from a file on this thread."""
+    _local.state.io += n
+
+
+def count_written(n: int) -> None:
+    """Storage code: n bytes were written to a file on this thread."""
+    _local.state.io += n << WRITTEN_SHIFT
+
+
+def bucket_index(ns: int) -> int:
+    shift = ns.bit_length() - SUB_BITS - 1
+    if shift <= 0:
+        return ns if ns > 0 else 0
+    return min((shift << SUB_BITS) + (ns >> shift), BUCKETS - 1)
+
+
+def bucket_upper(index: int) -> int:
+    """Exclusive upper edge of a bucket, in ns"""
+    if index < 2 * SUB_COUNT:
+        return index + 1
+    shift = (index >> SUB_BITS) - 1
+    return ((index & (SUB_COUNT - 1)) + SUB_COUNT + 1) << shift
+
+
+class _Shard:
+    # One thread's counts of one operation. Only that thread writes to it,
+    # so recording takes no lock; readers add the shards up. Calls are not
+    # counted as they happen: totals() sums the histogram. state is the
+    # owning thread's, so a call reaches both with one thread-local lookup.
+    __slots__ = ("calls", "errors", "bytes_read", "bytes_written", "total_ns", "max_ns", "counts", "state")
+
+    def __init__(self, state: Optional[_ThreadState] = None) -> None:
+        self.state = state
+        self.calls = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.counts = [0] * BUCKETS
+
+    def add_io(self, io: int) -> None:
+        # A difference of _ThreadState.io across a call.
+        self.bytes_read += io & READ_MASK
+        self.bytes_written += io >> WRITTEN_SHIFT
+
+
+class Operation:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+        self.here = threading.local()
+
+    def shard(self) -> _Shard:
+        """This thread's shard, created on first use"""
+        shard = getattr(self.here, "shard", None)
+        if shard is None:
+            shard = self.here.shard = _Shard(_local.state)
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def record(self, ns: int, io: int = 0, failed: bool = False) -> None:
+        shard = self.shard()
+        shard.counts[bucket_index(ns)] += 1
+        shard.total_ns += ns
+        if ns > shard.max_ns:
+            shard.max_ns = ns
+        if io:
+            shard.add_io(io)
+        if failed:
+            shard.errors += 1
+
+    def reset(self) -> None:
+        # In place: the owning threads keep their shards. A call finishing
+        # on another thread meanwhile may leave part of itself behind.
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            shard.__init__(shard.state)
+
+    def totals(self) -> _Shard:
+        """Every thread's counts added up"""
+        with self._lock:
+            shards = list(self._shards)
+        total = _Shard()
+        for shard in shards:
+            total.errors += shard.errors
+            total.bytes_read += shard.bytes_read
+            total.bytes_written += shard.bytes_written
+            total.total_ns += shard.total_ns
+            total.max_ns = max(total.max_ns, shard.max_ns)
+            total.counts = [a + b for a, b in zip(total.counts, shard.counts)]
+        total.calls = sum(total.counts)
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.totals()
+        calls = total.calls
+        summary: Dict[str, Any] = {
+            "calls": calls, "errors": total.errors,
+            "mean_us": total.total_ns / calls / 1000 if calls else None,
+            "max_us": total.max_ns / 1000 if calls else None,
+            "bytes_read": total.bytes_read, "bytes_written": total.bytes_written,
+        }
+        for label, fraction in PERCENTILES:
+            ns = percentile(total, fraction)
+            summary[f"{label}_us"] = None if ns is None else ns / 1000
+        return summary
+
+
+def percentile(counts: _Shard, fraction: float) -> Optional[int]:
+    """Upper edge (ns) of the bucket holding the given share of calls"""
+    if not counts.calls:
+        return None
+    rank = max(round(fraction * counts.calls), 1)
+    seen = 0
+    for index, count in enumerate(counts.counts):
+        seen += count
+        if seen >= rank:
+            return min(bucket_upper(index), counts.max_ns)
+    return counts.max_ns
+
+
+_operations: Dict[str, Operation] = {}
+_registry_lock = threading.Lock()
+
+
+def operation(name: str) -> Operation:
+    with _registry_lock:
+        op = _operations.get(name)
+        if op is None:
+            op = _operations[name] = Operation(name)
+        return op
+
+
+def set_enabled(flag: bool) -> None:
+    global enabled
+    enabled = bool(flag)
+
+
+def instrument(name: str) -> Callable[[F], F]:
+    """Decorator: time every call of the function as operation name."""
+    op = operation(name)
+
+    def decorate(func: F) -> F:
+        if not enabled:
+            # Off from the start (QUEUE_APP_METRICS=0): nothing to pay per call.
+            return func
+        # Globals bound as closure variables: cheaper to reach on every call.
+        here, clock, bits, last = op.here, perf_counter_ns, SUB_BITS, BUCKETS - 1
+
+        @wraps(func)
+        def measured(*args: Any, **kwargs: Any) -> Any:
+            if not enabled:
+                return func(*args, **kwargs)
+            try:
+                shard = here.shard
+            except AttributeError:
+                shard = op.shard()
+            state = shard.state
+            io = state.io
+            start = clock()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                op.record(clock() - start, state.io - io, failed=True)
+                raise
+            ns = clock() - start
+            # Operation.record, inlined: this runs on every call.
+            shift = ns.bit_length() - bits - 1
+            if shift > 0:
+                index = (shift << bits) + (ns >> shift)
+                shard.counts[index if index < last else last] += 1
+            else:
+                shard.counts[ns if ns > 0 else 0] += 1
+            shard.total_ns += ns
+            if ns > shard.max_ns:
+                shard.max_ns = ns
+            if state.io != io:
+                shard.add_io(state.io - io)
+            return result
+        return measured  # type: ignore[return-value]
+    return decorate
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """Summary per operation that has been called at least once"""
+    with _registry_lock:
+        ops = sorted(_operations.items())
+    summaries = ((name, op.stats()) for name, op in ops)
+    return {name: summary for name, summary in summaries if summary["calls"]}
+
+
+def reset() -> None:
+    with _registry_lock:
+        ops = list(_operations.values())
+    for op in ops:
+        op.reset()
+
+
+def prometheus_text() -> str:
+    p = PROMETHEUS_PREFIX
+    with _registry_lock:
+        ops = sorted(_operations.items())
+    lines: List[str] = []
+    sections = (
+        ("calls_total", "counter", "Calls of each queue_app operation.", lambda t: [("", "", t.calls)]),
+        ("errors_total", "counter", "Calls that raised.", lambda t: [("", "", t.errors)]),
+        ("read_bytes_total", "counter", "Bytes read from storage files.", lambda t: [("", "", t.bytes_read)]),
+        ("written_bytes_total", "counter", "Bytes written to storage files.",
+         lambda t: [("", "", t.bytes_written)]),
+        ("duration_seconds", "histogram", "Time per call.", _histogram_samples),
+    )
+    totals = [(name, op.totals()) for name, op in ops]
+    for suffix, kind, help_text, samples in sections:
+        metric = f"{p}_operation_{suffix}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for name, total in totals:
+            for sample, labels, value in samples(total):
+                lines.append(f'{metric}{sample}{{operation="{name}"{labels}}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def _histogram_samples(total: _Shard) -> List[Tuple[str, str, Any]]:
+    # (name suffix, extra labels, value) rows of one operation's histogram.
+    rows: List[Tuple[str, str, Any]] = []
+    seen = 0
+    index = 0
+    for bound in EXPORT_BOUNDS:
+        # Every bound is a bucket edge, so the cumulative counts are exact.
+        while index < BUCKETS and bucket_upper(index) <= bound:
+            seen += total.counts[index]
+            index += 1
+        rows.append(("_bucket", f',le="{bound / 1e9:.9g}"', seen))
+    rows.append(("_bucket", ',le="+Inf"', total.calls))
+    rows.append(("_sum", "", f"{total.total_ns / 1e9:.9f}"))
+    rows.append(("_count", "", total.calls))
+    return rows
+
+
+def write_prometheus(path: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
@@ -0,0 +1,320 @@
+"""
+Queue Records - compact ticket records for queue_app
+
+A Ticket holds one waiting entry in __slots__ instead of a dict: timestamps
+are integer epoch microseconds, and names, queue and lane labels are
+interned, so a thousand tickets for "Ann" at the "main" desk share three
+strings. It reads like the dict it replaces (ticket["joined_at"] is ISO text
+again, .get and dict(ticket) work), so code written against dict entries
+keeps working; to_dict() gives the JSON form back. Fields a Ticket has no
+slot for, and timestamps that would not come back as the same text, ride
+along in a small extra dict.
+
+RecordFile is the on-disk form: a header, then one fixed-width struct record
+per ticket sorted by id, then a string table the records point into. Opened
+through mmap, get(ticket_id) is a binary search that unpacks only the
+records it visits; iterating unpacks them in bulk.
+"""
+
+import gc
+import json
+from functools import lru_cache
+import mmap
+import struct
+import sys
+import zlib
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from queue_index import DEFAULT_LANE, DEFAULT_QUEUE
+from queue_metrics import count_read
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+MAGIC = b"QTKREC01"
+# magic, record count, byte offset of the string table
+HEADER = struct.Struct("<8sQQ")
+# id, joined, called, name, queue, lane, extra (string refs), number
+RECORD = struct.Struct("<qqqIIIIi4x")
+STRING_LEN = struct.Struct("<I")
+NO_TIME = -(1 << 63)
+NO_NUMBER = -(1 << 31)
+
+# Keys with a slot of their own, in the order a dict entry lists them.
+SLOT_KEYS = ("id", "name", "joined_at", "queue", "lane", "number", "called_at")
+_SLOTTED = frozenset(SLOT_KEYS)
+
+
+def to_micros(dt_iso: str) -> int:
+    dt = datetime.fromisoformat(dt_iso)
+    if dt.tzinfo is None:
+        dt = dt.astimezone()
+    return (dt - EPOCH) // MICROSECOND
+
+
+def from_micros(micros: int) -> str:
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+@lru_cache(maxsize=256)
+def _stamp(dt_iso: str) -> Tuple[int, bool]:
+    # (microseconds, whether from_micros gives the same text back); a batch
+    # of adds shares one timestamp, so recent ones are remembered.
+    micros = to_micros(dt_iso)
+    return micros, from_micros(micros) == dt_iso
+
+
+class Ticket(Mapping):
+    __slots__ = ("id", "name", "joined", "queue", "lane", "number", "called", "extra")
+
+    def __init__(self, id: int, name: str, joined: int, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE,
+                 number: Optional[int] = None, called: Optional[int] = None,
+                 extra: Optional[Dict[str, Any]] = None) -> None:
+        self.id = id
+        self.name = name
+        self.joined = joined
+        self.queue = queue
+        self.lane = lane
+        self.number = number
+        self.called = called
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, entry: Dict[str, Any]) -> "Ticket":
+        if isinstance(entry, Ticket):
+            return entry
+        extra: Dict[str, Any] = {}
+        joined, exact = _stamp(entry["joined_at"])
+        if not exact:
+            extra["joined_at"] = entry["joined_at"]
+        called = None
+        if "called_at" in entry:
+            called, exact = _stamp(entry["called_at"])
+            if not exact:
+                extra["called_at"] = entry["called_at"]
+        for key, value in entry.items():
+            if key not in SLOT_KEYS:
+                extra[key] = value
+        return cls(
+            entry["id"], sys.intern(entry["name"]), joined,
+            sys.intern(entry.get("queue", DEFAULT_QUEUE)), sys.intern(entry.get("lane", DEFAULT_LANE)),
+            entry.get("number"), called, extra or None,
+        )
+
+    # ---- the dict view ----
+
+    def keys(self) -> List[str]:
+        keys = ["id", "name", "joined_at"]
+        if self.queue != DEFAULT_QUEUE:
+            keys.append("queue")
+        if self.lane != DEFAULT_LANE:
+            keys.append("lane")
+        if self.number is not None:
+            keys.append("number")
+        if self.called is not None:
+            keys.append("called_at")
+        if self.extra:
+            keys += [key for key in self.extra if key not in SLOT_KEYS]
+        return keys
+
+    def __getitem__(self, key: str) -> Any:
+        extra = self.extra
+        if extra is not None and key in extra:
+            return extra[key]
+        if key == "id":
+            return self.id
+        if key == "name":
+            return self.name
+        if key == "joined_at":
+            return from_micros(self.joined)
+        if key == "queue" and self.queue != DEFAULT_QUEUE:
+            return self.queue
+        if key == "lane" and self.lane != DEFAULT_LANE:
+            return self.lane
+        if key == "number" and self.number is not None:
+            return self.number
+        if key == "called_at" and self.called is not None:
+            return from_micros(self.called)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # queue_of and lane_of run on every scheduling step, and the seat
+        # lookup on every append: skip the KeyError.
+        if key == "queue":
+            return self.queue if self.queue != DEFAULT_QUEUE else default
+        if key == "lane":
+            return self.lane if self.lane != DEFAULT_LANE else default
+        if key not in _SLOTTED:
+            extra = self.extra
+            return default if extra is None else extra.get(key, default)
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        return self.get(key, self) is not self
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Built directly rather than through keys(): this runs once per row
+        # of every listing and export. Extras keep keys() order, as an
+        # override lands on the slot key already there.
+        entry = {"id": self.id, "name": self.name, "joined_at": from_micros(self.joined)}
+        if self.queue != DEFAULT_QUEUE:
+            entry["queue"] = self.queue
+        if self.lane != DEFAULT_LANE:
+            entry["lane"] = self.lane
+        if self.number is not None:
+            entry["number"] = self.number
+        if self.called is not None:
+            entry["called_at"] = from_micros(self.called)
+        if self.extra:
+            entry.update(self.extra)
+        return entry
+
+    def __repr__(self) -> str:
+        return f"Ticket({self.to_dict()!r})"
+
+
+# ---- binary record files ----
+
+def encode_records(tickets: Iterable[Dict[str, Any]]) -> bytes:
+    """RecordFile bytes for tickets (Tickets or dict entries), sorted by id"""
+    records = sorted((Ticket.from_dict(t) for t in tickets), key=lambda t: t.id)
+    refs: Dict[str, int] = {"": 0}
+    strings: List[bytes] = [b""]
+
+    def ref(text: str) -> int:
+        found = refs.get(text)
+        if found is None:
+            found = refs[text] = len(strings)
+            strings.append(text.encode("utf-8"))
+        return found
+
+    body = bytearray(HEADER.size + RECORD.size * len(records))
+    offset = HEADER.size
+    for t in records:
+        extra = ref(json.dumps(t.extra, separators=(",", ":"))) if t.extra else 0
+        RECORD.pack_into(
+            body, offset, t.id, t.joined, NO_TIME if t.called is None else t.called,
+            ref(t.name), ref(t.queue), ref(t.lane), extra, NO_NUMBER if t.number is None else t.number,
+        )
+        offset += RECORD.size
+    HEADER.pack_into(body, 0, MAGIC, len(records), offset)
+    for raw in strings:
+        body += STRING_LEN.pack(len(raw))
+        body += raw
+    return bytes(body)
+
+
+class RecordFile:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._ids: Optional[memoryview] = None
+        magic, self._count, self._strings_at = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a ticket record file: {path}")
+        self._strings: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _string_table(self) -> List[str]:
+        if self._strings is None:
+            strings = []
+            offset = self._strings_at
+            end = len(self._map)
+            while offset < end:
+                (size,) = STRING_LEN.unpack_from(self._map, offset)
+                offset += STRING_LEN.size
+                strings.append(sys.intern(self._map[offset:offset + size].decode("utf-8")))
+                offset += size
+            self._strings = strings
+        return self._strings
+
+    def _ticket(self, fields: tuple) -> Ticket:
+        tid, joined, called, name, queue, lane, extra, number = fields
+        strings = self._strings if self._strings is not None else self._string_table()
+        return Ticket(
+            tid, strings[name], joined, strings[queue], strings[lane],
+            None if number == NO_NUMBER else number, None if called == NO_TIME else called,
+            json.loads(strings[extra]) if extra else None,
+        )
+
+    def _id_at(self, index: int) -> int:
+        if self._ids is None and sys.byteorder == "little" and self._count:
+            # Every record starts with its id: a strided view of the record
+            # area as int64 words reads ids straight out of the mapping.
+            words = memoryview(self._map)[HEADER.size:self._strings_at].cast("q")
+            self._ids = words[::RECORD.size // 8]
+        if self._ids is not None:
+            return self._ids[index]
+        return struct.unpack_from("<q", self._map, HEADER.size + index * RECORD.size)[0]
+
+    def get(self, ticket_id: int) -> Optional[Ticket]:
+        lo, hi = 0, self._count
+        id_at = self._ids.__getitem__ if self._ids is not None else self._id_at
+        while lo < hi:
+            mid = (lo + hi) // 2
+            tid = id_at(mid)
+            if tid < ticket_id:
+                lo = mid + 1
+            elif tid > ticket_id:
+                hi = mid
+            else:
+                return self._ticket(RECORD.unpack_from(self._map, HEADER.size + mid * RECORD.size))
+        return None
+
+    def __iter__(self) -> Iterator[Ticket]:
+        strings = self._string_table()
+        records = memoryview(self._map)[HEADER.size:self._strings_at]
+        try:
+            for tid, joined, called, name, queue, lane, extra, number in RECORD.iter_unpack(records):
+                yield Ticket(
+                    tid, strings[name], joined, strings[queue], strings[lane],
+                    None if number == NO_NUMBER else number, None if called == NO_TIME else called,
+                    json.loads(strings[extra]) if extra else None,
+                )
+        finally:
+            records.release()
+
+    def load(self) -> List[Ticket]:
+        """Every ticket, in id order"""
+        # Tickets are tracked by the cycle collector (dicts of plain values
+        # are not), so a million of them would set it off over and over.
+        enabled = gc.isenabled()
+        gc.disable()
+        count_read(len(self._map))
+        try:
+            return list(self)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def checksum(self) -> int:
+        """CRC-32 of the whole file"""
+        return zlib.crc32(self._map)
+
+    def close(self) -> None:
+        if self._ids is not None:
+            self._ids.release()
+            self._ids = None
+        self._map.close()
+
+    def __enter__(self) -> "RecordFile":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
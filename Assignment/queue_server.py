@@ -0,0 +1,479 @@
+"""
+Queue Server - long-running queue_app daemon and its client
+
+The server keeps the store resident and answers one JSON object per line:
+    {"op": "add", "name": "Ann"}      -> {"ok": true, "result": {...}}
+    {"op": "add", "name": "Ann", "queue": "desk2", "lane": "vip"}
+    {"op": "call"}                    -> {"ok": true, "result": {...} or null}
+    {"op": "call", "queue": "desk2"}
+    {"op": "add_many", "people": ["Ann", {"name": "Bob", "lane": "vip"}], "queue": "desk2"}
+                                      -> {"ok": true, "result": [{...}, ...]}
+    {"op": "call_many", "n": 5}       -> {"ok": true, "result": [{...}, ...]}
+    {"op": "claim", "agent": "desk1", "lease": 120}
+                                      -> {"ok": true, "result": {..., "lease_until": ...} or null}
+    {"op": "complete", "id": 3, "agent": "desk1"}
+    {"op": "no_show", "id": 3, "agent": "desk1"}
+                                      -> {"ok": true, "result": {...} or null if not held}
+    {"op": "cancel", "id": 3}         -> {"ok": true, "result": {...} or null if not waiting}
+    {"op": "requeue", "id": 3, "position": 1}
+                                      -> {"ok": true, "result": {...} or null if not waiting}
+    {"op": "expire", "after": 900}    -> {"ok": true, "result": [{..., "reason": "expired"}, ...]}
+    {"op": "position", "id": 3}       -> {"ok": true, "result": 2}
+    {"op": "eta", "id": 3}            -> {"ok": true, "result": 240.5 or null}
+    {"op": "stats"}                   -> {"ok": true, "result": {"service_mean": ...}}
+    {"op": "find", "query": "ann"}    -> {"ok": true, "result": [...]}
+    {"op": "search", "query": "an"}   -> {"ok": true, "result": [...]}
+    {"op": "waiting"}                 -> {"ok": true, "result": [...]}
+    {"op": "queues"}                  -> {"ok": true, "result": {"main": 3, "desk2": 1}}
+    {"op": "history", "start": "2026-01-01T10:00:00+00:00", "end": ...}
+    {"op": "wait_stats", "start": ..., "end": ...}
+                                      -> {"ok": true, "result": {"count": ..., "p95": ...}}
+    {"op": "metrics"}                 -> {"ok": true, "result": {"add_person": {"calls": ..., "p99_us": ...}}}
+    {"op": "metrics", "format": "prometheus"}
+                                      -> {"ok": true, "result": "# HELP ..."}
+Errors come back as {"ok": false, "error": "..."}.
+
+{"op": "subscribe", "queue": "main"} (queue optional) turns the connection
+into a push stream: after the ok reply, every change arrives as one event
+line (see queue_events). The same port speaks Server-Sent Events to
+"GET /events?queue=main" for browser displays. Each event is encoded once,
+however many subscribers there are.
+
+While metrics are on, the server also rewrites queue_app.METRICS_FILE every
+METRICS_INTERVAL seconds for a Prometheus textfile collector to pick up. With
+queue_app.NO_SHOW_AFTER set, it cancels tickets that have waited longer
+than that every SWEEP_INTERVAL seconds.
+
+Addresses are "host:port" for TCP or "unix:/path/to/socket".
+"""
+
+import asyncio
+import json
+import os
+import socket
+from typing import Dict, Any, Callable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import queue_app
+import queue_metrics
+from queue_index import DEFAULT_LANE, DEFAULT_QUEUE
+
+DEFAULT_ADDRESS = "127.0.0.1:7345"
+# Subscribers further behind than this many unsent bytes are dropped.
+MAX_BACKLOG = 1 << 20
+# How often the store is checked for changes written by other processes
+# while anyone is subscribed.
+WATCH_INTERVAL = 0.25
+# Seconds between rewrites of the metrics file.
+METRICS_INTERVAL = 15.0
+# Seconds between sweeps for no-shows, when queue_app.NO_SHOW_AFTER is set.
+SWEEP_INTERVAL = 30.0
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def _op_add(req: Dict[str, Any]) -> Any:
+    return queue_app.add_person(req.get("name", ""), req.get("queue") or DEFAULT_QUEUE, req.get("lane") or DEFAULT_LANE)
+
+
+def _op_call(req: Dict[str, Any]) -> Any:
+    return queue_app.call_next(req.get("queue") or DEFAULT_QUEUE)
+
+
+def _op_add_many(req: Dict[str, Any]) -> Any:
+    return queue_app.add_people(req.get("people") or [], req.get("queue") or DEFAULT_QUEUE, req.get("lane") or DEFAULT_LANE)
+
+
+def _op_call_many(req: Dict[str, Any]) -> Any:
+    return queue_app.call_next_n(int(req.get("n", 1)), req.get("queue") or DEFAULT_QUEUE)
+
+
+def _op_claim(req: Dict[str, Any]) -> Any:
+    lease = float(req.get("lease") or queue_app.LEASE_SECONDS)
+    return queue_app.claim_next(str(req.get("agent", "")), lease, req.get("queue") or DEFAULT_QUEUE)
+
+
+def _op_complete(req: Dict[str, Any]) -> Any:
+    return queue_app.complete(int(req["id"]), str(req.get("agent", "")))
+
+
+def _op_no_show(req: Dict[str, Any]) -> Any:
+    return queue_app.no_show(int(req["id"]), str(req.get("agent", "")))
+
+
+def _op_cancel(req: Dict[str, Any]) -> Any:
+    return queue_app.cancel_ticket(int(req["id"]))
+
+
+def _op_requeue(req: Dict[str, Any]) -> Any:
+    return queue_app.requeue_ticket(int(req["id"]), int(req["position"]))
+
+
+def _op_expire(req: Dict[str, Any]) -> Any:
+    return queue_app.expire_waiting(float(req.get("after") or queue_app.NO_SHOW_AFTER))
+
+
+def _op_position(req: Dict[str, Any]) -> Any:
+    return queue_app.get_position(int(req["id"]))
+
+
+def _op_eta(req: Dict[str, Any]) -> Any:
+    return queue_app.get_eta(int(req["id"]))
+
+
+def _op_stats(req: Dict[str, Any]) -> Any:
+    return queue_app.service_stats(req.get("queue") or DEFAULT_QUEUE)
+
+
+def _op_find(req: Dict[str, Any]) -> Any:
+    return queue_app.find_person(str(req.get("query", "")))
+
+
+def _op_search(req: Dict[str, Any]) -> Any:
+    return queue_app.search_person(str(req.get("query", "")), int(req.get("limit", 10)))
+
+
+def _op_waiting(req: Dict[str, Any]) -> Any:
+    return queue_app.get_store().waiting(req.get("queue") or DEFAULT_QUEUE)
+
+
+def _op_queues(req: Dict[str, Any]) -> Any:
+    return queue_app.list_queues()
+
+
+def _op_history(req: Dict[str, Any]) -> Any:
+    return queue_app.history_between(req.get("start"), req.get("end"))
+
+
+def _op_wait_stats(req: Dict[str, Any]) -> Any:
+    return queue_app.wait_stats(req.get("start"), req.get("end"))
+
+
+def _op_metrics(req: Dict[str, Any]) -> Any:
+    if req.get("format") == "prometheus":
+        return queue_metrics.prometheus_text()
+    return queue_app.operation_stats()
+
+
+def _op_ping(req: Dict[str, Any]) -> Any:
+    return "pong"
+
+
+OPS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "add": _op_add,
+    "call": _op_call,
+    "add_many": _op_add_many,
+    "call_many": _op_call_many,
+    "claim": _op_claim,
+    "complete": _op_complete,
+    "no_show": _op_no_show,
+    "cancel": _op_cancel,
+    "requeue": _op_requeue,
+    "expire": _op_expire,
+    "position": _op_position,
+    "eta": _op_eta,
+    "stats": _op_stats,
+    "find": _op_find,
+    "search": _op_search,
+    "waiting": _op_waiting,
+    "queues": _op_queues,
+    "history": _op_history,
+    "wait_stats": _op_wait_stats,
+    "metrics": _op_metrics,
+    "ping": _op_ping,
+}
+
+
+def parse_request(line: bytes) -> Dict[str, Any]:
+    req = json.loads(line)
+    if not isinstance(req, dict):
+        raise ValueError("A request must be a JSON object")
+    return req
+
+
+def handle_line(line: bytes) -> bytes:
+    try:
+        req = parse_request(line)
+        handler = OPS.get(req.get("op"))
+        if handler is None:
+            raise ValueError(f"Unknown op: {req.get('op')!r}")
+        reply = {"ok": True, "result": handler(req)}
+    except (ValueError, KeyError, TypeError) as e:
+        reply = {"ok": False, "error": str(e)}
+    except Exception as e:
+        # A field of the wrong type deep in a handler, or a storage failure:
+        # this request fails, the connection carries on.
+        reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    return json.dumps(reply, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class Fanout:
+    """Subscribed connections, by queue (None for all) and wire format."""
+
+    def __init__(self) -> None:
+        self.streams: Dict[Optional[str], Set[asyncio.StreamWriter]] = {}
+        self.sse: Dict[Optional[str], Set[asyncio.StreamWriter]] = {}
+
+    def __bool__(self) -> bool:
+        return any(self.streams.values()) or any(self.sse.values())
+
+    def add(self, writer: asyncio.StreamWriter, queue: Optional[str], sse: bool) -> None:
+        (self.sse if sse else self.streams).setdefault(queue, set()).add(writer)
+
+    def discard(self, writer: asyncio.StreamWriter) -> None:
+        for group in (self.streams, self.sse):
+            for writers in group.values():
+                writers.discard(writer)
+
+    def _targets(self, group: Dict[Optional[str], Set[asyncio.StreamWriter]], queue: Optional[str]) -> List[asyncio.StreamWriter]:
+        if queue is None:
+            return [w for writers in group.values() for w in writers]
+        return list(group.get(None, ())) + list(group.get(queue, ()))
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        payload = json.dumps(event, separators=(",", ":")).encode("utf-8")
+        frames = ((self.streams, payload + b"\n"), (self.sse, b"data: " + payload + b"\n\n"))
+        for group, frame in frames:
+            for writer in self._targets(group, event.get("queue")):
+                if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                    self.discard(writer)
+                    writer.close()
+                else:
+                    writer.write(frame)
+
+
+_fanout = Fanout()
+# (store, unsubscribe) of the one subscription feeding every connection.
+_feed: Optional[Tuple[Any, Callable[[], None]]] = None
+
+
+def _ensure_feed() -> None:
+    # get_store() also catches up on the log, which publishes changes made
+    # by other processes. The feed moves along if queue_app swaps stores.
+    global _feed
+    store = queue_app.get_store()
+    if _feed is None or _feed[0] is not store:
+        if _feed is not None:
+            _feed[1]()
+        _feed = (store, store.subscribe(_fanout.publish))
+
+
+async def _hold(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, queue: Optional[str], sse: bool) -> None:
+    _ensure_feed()
+    _fanout.add(writer, queue, sse)
+    try:
+        # Nothing more is expected from the client; wait for it to hang up.
+        while await reader.read(4096):
+            pass
+    finally:
+        _fanout.discard(writer)
+
+
+async def _serve_sse(request_line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    while (await reader.readline()).strip():
+        pass  # headers
+    target = urlsplit(request_line.split()[1].decode("latin-1"))
+    if target.path != "/events":
+        writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        return
+    queue = parse_qs(target.query).get("queue", [None])[0]
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+        b"Connection: keep-alive\r\n\r\n"
+    )
+    await _hold(reader, writer, queue, sse=True)
+
+
+async def _serve_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        line = await reader.readline()
+        if line.startswith(b"GET "):
+            await _serve_sse(line, reader, writer)
+            return
+        while line:
+            # A cheap check first; handle_line parses every other request.
+            if b'"subscribe"' in line:
+                try:
+                    req = parse_request(line)
+                except ValueError:
+                    req = {}  # handle_line replies with the error
+                if req.get("op") == "subscribe":
+                    writer.write(b'{"ok":true,"result":"subscribed"}\n')
+                    await _hold(reader, writer, req.get("queue"), sse=False)
+                    return
+            # Store calls are short in-memory updates plus one log append,
+            # so they run inline on the event loop and need no locking.
+            writer.write(handle_line(line))
+            await writer.drain()
+            line = await reader.readline()
+    except (ConnectionResetError, BrokenPipeError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _watch_store() -> None:
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        if _fanout:
+            _ensure_feed()
+
+
+async def _export_metrics() -> None:
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        if queue_metrics.enabled:
+            try:
+                queue_app.export_metrics()
+            except OSError as e:
+                print(f"Could not write {queue_app.METRICS_FILE}: {e}")
+
+
+async def _sweep_no_shows() -> None:
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            queue_app.expire_waiting()
+        except OSError as e:
+            print(f"No-show sweep failed: {e}")
+
+
+async def serve(address: str = DEFAULT_ADDRESS) -> None:
+    kind, target = parse_address(address)
+    queue_app.get_store()
+    if kind == "unix":
+        if os.path.exists(target):
+            os.unlink(target)
+        server = await asyncio.start_unix_server(_serve_client, path=target)
+    else:
+        server = await asyncio.start_server(_serve_client, host=target[0], port=target[1])
+    print(f"Queue server listening on {address}")
+    watcher = asyncio.ensure_future(_watch_store())
+    exporter = asyncio.ensure_future(_export_metrics())
+    tasks = [watcher, exporter]
+    if queue_app.NO_SHOW_AFTER > 0:
+        tasks.append(asyncio.ensure_future(_sweep_no_shows()))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def run_server(address: str = DEFAULT_ADDRESS) -> None:
+    try:
+        asyncio.run(serve(address))
+    except KeyboardInterrupt:
+        print("\nServer stopped.")
+    finally:
+        queue_app.get_store().close()
+
+
+class QueueClient:
+    def __init__(self, address: str = DEFAULT_ADDRESS, timeout: Optional[float] = 10.0) -> None:
+        kind, target = parse_address(address)
+        if kind == "unix":
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(target)
+        else:
+            self.sock = socket.create_connection(target, timeout=timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, op: str, **args: Any) -> Any:
+        self.file.write(json.dumps({"op": op, **args}, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Queue server closed the connection.")
+        reply = json.loads(line)
+        if not reply.get("ok"):
+            raise ValueError(reply.get("error", "request failed"))
+        return reply["result"]
+
+    def add_person(self, name: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
+        return self.request("add", name=name, queue=queue, lane=lane)
+
+    def call_next(self, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        return self.request("call", queue=queue)
+
+    def add_people(self, people: List[Any], queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> List[Dict[str, Any]]:
+        return self.request("add_many", people=people, queue=queue, lane=lane)
+
+    def call_next_n(self, n: int, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        return self.request("call_many", n=n, queue=queue)
+
+    def claim_next(self, agent_id: str, lease_seconds: Optional[float] = None,
+                   queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        return self.request("claim", agent=agent_id, lease=lease_seconds, queue=queue)
+
+    def complete(self, ticket_id: int, agent_id: str) -> Optional[Dict[str, Any]]:
+        return self.request("complete", id=ticket_id, agent=agent_id)
+
+    def no_show(self, ticket_id: int, agent_id: str) -> Optional[Dict[str, Any]]:
+        return self.request("no_show", id=ticket_id, agent=agent_id)
+
+    def cancel_ticket(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        return self.request("cancel", id=ticket_id)
+
+    def requeue_ticket(self, ticket_id: int, position: int) -> Optional[Dict[str, Any]]:
+        return self.request("requeue", id=ticket_id, position=position)
+
+    def expire_waiting(self, max_wait: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self.request("expire", after=max_wait)
+
+    def get_position(self, ticket_id: int) -> Optional[int]:
+        return self.request("position", id=ticket_id)
+
+    def get_eta(self, ticket_id: int) -> Optional[float]:
+        return self.request("eta", id=ticket_id)
+
+    def service_stats(self, queue: str = DEFAULT_QUEUE) -> Dict[str, Any]:
+        return self.request("stats", queue=queue)
+
+    def find_person(self, query: str) -> List[Dict[str, Any]]:
+        return self.request("find", query=query)
+
+    def search_person(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return self.request("search", query=query, limit=limit)
+
+    def waiting(self, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        return self.request("waiting", queue=queue)
+
+    def queues(self) -> Dict[str, int]:
+        return self.request("queues")
+
+    def subscribe(self, queue: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Turn this connection into an event stream (of one queue, if given)."""
+        self.request("subscribe", queue=queue)
+        self.sock.settimeout(None)
+        return (json.loads(line) for line in self.file)
+
+    def history_between(self, start: Optional[str] = None, end: Optional[str] = None) -> List[Dict[str, Any]]:
+        return self.request("history", start=start, end=end)
+
+    def wait_stats(self, start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+        return self.request("wait_stats", start=start, end=end)
+
+    def operation_stats(self) -> Dict[str, Dict[str, Any]]:
+        return self.request("metrics")
+
+    def prometheus_text(self) -> str:
+        return self.request("metrics", format="prometheus")
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "QueueClient":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
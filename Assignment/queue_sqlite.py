@@ -0,0 +1,815 @@
+"""
+Queue SQLite - SQLite storage backend for queue_app
+
+Every ticket is one row keyed by its id. Waiting tickets have no called_at,
+so the called_at index (which carries the rowid) keeps call_next and position
+lookups off the history rows entirely.
+
+Names are keyed casefolded, so exact and prefix matches ride idx_tickets_name.
+name_grams maps each distinct name to its trigrams for typo-tolerant search;
+ranking is shared with LogStore through queue_index.rank_names.
+
+Time-range queries narrow on idx_tickets_called with ISO bounds a day wider
+than asked, then compare exact epoch seconds from SQLite's strftime('%s').
+
+Named queues and lanes are columns on the ticket. The lanes table holds each
+lane's stride-scheduling pass and waiting count, so call_next picks its lane
+from a handful of rows and its ticket from the partial idx_tickets_order
+index, with the same integer arithmetic LogStore uses. Waiting tickets are
+ordered by COALESCE(seat, id): seat is only set on a requeued ticket, to
+the same fractional value LogStore gives it (queue_index.place_seat). A
+requeue finds its neighbours with OFFSET, which walks the index: SQLite
+has no order statistics. Cancelled tickets are deleted outright. Each queue's
+service-rate estimator is one JSON row in service_rate, updated inside the
+same transaction as the call it observes.
+
+Leases are columns too: a claimed ticket has called_at, agent and
+lease_until, so it is out of the waiting index at once, and the partial
+idx_tickets_leased index finds the first expired lease of a queue. Claims
+run in BEGIN IMMEDIATE transactions, which SQLite serializes across threads
+and processes alike: every thread gets its own connection.
+
+Events (queue_events) are published for changes made through this
+connection only; other processes' writes are not seen.
+
+Migrate an existing JSON store:
+    python queue_sqlite.py import data/queue.json [data/queue.db]
+"""
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from queue_index import (
+    DEFAULT_LANE, DEFAULT_QUEUE, FUZZY_MAX_POSTING, FUZZY_THRESHOLD, LANE_WEIGHTS, STRIDE,
+    interleave, lane_rank, name_key, place_seat, queue_of, rank_for, rank_names, similarity, stride_position,
+    trigrams,
+)
+from queue_checkpoint import read_checked
+from queue_events import EventBus
+from queue_stats import ServiceRate, summarize_waits, to_seconds
+from queue_store import QueueStore, LogStore, LEASE_FIELDS, SNAPSHOT_NAME, LOG_NAME
+
+DB_NAME = "queue.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    joined_at TEXT NOT NULL,
+    called_at TEXT,
+    queue TEXT NOT NULL DEFAULT 'main',
+    lane TEXT NOT NULL DEFAULT 'normal',
+    number INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_name ON tickets(name_key);
+CREATE INDEX IF NOT EXISTS idx_tickets_joined ON tickets(joined_at);
+CREATE INDEX IF NOT EXISTS idx_tickets_called ON tickets(called_at);
+CREATE TABLE IF NOT EXISTS name_grams (
+    gram TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    PRIMARY KEY (gram, name_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS lanes (
+    queue TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    pass INTEGER NOT NULL,
+    waiting INTEGER NOT NULL,
+    PRIMARY KEY (queue, lane)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS service_rate (
+    queue TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('next_id', 1);
+"""
+
+# Added after the tables existed; open() adds them to older databases first.
+LATE_COLUMNS = {
+    "queue": "TEXT NOT NULL DEFAULT 'main'",
+    "lane": "TEXT NOT NULL DEFAULT 'normal'",
+    "number": "INTEGER",
+    "agent": "TEXT",
+    "lease_until": "REAL",
+    "outcome": "TEXT",
+    "finished_at": "TEXT",
+    "seat": "REAL",
+}
+LATE_SCHEMA = """
+DROP INDEX IF EXISTS idx_tickets_waiting;
+CREATE INDEX IF NOT EXISTS idx_tickets_order ON tickets(queue, lane, COALESCE(seat, id)) WHERE called_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_tickets_seated ON tickets(id) WHERE seat IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_tickets_leased ON tickets(queue, lease_until, id) WHERE lease_until IS NOT NULL;
+"""
+# Optional columns, in the order LogStore adds them to a ticket.
+TICKET_EXTRAS = ("number", "seat", "called_at", "agent", "lease_until", "outcome", "finished_at")
+
+# Waiting rows first (put in queue order by _results), then leased rows by id,
+# then called rows in the order they were called, as LogStore lists them.
+RESULT_ORDER = (
+    "ORDER BY called_at IS NOT NULL, lease_until IS NULL, CASE WHEN lease_until IS NULL THEN called_at END, id"
+)
+CALLED_EPOCH = "CAST(strftime('%s', called_at) AS INTEGER)"
+JOINED_EPOCH = "CAST(strftime('%s', joined_at) AS INTEGER)"
+# Open leases are not history yet.
+WINDOW = (
+    f"called_at >= ? AND called_at < ? AND {CALLED_EPOCH} >= ? AND {CALLED_EPOCH} < ? AND lease_until IS NULL"
+)
+
+
+def _window_args(start: int, end: int) -> tuple:
+    # The text bounds only have to be loose enough for any UTC offset.
+    def iso(epoch: int, default: str) -> str:
+        try:
+            return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+        except (OverflowError, OSError, ValueError):
+            return default
+    return iso(start - 86400, ""), iso(end + 86400, "\uffff"), start, end
+
+
+def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+    entry = {"id": row["id"], "name": row["name"], "joined_at": row["joined_at"]}
+    if row["queue"] != DEFAULT_QUEUE:
+        entry["queue"] = row["queue"]
+    if row["lane"] != DEFAULT_LANE:
+        entry["lane"] = row["lane"]
+    for field in TICKET_EXTRAS:
+        if row[field] is not None:
+            entry[field] = row[field]
+    return entry
+
+
+def _row_to_result(row: sqlite3.Row) -> Dict[str, Any]:
+    if row["called_at"] is None:
+        status = "waiting"
+    else:
+        status = "called" if row["lease_until"] is None else "leased"
+    return {"status": status, **_row_to_entry(row)}
+
+
+class SQLiteStore(QueueStore):
+    def __init__(self, data_dir: str, db_name: str = DB_NAME,
+                 lanes: Optional[Dict[str, int]] = None, numbering: str = "global") -> None:
+        self.data_dir = data_dir
+        self.db_path = os.path.join(data_dir, db_name)
+        self.lanes = lanes or LANE_WEIGHTS
+        self.numbering = numbering
+        self.events = EventBus()
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._opened = False
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        return getattr(self._local, "conn", None)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Only this thread uses it; close() may come from any thread.
+        conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        with self._conns_lock:
+            self._conns.append(conn)
+        return conn
+
+    def open(self) -> None:
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir, exist_ok=True)
+        if self.conn is None:
+            self._connect()
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(LATE_SCHEMA)
+        if self.conn.execute("SELECT 1 FROM name_grams LIMIT 1").fetchone() is None:
+            # Databases from before name search: backfill the trigram table.
+            self.conn.execute("BEGIN IMMEDIATE")
+            keys = [row[0] for row in self.conn.execute("SELECT DISTINCT name_key FROM tickets")]
+            self._index_names(keys)
+            self.conn.execute("COMMIT")
+        self._opened = True
+
+    def _migrate(self) -> None:
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(tickets)")}
+        for column, decl in LATE_COLUMNS.items():
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE tickets ADD COLUMN {column} {decl}")
+        rate_columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(service_rate)")}
+        if "queue" not in rate_columns:
+            # The single-queue estimator table; the estimate rebuilds itself.
+            self.conn.execute("DROP TABLE service_rate")
+            self.conn.execute("CREATE TABLE service_rate (queue TEXT PRIMARY KEY, state TEXT NOT NULL)")
+        if "queue" not in columns:
+            # Every waiting ticket of an older database is in the default lane.
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lanes (queue, lane, pass, waiting)"
+                " SELECT queue, lane, 0, COUNT(*) FROM tickets WHERE called_at IS NULL GROUP BY queue, lane"
+            )
+
+    def _index_names(self, keys: Iterable[str]) -> None:
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO name_grams (gram, name_key) VALUES (?, ?)",
+            ((gram, key) for key in set(keys) for gram in trigrams(key)),
+        )
+
+    def refresh(self) -> None:
+        if self.conn is None:
+            if self._opened:
+                self._connect()
+            else:
+                self.open()
+
+    def close(self) -> None:
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._local = threading.local()
+        self._opened = False
+
+    # ---- mutations ----
+
+    def _meta(self, key: str, default: int) -> int:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key: str, value: int) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _interleaved(self, queue: str) -> bool:
+        # As QueueSet.interleaved: more than one lane of queue has tickets waiting.
+        row = self.conn.execute("SELECT COUNT(*) FROM lanes WHERE queue = ? AND waiting > 0", (queue,)).fetchone()
+        return row[0] > 1
+
+    def _lane_state(self, queue: str) -> Dict[str, Tuple[int, int]]:
+        rows = self.conn.execute("SELECT lane, pass, waiting FROM lanes WHERE queue = ?", (queue,))
+        return {row["lane"]: (row["pass"], row["waiting"]) for row in rows}
+
+    def add(self, name: str, at: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
+        return self.add_many([(name, at, queue, lane)])[0]
+
+    def add_many(self, people: Iterable[Tuple[str, str, str, str]]) -> List[Dict[str, Any]]:
+        """Add (name, at, queue, lane) tuples in one transaction; all of them or none."""
+        people = list(people)
+        for _, _, _, lane in people:
+            if lane not in self.lanes:
+                raise ValueError(f"Unknown lane: {lane!r} (lanes: {', '.join(self.lanes)})")
+        if not people:
+            return []
+        self.refresh()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first_id = conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()[0]
+            # Lane and numbering state is read once per queue, advanced in
+            # memory ticket by ticket, and written back once.
+            lanes: Dict[str, Dict[str, List[int]]] = {}
+            numbers: Dict[str, int] = {}
+            rows = []
+            entries = []
+            positions = []
+            for ticket_id, (name, at, queue, lane) in enumerate(people, first_id):
+                state = lanes.get(queue)
+                if state is None:
+                    state = lanes[queue] = {k: list(v) for k, v in self._lane_state(queue).items()}
+                    if self.numbering == "queue":
+                        numbers[queue] = self._meta(f"next_number:{queue}", 1)
+                number = None
+                if self.numbering == "queue":
+                    number = numbers[queue]
+                    numbers[queue] = number + 1
+                counts = state.get(lane)
+                if counts is None or not counts[1]:
+                    # A lane coming back from idle starts level with the others.
+                    pass_ = max(counts[0] if counts else 0, self._meta(f"vtime:{queue}", 0))
+                    state[lane] = [pass_, 1]
+                else:
+                    counts[1] += 1
+                if self.events:
+                    # The new ticket is last in its lane: the position it
+                    # had as of its own add, as a single add would report.
+                    rank = state[lane][1]
+                    positions.append(rank if len(state) == 1 else stride_position(
+                        rank, lane, {k: tuple(v) for k, v in state.items()}, self.lanes))
+                key = name_key(name)
+                rows.append((ticket_id, name, key, at, queue, lane, number))
+                entry = {"id": ticket_id, "name": name, "joined_at": at}
+                if queue != DEFAULT_QUEUE:
+                    entry["queue"] = queue
+                if lane != DEFAULT_LANE:
+                    entry["lane"] = lane
+                if number is not None:
+                    entry["number"] = number
+                entries.append(entry)
+            conn.executemany(
+                "INSERT INTO tickets (id, name, name_key, joined_at, queue, lane, number)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO lanes (queue, lane, pass, waiting) VALUES (?, ?, ?, ?)",
+                ((queue, lane, pass_, waiting)
+                 for queue, state in lanes.items() for lane, (pass_, waiting) in state.items()),
+            )
+            for queue, number in numbers.items():
+                self._set_meta(f"next_number:{queue}", number)
+            self._index_names(row[2] for row in rows)
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'next_id'", (first_id + len(rows),))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if self.events:
+            for entry, position in zip(entries, positions):
+                self.events.publish({
+                    "op": "add", "queue": queue_of(entry), "id": entry["id"],
+                    "position": position, "ticket": dict(entry),
+                })
+        return entries
+
+    def _serve(self, queue: str, at: str, rate: ServiceRate) -> Optional[sqlite3.Row]:
+        # Inside a transaction: mark the queue's next waiting ticket called
+        # and count it towards the service rate (saved by the caller).
+        conn = self.conn
+        lanes = {lane: state for lane, state in self._lane_state(queue).items() if state[1]}
+        if not lanes:
+            return None
+        lane = min(lanes, key=lambda name: (lanes[name][0], lane_rank(name, self.lanes)))
+        row = conn.execute(
+            "SELECT * FROM tickets WHERE queue = ? AND lane = ? AND called_at IS NULL"
+            " ORDER BY COALESCE(seat, id) LIMIT 1",
+            (queue, lane),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE tickets SET called_at = ?, seat = NULL WHERE id = ?", (at, row["id"]))
+        if sum(waiting for _, waiting in lanes.values()) == 1:
+            # An idle queue starts over, as in LogStore.
+            conn.execute("DELETE FROM lanes WHERE queue = ?", (queue,))
+            conn.execute("DELETE FROM meta WHERE key = ?", (f"vtime:{queue}",))
+        else:
+            self._set_meta(f"vtime:{queue}", lanes[lane][0])
+            conn.execute(
+                "UPDATE lanes SET pass = pass + ?, waiting = waiting - 1 WHERE queue = ? AND lane = ?",
+                (STRIDE // self.lanes.get(lane, 1), queue, lane),
+            )
+        rate.observe(at, row["joined_at"])
+        return row
+
+    def _expired_lease(self, queue: str, at: str) -> Optional[sqlite3.Row]:
+        return self.conn.execute(
+            "SELECT * FROM tickets WHERE queue = ? AND lease_until IS NOT NULL AND lease_until <= ?"
+            " ORDER BY lease_until, id LIMIT 1",
+            (queue, to_seconds(at)),
+        ).fetchone()
+
+    def _dispatch(self, queue: str, at: str, agent: Optional[str], until: Optional[float],
+                  n: int = 1) -> List[Dict[str, Any]]:
+        # call and claim: an expired lease first, else the next waiting
+        # ticket; up to n of them in one transaction.
+        self.refresh()
+        conn = self.conn
+        served = []
+        rate = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for _ in range(n):
+                row = self._expired_lease(queue, at)
+                reclaimed = row is not None
+                if row is None:
+                    if rate is None:
+                        rate = self._load_rate(queue)
+                    row = self._serve(queue, at, rate)
+                if row is None:
+                    break
+                conn.execute(
+                    "UPDATE tickets SET called_at = ?, agent = ?, lease_until = ? WHERE id = ?",
+                    (at, agent, until, row["id"]),
+                )
+                served.append((row, reclaimed))
+            if rate is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO service_rate (queue, state) VALUES (?, ?)",
+                    (queue, json.dumps(rate.to_dict(), separators=(",", ":"))),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        results = []
+        for row, reclaimed in served:
+            person_called = {k: v for k, v in _row_to_entry(row).items() if k not in LEASE_FIELDS and k != "seat"}
+            person_called["called_at"] = at
+            if agent is not None:
+                person_called["agent"] = agent
+            if self.events:
+                op = "reclaim" if reclaimed else "call"
+                self.events.publish({"op": op, "queue": queue, "id": row["id"], "ticket": dict(person_called)})
+            if until is not None:
+                person_called["lease_until"] = until
+            results.append(person_called)
+        return results
+
+    def call(self, at: str, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        called = self._dispatch(queue, at, None, None)
+        return called[0] if called else None
+
+    def call_many(self, n: int, at: str, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        return self._dispatch(queue, at, None, None, n)
+
+    def claim(self, agent: str, at: str, lease_seconds: float, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        claimed = self._dispatch(queue, at, agent, to_seconds(at) + lease_seconds)
+        return claimed[0] if claimed else None
+
+    def _finish(self, ticket_id: int, agent: str, at: str, outcome: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM tickets WHERE id = ? AND lease_until IS NOT NULL AND agent = ?", (ticket_id, agent)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE tickets SET lease_until = NULL, outcome = ?, finished_at = ? WHERE id = ?",
+                    (outcome, at, ticket_id),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        person_called = {k: v for k, v in _row_to_entry(row).items() if k != "lease_until"}
+        person_called["outcome"] = outcome
+        person_called["finished_at"] = at
+        if self.events:
+            self.events.publish({"op": "finish", "queue": row["queue"], "id": ticket_id, "ticket": dict(person_called)})
+        return person_called
+
+    def complete(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        return self._finish(ticket_id, agent, at, "served")
+
+    def no_show(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        return self._finish(ticket_id, agent, at, "no_show")
+
+    def _drop(self, row: sqlite3.Row, at: str, reason: Optional[str]) -> Tuple[Dict[str, Any], Optional[int], bool]:
+        # Inside a transaction: delete a waiting ticket, as LogStore's cancel
+        # record does. (the cancelled ticket, its position before, whether
+        # listeners must re-read positions).
+        conn = self.conn
+        position = self._position(row) if self.events else None
+        resync = position is not None and self._interleaved(row["queue"])
+        conn.execute("DELETE FROM tickets WHERE id = ?", (row["id"],))
+        conn.execute(
+            "UPDATE lanes SET waiting = waiting - 1 WHERE queue = ? AND lane = ?", (row["queue"], row["lane"])
+        )
+        if not conn.execute("SELECT SUM(waiting) FROM lanes WHERE queue = ?", (row["queue"],)).fetchone()[0]:
+            conn.execute("DELETE FROM lanes WHERE queue = ?", (row["queue"],))
+            conn.execute("DELETE FROM meta WHERE key = ?", (f"vtime:{row['queue']}",))
+        key = row["name_key"]
+        if conn.execute("SELECT 1 FROM tickets WHERE name_key = ? LIMIT 1", (key,)).fetchone() is None:
+            conn.executemany(
+                "DELETE FROM name_grams WHERE gram = ? AND name_key = ?", ((gram, key) for gram in trigrams(key))
+            )
+        cancelled = {k: v for k, v in _row_to_entry(row).items() if k != "seat"}
+        cancelled["cancelled_at"] = at
+        if reason is not None:
+            cancelled["reason"] = reason
+        return cancelled, position, resync
+
+    def _cancel(self, pick: Callable[[], List[sqlite3.Row]], at: str,
+                reason: Optional[str] = None) -> List[Dict[str, Any]]:
+        # Delete the waiting rows pick() chooses, all in one transaction.
+        self.refresh()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            dropped = [self._drop(row, at, reason) for row in pick()]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if self.events:
+            for cancelled, position, resync in dropped:
+                self.events.publish({
+                    "op": "cancel", "queue": queue_of(cancelled), "id": cancelled["id"],
+                    "position": position, "ticket": dict(cancelled),
+                })
+                if resync:
+                    self.events.publish({"op": "sync", "queue": queue_of(cancelled)})
+        return [cancelled for cancelled, _, _ in dropped]
+
+    def cancel(self, ticket_id: int, at: str) -> Optional[Dict[str, Any]]:
+        def pick() -> List[sqlite3.Row]:
+            return self.conn.execute(
+                "SELECT * FROM tickets WHERE id = ? AND called_at IS NULL", (ticket_id,)
+            ).fetchall()
+        cancelled = self._cancel(pick, at)
+        return cancelled[0] if cancelled else None
+
+    def expire(self, before: float, at: str) -> List[Dict[str, Any]]:
+        def pick() -> List[sqlite3.Row]:
+            # Each lane from its head until someone joined late enough; tickets
+            # join in id order, so only requeued ones need a separate look.
+            stale = []
+            for queue, lane in self.conn.execute("SELECT queue, lane FROM lanes WHERE waiting > 0").fetchall():
+                for row in self._lane_rows(queue, lane):
+                    if row["seat"] is not None:
+                        continue
+                    if to_seconds(row["joined_at"]) >= before:
+                        break
+                    stale.append(row)
+            # A call clears seat, so every seated row is waiting.
+            rows = self.conn.execute("SELECT * FROM tickets WHERE seat IS NOT NULL")
+            stale += [row for row in rows if to_seconds(row["joined_at"]) < before]
+            return sorted(stale, key=lambda row: row["id"])
+        return self._cancel(pick, at, "expired")
+
+    def requeue(self, ticket_id: int, position: int, at: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT * FROM tickets WHERE id = ? AND called_at IS NULL", (ticket_id,)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            before = self._position(row) if self.events else None
+            queue, lane = row["queue"], row["lane"]
+            lanes = self._lane_state(queue)
+            rank = rank_for(max(int(position), 1), lane, lanes, self.lanes)
+            # The rest of the lane in order, without the ticket being moved.
+            others = (
+                "FROM tickets WHERE queue = ? AND lane = ? AND called_at IS NULL AND id != ?"
+                " ORDER BY COALESCE(seat, id) LIMIT ? OFFSET ?"
+            )
+
+            def seat_at(index: int) -> float:
+                args = (queue, lane, ticket_id, 1, index)
+                return conn.execute(f"SELECT COALESCE(seat, id) {others}", args).fetchone()[0]
+            first, seats = place_seat(seat_at, lanes[lane][1] - 1, rank, self._meta("next_id", 1))
+            ids = [r[0] for r in conn.execute(f"SELECT id {others}", (queue, lane, ticket_id, len(seats) - 1, first))]
+            ids.insert(rank - 1 - first, ticket_id)
+            conn.executemany(
+                "UPDATE tickets SET seat = ? WHERE id = ?",
+                ((None if seat == tid else seat, tid) for tid, seat in zip(ids, seats)),
+            )
+            row = conn.execute("SELECT * FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+            after = self._position(row) if self.events else None
+            resync = sum(1 for _, waiting in lanes.values() if waiting) > 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        entry = {k: v for k, v in _row_to_entry(row).items() if k != "seat"}
+        if self.events:
+            self.events.publish({
+                "op": "requeue", "queue": queue, "id": ticket_id, "from": before, "position": after,
+                "ticket": dict(entry),
+            })
+            if resync:
+                self.events.publish({"op": "sync", "queue": queue})
+        return entry
+
+    def reset(self) -> None:
+        self.replace({"next_id": 1, "queue": [], "history": []})
+
+    # ---- queries ----
+
+    def _lane_rows(self, queue: str, lane: str, limit: int = -1, offset: int = 0) -> sqlite3.Cursor:
+        return self.conn.execute(
+            "SELECT * FROM tickets WHERE queue = ? AND lane = ? AND called_at IS NULL"
+            " ORDER BY COALESCE(seat, id) LIMIT ? OFFSET ?",
+            (queue, lane, limit, offset),
+        )
+
+    def waiting(self, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        return list(self.iter_waiting(queue))
+
+    def iter_waiting(self, queue: str = DEFAULT_QUEUE, start: int = 0,
+                     stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        self.refresh()
+        lanes = {lane: pass_ for lane, (pass_, waiting) in self._lane_state(queue).items() if waiting}
+        if len(lanes) == 1:
+            # One lane is plain id order: SQLite skips to start in the index.
+            rows = self._lane_rows(queue, next(iter(lanes)), -1 if stop is None else max(stop - start, 0), start)
+        else:
+            # One open cursor per lane, merged as they are read; no lane
+            # gives more than stop rows. Rows skipped to reach start are
+            # never turned into dicts.
+            limit = -1 if stop is None else stop
+            merged = interleave({lane: (pass_, self._lane_rows(queue, lane, limit)) for lane, pass_ in lanes.items()},
+                                self.lanes)
+            rows = islice(merged, start, stop)
+        return (_row_to_entry(r) for r in rows)
+
+    def queues(self) -> Dict[str, int]:
+        self.refresh()
+        rows = self.conn.execute("SELECT queue, SUM(waiting) FROM lanes GROUP BY queue HAVING SUM(waiting) > 0")
+        return {row[0]: row[1] for row in rows}
+
+    def position(self, ticket_id: int) -> Optional[int]:
+        self.refresh()
+        row = self.conn.execute(
+            "SELECT id, queue, lane, seat, called_at IS NULL AS waiting FROM tickets WHERE id = ?", (ticket_id,)
+        ).fetchone()
+        if row is None or not row["waiting"]:
+            return None
+        return self._position(row)
+
+    def _position(self, row: sqlite3.Row) -> int:
+        seat = row["id"] if row["seat"] is None else row["seat"]
+        rank = self.conn.execute(
+            "SELECT COUNT(*) FROM tickets WHERE queue = ? AND lane = ? AND called_at IS NULL"
+            " AND COALESCE(seat, id) <= ?",
+            (row["queue"], row["lane"], seat),
+        ).fetchone()[0]
+        lanes = self._lane_state(row["queue"])
+        if len(lanes) == 1:
+            return rank
+        return stride_position(rank, row["lane"], lanes, self.lanes)
+
+    def find_id(self, ticket_id: int) -> List[Dict[str, Any]]:
+        self.refresh()
+        rows = self.conn.execute("SELECT * FROM tickets WHERE id = ?", (ticket_id,))
+        return [_row_to_result(r) for r in rows]
+
+    def _results(self, rows: Iterable[sqlite3.Row]) -> List[Dict[str, Any]]:
+        # Rows in RESULT_ORDER, with the waiting ones sorted by queue position:
+        # lanes and requeues make that differ from id order.
+        rows = list(rows)
+        waiting = sum(1 for row in rows if row["called_at"] is None)
+        if waiting > 1:
+            rows[:waiting] = sorted(rows[:waiting], key=lambda row: (self._position(row), row["id"]))
+        return [_row_to_result(row) for row in rows]
+
+    def find_name(self, name: str) -> List[Dict[str, Any]]:
+        self.refresh()
+        rows = self.conn.execute(
+            f"SELECT * FROM tickets WHERE name_key = ? {RESULT_ORDER}", (name_key(name),)
+        )
+        return self._results(rows)
+
+    def _key_exists(self, key: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM tickets WHERE name_key = ? LIMIT 1", (key,)).fetchone() is not None
+
+    def _prefixed(self, key: str, limit: int) -> List[str]:
+        # Every key starting with `key` sorts in [key, key + U+10FFFF).
+        rows = self.conn.execute(
+            "SELECT DISTINCT name_key FROM tickets WHERE name_key >= ? AND name_key < ? ORDER BY name_key LIMIT ?",
+            (key, key + "\U0010ffff", limit),
+        )
+        return [row[0] for row in rows]
+
+    def _similar(self, key: str, limit: int) -> List[Tuple[float, str]]:
+        grams = list(trigrams(key))
+        marks = ",".join("?" * len(grams))
+        sizes = self.conn.execute(
+            f"SELECT gram FROM name_grams WHERE gram IN ({marks}) GROUP BY gram HAVING COUNT(*) <= ?",
+            (*grams, FUZZY_MAX_POSTING),
+        )
+        grams = [row[0] for row in sizes]
+        if not grams:
+            return []
+        marks = ",".join("?" * len(grams))
+        rows = self.conn.execute(
+            f"SELECT name_key FROM name_grams WHERE gram IN ({marks})"
+            f" GROUP BY name_key ORDER BY COUNT(*) DESC, name_key LIMIT ?",
+            (*grams, limit * 8),
+        )
+        scored = [(similarity(key, row[0]), row[0]) for row in rows]
+        scored = [(score, name) for score, name in scored if score >= FUZZY_THRESHOLD]
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:limit]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        self.refresh()
+        ranked = rank_names(name_key(query), self._key_exists, self._prefixed, self._similar, limit)
+        results: List[Dict[str, Any]] = []
+        for key, score, kind in ranked:
+            rows = self.conn.execute(f"SELECT * FROM tickets WHERE name_key = ? {RESULT_ORDER}", (key,))
+            results += [{"match": kind, "score": round(score, 3), **result} for result in self._results(rows)]
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    def called_between(self, start: int, end: int) -> List[Dict[str, Any]]:
+        self.refresh()
+        rows = self.conn.execute(
+            f"SELECT * FROM tickets WHERE {WINDOW} ORDER BY {CALLED_EPOCH}, called_at, id", _window_args(start, end)
+        )
+        return [_row_to_entry(r) for r in rows]
+
+    def wait_stats(self, start: int, end: int) -> Dict[str, Any]:
+        self.refresh()
+        rows = self.conn.execute(
+            f"SELECT {CALLED_EPOCH} - {JOINED_EPOCH} FROM tickets WHERE {WINDOW}", _window_args(start, end)
+        )
+        return summarize_waits(row[0] for row in rows)
+
+    def _load_rate(self, queue: str) -> ServiceRate:
+        row = self.conn.execute("SELECT state FROM service_rate WHERE queue = ?", (queue,)).fetchone()
+        return ServiceRate.from_dict(json.loads(row[0]) if row else None)
+
+    def service_rate(self, queue: str = DEFAULT_QUEUE) -> ServiceRate:
+        self.refresh()
+        return self._load_rate(queue)
+
+    def state(self) -> Dict[str, Any]:
+        self.refresh()
+        next_id = self.conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()[0]
+        history = self.conn.execute(
+            "SELECT * FROM tickets WHERE called_at IS NOT NULL AND lease_until IS NULL ORDER BY called_at, id"
+        )
+        waiting = self.conn.execute("SELECT * FROM tickets WHERE called_at IS NULL ORDER BY queue, lane, COALESCE(seat, id)")
+        leases = self.conn.execute("SELECT * FROM tickets WHERE lease_until IS NOT NULL ORDER BY called_at, id")
+        return {
+            "next_id": next_id,
+            "queue": [_row_to_entry(r) for r in waiting],
+            "leases": [_row_to_entry(r) for r in leases],
+            "history": [_row_to_entry(r) for r in history],
+        }
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        self.refresh()
+        conn = self.conn
+        tickets = list(data.get("history", [])) + list(data.get("leases", [])) + list(data.get("queue", []))
+        rows = [
+            (p["id"], p["name"], name_key(p["name"]), p["joined_at"], p.get("queue", DEFAULT_QUEUE),
+             p.get("lane", DEFAULT_LANE), *(p.get(field) for field in TICKET_EXTRAS))
+            for p in tickets
+        ]
+        extras = ", ".join(TICKET_EXTRAS)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM tickets")
+            conn.execute("DELETE FROM name_grams")
+            conn.execute("DELETE FROM service_rate")
+            conn.execute("DELETE FROM lanes")
+            conn.execute("DELETE FROM meta WHERE key != 'next_id'")
+            conn.executemany(
+                f"INSERT OR REPLACE INTO tickets (id, name, name_key, joined_at, queue, lane, {extras})"
+                f" VALUES ({', '.join('?' * (6 + len(TICKET_EXTRAS)))})",
+                rows,
+            )
+            self._index_names(row[2] for row in rows)
+            conn.execute(
+                "INSERT INTO lanes (queue, lane, pass, waiting)"
+                " SELECT queue, lane, 0, COUNT(*) FROM tickets WHERE called_at IS NULL GROUP BY queue, lane"
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) SELECT 'next_number:' || queue, MAX(number) + 1"
+                " FROM tickets WHERE number IS NOT NULL GROUP BY queue"
+            )
+            conn.execute(
+                "UPDATE meta SET value = ? WHERE key = 'next_id'", (data.get("next_id", 1),)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if self.events:
+            self.events.publish({"op": "sync"})
+
+    def compact(self) -> None:
+        self.refresh()
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def import_json(json_path: str, db_path: str) -> int:
+    data_dir = os.path.dirname(os.path.abspath(json_path))
+    if os.path.basename(json_path) == SNAPSHOT_NAME and os.path.exists(os.path.join(data_dir, LOG_NAME)):
+        # A LogStore directory: the checkpoint alone would miss the log tail.
+        source = LogStore(data_dir)
+        source.open()
+        data = source.state()
+        source.close()
+    else:
+        data = read_checked(json_path)
+    store = SQLiteStore(os.path.dirname(os.path.abspath(db_path)), os.path.basename(db_path))
+    store.replace(data)
+    store.close()
+    return len(data.get("queue", [])) + len(data.get("history", []))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "import":
+        print("Usage: python queue_sqlite.py import <queue.json> [queue.db]")
+        sys.exit(1)
+    source = sys.argv[2]
+    target = sys.argv[3] if len(sys.argv) > 3 else os.path.join(os.path.dirname(source), DB_NAME)
+    count = import_json(source, target)
+    print(f"Imported {count} tickets from {source} into {target}.")
@@ -0,0 +1,169 @@
+"""
+Queue Stats - wait-time arithmetic shared by the queue_app backends
+
+Timestamps are compared as integer epoch seconds. A ticket's wait is
+called_at - joined_at; summaries report count, mean, p50, p95 and max over
+whatever waits a backend's range lookup hands in.
+
+ServiceRate is the streaming side: every call updates an EWMA of the service
+time (gap since the previous call, or since the ticket joined if the desk
+sat idle) and a quantile sketch of the recent service times, both O(1). A
+waiting ticket's ETA is its position times the smoothed service time.
+"""
+
+import math
+from datetime import datetime
+from typing import Dict, Any, Iterable, Optional
+
+PERCENTILES = (("p50", 0.50), ("p95", 0.95))
+# Weight of the newest service time in the moving average.
+EWMA_ALPHA = 0.1
+# Quantiles cover the last SKETCH_WINDOW to 2 * SKETCH_WINDOW calls.
+SKETCH_WINDOW = 500
+# Sketch buckets are this close to the values they hold (relative error).
+SKETCH_ACCURACY = 0.02
+
+
+def to_seconds(dt_iso: str) -> float:
+    dt = datetime.fromisoformat(dt_iso)
+    if dt.tzinfo is None:
+        # Naive times are what a person types at the menu: local time.
+        dt = dt.astimezone()
+    return dt.timestamp()
+
+
+def to_epoch(dt_iso: str) -> int:
+    return math.floor(to_seconds(dt_iso))
+
+
+def summarize_waits(waits: Iterable[int]) -> Dict[str, Any]:
+    ordered = sorted(waits)
+    count = len(ordered)
+    summary: Dict[str, Any] = {"count": count, "mean": None, "p50": None, "p95": None, "max": None}
+    if not count:
+        return summary
+    summary["mean"] = sum(ordered) / count
+    for label, fraction in PERCENTILES:
+        # Nearest rank: the smallest wait with at least this share at or below it.
+        summary[label] = ordered[max(math.ceil(fraction * count), 1) - 1]
+    summary["max"] = ordered[-1]
+    return summary
+
+
+def parse_window(start: Optional[str], end: Optional[str]) -> tuple:
+    """(start, end) epoch bounds of a half-open window; a missing side is unbounded"""
+    lo = to_epoch(start) if start else -(2 ** 62)
+    hi = to_epoch(end) if end else 2 ** 62
+    return lo, hi
+
+
+class QuantileSketch:
+    """Log-bucketed histogram; two sketches merge by adding bucket counts."""
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY) -> None:
+        self.accuracy = accuracy
+        self._log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        merged = QuantileSketch(self.accuracy)
+        merged.buckets = dict(self.buckets)
+        for index, n in other.buckets.items():
+            merged.buckets[index] = merged.buckets.get(index, 0) + n
+        merged.zeros = self.zeros + other.zeros
+        merged.count = self.count + other.count
+        return merged
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(math.ceil(fraction * self.count), 1)
+        seen = self.zeros
+        if seen >= rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Midpoint of the bucket (gamma^(i-1), gamma^i].
+                gamma = math.exp(self._log_gamma)
+                return 2 * gamma ** index / (gamma + 1)
+        return None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"zeros": self.zeros, "buckets": {str(i): n for i, n in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls()
+        sketch.buckets = {int(i): n for i, n in data.get("buckets", {}).items()}
+        sketch.zeros = data.get("zeros", 0)
+        sketch.count = sketch.zeros + sum(sketch.buckets.values())
+        return sketch
+
+
+class ServiceRate:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.mean: Optional[float] = None
+        self.last_called: Optional[float] = None
+        # Two generations: quantiles come from both merged, and the older one
+        # is dropped every SKETCH_WINDOW calls.
+        self.current = QuantileSketch()
+        self.previous = QuantileSketch()
+
+    def observe(self, called_at: str, joined_at: str) -> None:
+        called = to_seconds(called_at)
+        started = to_seconds(joined_at)
+        if self.last_called is not None:
+            started = max(started, self.last_called)
+        service = max(called - started, 0.0)
+        self.last_called = called if self.last_called is None else max(self.last_called, called)
+        self.calls += 1
+        self.mean = service if self.mean is None else self.mean + EWMA_ALPHA * (service - self.mean)
+        self.current.add(service)
+        if self.current.count >= SKETCH_WINDOW:
+            self.previous, self.current = self.current, QuantileSketch()
+
+    def eta(self, position: Optional[int]) -> Optional[float]:
+        """Seconds until the ticket at this position is called, if there is a rate yet"""
+        if position is None or self.mean is None:
+            return None
+        return position * self.mean
+
+    def stats(self) -> Dict[str, Any]:
+        recent = self.previous.merge(self.current)
+        return {
+            "calls": self.calls,
+            "service_mean": self.mean,
+            "service_p50": recent.quantile(0.50),
+            "service_p95": recent.quantile(0.95),
+            "calls_per_hour": 3600 / self.mean if self.mean else None,
+            "last_called": self.last_called,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls, "mean": self.mean, "last_called": self.last_called,
+            "current": self.current.to_dict(), "previous": self.previous.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ServiceRate":
+        rate = cls()
+        if data:
+            rate.calls = data.get("calls", 0)
+            rate.mean = data.get("mean")
+            rate.last_called = data.get("last_called")
+            rate.current = QuantileSketch.from_dict(data.get("current", {}))
+            rate.previous = QuantileSketch.from_dict(data.get("previous", {}))
+        return rate
@@ -0,0 +1,1022 @@
+"""
+Queue Store - storage backends for queue_app
+
+QueueStore is the interface queue_app talks to. LogStore is the default
+backend: the waiting queue lives in memory, every mutation appends one compact
+JSON line to queue.log, and every so often the log is folded back into the
+queue.json checkpoint and started again from empty. Called tickets only stay
+in memory until that checkpoint; it moves them into the on-disk history
+archive (see queue_history). Waiting tickets are kept as compact Ticket
+records, and the checkpoint stores them in a binary record file
+(queue-<seq>.rec, see queue_records) that queue.json points at.
+
+Several processes can share one LogStore directory. Writers hold an exclusive
+flock on queue.lock while they catch up on the log and append, and readers a
+shared one. Durability uses group commit: after appending, a writer fsyncs
+the log only if no other process has already synced past its record, so one
+fsync covers every append that landed while the previous one was running.
+
+Agents dispatch with leases: claim takes the next ticket for one agent until
+a deadline, and complete or no_show closes it into the history. A lease that
+runs out goes back to the front: the next claim (or call) of that queue
+takes it before anyone still waiting. Claims take the same exclusive lock as
+every other write, so two agents never hold the same ticket.
+
+Waiting tickets can also leave without being called. A cancel record takes
+one out of the line (with reason "expired" when expire() swept it for
+waiting too long), and a requeue record moves one to another position; the
+index does either in logarithmic time (see queue_index). A cancelled ticket
+never reaches the history.
+
+queue.json is checksummed (see queue_checkpoint) and records the CRC of its
+record file. Each checkpoint keeps the one before it, and the log it
+replaced, as queue.prev.json and queue.prev.log. Opening a store loads the
+newest checkpoint that passes its checksums and still joins up with the logs,
+then replays the log tail; replay stops at the first torn or unreadable
+line. How much there is to replay is bounded by the compaction policy.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+from queue_checkpoint import CorruptCheckpoint, encode_checked, keep_previous, read_checked, write_atomic
+from queue_events import EventBus, Subscriber
+from queue_history import HistoryArchive
+from queue_index import (
+    DEFAULT_LANE, DEFAULT_QUEUE, LANE_WEIGHTS, NameIndex, QueueSet, name_key, queue_of, reseat,
+)
+from queue_metrics import count_read, count_written
+from queue_records import RecordFile, Ticket, encode_records
+from queue_stats import ServiceRate, summarize_waits, to_epoch, to_seconds
+
+SNAPSHOT_NAME = "queue.json"
+LOG_NAME = "queue.log"
+PREVIOUS_SNAPSHOT_NAME = "queue.prev.json"
+PREVIOUS_LOG_NAME = "queue.prev.log"
+LOCK_NAME = "queue.lock"
+SYNC_NAME = "queue.sync"
+RECORDS_PREFIX = "queue-"
+RECORDS_SUFFIX = ".rec"
+COMPACT_EVERY = 10000
+# Fields a claimed ticket carries only while its lease is open.
+LEASE_FIELDS = ("agent", "lease_until")
+
+
+def empty_state() -> Dict[str, Any]:
+    return {"next_id": 1, "queue": [], "history": [], "log_seq": 0}
+
+
+def _reseat_ticket(entry: Dict[str, Any], seat: float) -> Ticket:
+    return Ticket.from_dict(reseat(entry, seat))
+
+
+def _parse_record(raw: bytes) -> Optional[Dict[str, Any]]:
+    # None for a line a crash left torn or garbled.
+    if not raw.endswith(b"\n"):
+        return None
+    try:
+        rec = json.loads(raw)
+    except ValueError:
+        return None
+    return rec if isinstance(rec, dict) and "op" in rec else None
+
+
+class QueueStore:
+    """Interface shared by every queue_app storage backend"""
+
+    def open(self) -> None:
+        raise NotImplementedError
+
+    def refresh(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+    def add(self, name: str, at: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def add_many(self, people: Iterable[Tuple[str, str, str, str]]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def call(self, at: str, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def call_many(self, n: int, at: str, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def claim(self, agent: str, at: str, lease_seconds: float, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def complete(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def no_show(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def cancel(self, ticket_id: int, at: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def requeue(self, ticket_id: int, position: int, at: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def expire(self, before: float, at: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+    def waiting(self, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def iter_waiting(self, queue: str = DEFAULT_QUEUE, start: int = 0,
+                     stop: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def queues(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def position(self, ticket_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def find_id(self, ticket_id: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def find_name(self, name: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def called_between(self, start: int, end: int) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def wait_stats(self, start: int, end: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def service_rate(self, queue: str = DEFAULT_QUEUE) -> ServiceRate:
+        raise NotImplementedError
+
+    def subscribe(self, callback: Subscriber, queue: Optional[str] = None) -> Callable[[], None]:
+        # Backends publish on self.events (see queue_events for the event shapes).
+        return self.events.subscribe(callback, queue)
+
+    def state(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def compact(self) -> None:
+        pass
+
+
+class LogStore(QueueStore):
+    def __init__(
+        self, data_dir: str, compact_every: int = COMPACT_EVERY, fsync: bool = True, compress: bool = False,
+        lanes: Optional[Dict[str, int]] = None, numbering: str = "global",
+    ) -> None:
+        self.data_dir = data_dir
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_NAME)
+        self.log_path = os.path.join(data_dir, LOG_NAME)
+        self.previous_snapshot_path = os.path.join(data_dir, PREVIOUS_SNAPSHOT_NAME)
+        self.previous_log_path = os.path.join(data_dir, PREVIOUS_LOG_NAME)
+        # Set by every recovery: the checkpoint file it started from (None
+        # for an empty state), and why any newer one was passed over.
+        self.recovered_from: Optional[str] = None
+        self.recovery_problems: List[str] = []
+        # False while queue.json is known to be damaged: it must not become
+        # the previous generation.
+        self._snapshot_intact = True
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.next_id = 1
+        # Every process sharing the directory must use the same lanes.
+        self.lanes = lanes or LANE_WEIGHTS
+        # "global": ticket ids are the numbers people see. "queue": each
+        # queue also numbers its tickets from 1.
+        self.numbering = numbering
+        self.next_numbers: Dict[str, int] = {}
+        self.queue = QueueSet(weights=self.lanes)
+        self.archive = HistoryArchive(data_dir, compress=compress, fsync=fsync)
+        # Called tickets not yet archived, tagged with the seq of their call.
+        self.recent: List[Tuple[int, Dict[str, Any]]] = []
+        self.called: Dict[int, Dict[str, Any]] = {}
+        # Claimed tickets by id: the ticket plus called_at, agent and
+        # lease_until (epoch seconds). Checkpointed in the snapshot.
+        self.leases: Dict[int, Dict[str, Any]] = {}
+        # Epoch seconds of each recent call and join, parallel to recent.
+        self._recent_called = array("q")
+        self._recent_joined = array("q")
+        self._recent_ordered = True
+        # Per queue, updated by every call record; checkpointed in the snapshot.
+        self.rates: Dict[str, ServiceRate] = {}
+        # Fed from _apply, so changes made by other processes are published
+        # too, as soon as this one catches up on the log.
+        self.events = EventBus()
+        # Built on the first name search, then kept current by _apply.
+        self._names: Optional[NameIndex] = None
+        # Archived ticket id -> (segment number, byte offset), from names.tsv.
+        self._loc_seg = array("i")
+        self._loc_off = array("q")
+        self._seg_keys: List[str] = []
+        self._seg_nums: Dict[str, int] = {}
+        self._index_loaded = 0
+        self.seq = 0
+        self.fsync_count = 0
+        self._log = None
+        self._log_inode: Optional[int] = None
+        self._log_offset = 0
+        self._log_records = 0
+        self._loaded = False
+        self._mutex = threading.RLock()
+        self._lock_fd: Optional[int] = None
+        self._lock_depth = 0
+        self._sync_fd: Optional[int] = None
+
+    # ---- locking ----
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        with self._mutex:
+            if self._lock_depth or fcntl is None:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            if self._lock_fd is None:
+                os.makedirs(self.data_dir, exist_ok=True)
+                self._lock_fd = os.open(os.path.join(self.data_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _commit(self, inode: int, offset: int) -> None:
+        # Group commit: make the log durable up to offset, unless another
+        # process's fsync already covered it while we waited for the lock.
+        if not self.fsync:
+            return
+        if fcntl is None:
+            os.fsync(self._log.fileno())
+            self.fsync_count += 1
+            return
+        if self._sync_fd is None:
+            self._sync_fd = os.open(os.path.join(self.data_dir, SYNC_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._sync_fd, fcntl.LOCK_EX)
+        try:
+            raw = os.pread(self._sync_fd, 16, 0)
+            synced_inode, synced_offset = struct.unpack("<QQ", raw) if len(raw) == 16 else (0, 0)
+            if synced_inode == inode and synced_offset >= offset:
+                return
+            if self._log_inode != inode:
+                # The log was compacted since; the fsynced snapshot holds the record.
+                return
+            size = os.fstat(self._log.fileno()).st_size
+            os.fsync(self._log.fileno())
+            self.fsync_count += 1
+            os.pwrite(self._sync_fd, struct.pack("<QQ", inode, size), 0)
+        finally:
+            fcntl.flock(self._sync_fd, fcntl.LOCK_UN)
+
+    # ---- startup / replay ----
+
+    def open(self) -> None:
+        with self._locked(exclusive=True):
+            if not os.path.isdir(self.data_dir):
+                os.makedirs(self.data_dir, exist_ok=True)
+            if not os.path.exists(self.snapshot_path):
+                self._write_snapshot(empty_state())
+            self._recover()
+            self._loaded = True
+
+    def _read_snapshot(self, path: str) -> Dict[str, Any]:
+        data = read_checked(path)
+        if data.get("queue_file"):
+            with RecordFile(os.path.join(self.data_dir, data["queue_file"])) as records:
+                if "queue_crc" in data and records.checksum() != data["queue_crc"]:
+                    raise CorruptCheckpoint(f"{data['queue_file']}: checksum mismatch")
+                data["queue"] = records.load()
+        return data
+
+    def _recover(self, repair: bool = True) -> None:
+        # The newest checkpoint that reads back intact and that the logs
+        # still continue from, then every log record after it. An empty
+        # state is the last resort, good while the log reaches back to seq 0.
+        self.archive.load()
+        problems = []
+        for path in (self.snapshot_path, self.previous_snapshot_path, None):
+            if path is None:
+                data = empty_state()
+            else:
+                try:
+                    data = self._read_snapshot(path)
+                except FileNotFoundError:
+                    continue
+                except (OSError, ValueError, struct.error) as e:
+                    problems.append(f"{os.path.basename(path)}: {e}")
+                    continue
+                if data.get("archived_seq", -1) > self.archive.archived_seq:
+                    problems.append(f"{os.path.basename(path)}: ahead of the history archive")
+                    continue
+            self._apply_snapshot(data)
+            if self._replay_logs(repair):
+                self.recovered_from = path
+                self.recovery_problems = problems
+                self._snapshot_intact = path == self.snapshot_path
+                return
+            problems.append(f"{os.path.basename(path) if path else 'empty state'}: the log does not reach back to it")
+        raise CorruptCheckpoint(f"No usable checkpoint in {self.data_dir}: " + "; ".join(problems))
+
+    def _replay_logs(self, repair: bool) -> bool:
+        # False if records between the loaded checkpoint and the log are gone.
+        self._open_log()
+        base = self._log_base()
+        if base > self.seq:
+            self._replay_file(self.previous_log_path)
+            if base > self.seq:
+                return False
+        self._replay(repair)
+        return True
+
+    def _replay_file(self, path: str) -> None:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            for raw in f:
+                rec = _parse_record(raw)
+                if rec is None or (rec["op"] == "base" and rec["seq"] > self.seq):
+                    # Torn, or a log that starts past where we are.
+                    break
+                count_read(len(raw))
+                self._apply(rec)
+
+    def _apply_snapshot(self, data: Dict[str, Any]) -> None:
+        self.next_id = data.get("next_id", 1)
+        self.seq = data.get("log_seq", 0)
+        # Only pre-archive snapshots still carry history.
+        self._set_state(data.get("queue", []), data.get("history", []), self.seq, data.get("leases", []))
+        self.queue.restore(data.get("schedule", {}))
+        for name, number in data.get("next_numbers", {}).items():
+            self.next_numbers[name] = max(self.next_numbers.get(name, 1), number)
+        # Snapshots from before named queues kept a single "rate".
+        rates = data.get("rates") or ({DEFAULT_QUEUE: data["rate"]} if "rate" in data else {})
+        self.rates = {name: ServiceRate.from_dict(rate) for name, rate in rates.items()}
+
+    def _set_state(self, queue: List[Dict[str, Any]], history: List[Dict[str, Any]], seq: int,
+                   leases: Iterable[Dict[str, Any]] = ()) -> None:
+        self.queue = QueueSet([Ticket.from_dict(p) for p in queue], weights=self.lanes)
+        self.leases = {p["id"]: p for p in leases}
+        self._forget_recent()
+        self._names = None
+        self.next_numbers = {}
+        self.rates = {}
+        for p in queue + history + list(self.leases.values()):
+            self._note_number(p)
+        if self.events:
+            self.events.publish({"op": "sync"})
+        if seq > self.archive.archived_seq:
+            for p in history:
+                self._remember(seq, p)
+
+    def _note_number(self, entry: Dict[str, Any]) -> None:
+        if "number" in entry:
+            name = queue_of(entry)
+            self.next_numbers[name] = max(self.next_numbers.get(name, 1), entry["number"] + 1)
+
+    def _remember(self, seq: int, person_called: Dict[str, Any]) -> None:
+        self.recent.append((seq, person_called))
+        self.called[person_called["id"]] = person_called
+        called_at = to_epoch(person_called["called_at"])
+        if self._recent_called and called_at < self._recent_called[-1]:
+            self._recent_ordered = False
+        self._recent_called.append(called_at)
+        self._recent_joined.append(to_epoch(person_called["joined_at"]))
+
+    def _forget_recent(self) -> None:
+        self.recent = []
+        self.called = {}
+        self._recent_called = array("q")
+        self._recent_joined = array("q")
+        self._recent_ordered = True
+
+    def _prune_recent(self) -> None:
+        archived = self.archive.archived_seq
+        if self.recent and self.recent[0][0] <= archived:
+            keep = [i for i, (s, _) in enumerate(self.recent) if s > archived]
+            self.recent = [self.recent[i] for i in keep]
+            self.called = {p["id"]: p for _, p in self.recent}
+            self._recent_called = array("q", (self._recent_called[i] for i in keep))
+            self._recent_joined = array("q", (self._recent_joined[i] for i in keep))
+            self._recent_ordered = list(self._recent_called) == sorted(self._recent_called)
+
+    def _open_log(self) -> None:
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.log_path, "a+b")
+        self._log_inode = os.fstat(self._log.fileno()).st_ino
+        self._log_offset = 0
+        self._log_records = 0
+
+    def _log_base(self) -> int:
+        # A compacted log starts with {"op":"base","seq":N}: the checkpoint
+        # it continues from already includes every record up to N.
+        self._log.seek(0)
+        rec = _parse_record(self._log.readline())
+        return rec["seq"] if rec is not None and rec["op"] == "base" else 0
+
+    def _replay(self, repair: bool = False) -> None:
+        self._log.seek(self._log_offset)
+        for raw in self._log:
+            rec = _parse_record(raw)
+            if rec is None:
+                # Torn or garbled write from a crash. Only a writer may cut
+                # it off; a reader just stops short of it.
+                if repair:
+                    self._log.truncate(self._log_offset)
+                break
+            self._log_offset += len(raw)
+            self._log_records += 1
+            count_read(len(raw))
+            self._apply(rec)
+        self._log.seek(0, os.SEEK_END)
+
+    def refresh(self) -> None:
+        with self._mutex:
+            if not self._loaded:
+                self.open()
+                return
+            with self._locked(exclusive=False):
+                self._catch_up()
+
+    def _catch_up(self, repair: bool = False) -> None:
+        try:
+            st = os.stat(self.log_path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._log_inode:
+            # Another process compacted the log. Our handle still reaches the
+            # old log, so finish reading it; then our state matches the new
+            # checkpoint and only the new log needs reading.
+            self._replay()
+            self._open_log()
+            if self._log_base() > self.seq or st is None:
+                self._recover(repair)
+            else:
+                self.archive.load()
+                self._prune_recent()
+                self._replay(repair)
+        elif st.st_size > self._log_offset:
+            self._replay(repair)
+
+    def _apply(self, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        seq = rec.get("seq", 0)
+        if seq and seq <= self.seq:
+            return None
+        self.seq = max(self.seq, seq)
+        op = rec["op"]
+        if op == "add":
+            entry = {"id": rec["id"], "name": rec["name"], "joined_at": rec["at"]}
+            for field in ("queue", "lane", "number"):
+                if field in rec:
+                    entry[field] = rec[field]
+            self._note_number(entry)
+            self.queue.append(Ticket.from_dict(entry))
+            if self._names is not None:
+                self._names.add(entry["name"], entry["id"])
+            if self.events:
+                self.events.publish({
+                    "op": "add", "queue": queue_of(entry), "id": entry["id"],
+                    "position": self.queue.position(entry["id"]), "ticket": dict(entry),
+                })
+            self.next_id = max(self.next_id, rec["id"] + 1)
+            return entry
+        if op == "call":
+            lease = self.leases.pop(rec["id"], None)
+            if lease is not None:
+                # An expired lease, called ahead of everyone waiting.
+                person_called = {k: v for k, v in lease.items() if k not in LEASE_FIELDS}
+                person_called["called_at"] = rec["at"]
+                self._publish("reclaim", person_called)
+            else:
+                person_called = self._serve(rec["id"], rec["at"])
+                if person_called is None:
+                    return None
+            if seq > self.archive.archived_seq:
+                self._remember(seq, person_called)
+            return person_called
+        if op == "claim":
+            # Popped and re-inserted, so leases stay in claim order.
+            lease = self.leases.pop(rec["id"], None)
+            if lease is not None:
+                lease = {k: v for k, v in lease.items() if k not in LEASE_FIELDS}
+                lease.update(called_at=rec["at"], agent=rec["agent"])
+                self._publish("reclaim", lease)
+            else:
+                lease = self._serve(rec["id"], rec["at"], agent=rec["agent"])
+                if lease is None:
+                    return None
+            lease["lease_until"] = rec["until"]
+            self.leases[rec["id"]] = lease
+            return dict(lease)
+        if op == "finish":
+            lease = self.leases.pop(rec["id"], None)
+            if lease is None:
+                return None
+            person_called = {k: v for k, v in lease.items() if k != "lease_until"}
+            person_called["outcome"] = rec["outcome"]
+            person_called["finished_at"] = rec["at"]
+            self._publish("finish", person_called)
+            if seq > self.archive.archived_seq:
+                self._remember(seq, person_called)
+            return person_called
+        if op == "cancel":
+            position = self.queue.position(rec["id"]) if self.events else None
+            # Behind a ticket leaving a multi-lane queue, positions shift
+            # unevenly: listeners re-read them.
+            resync = position is not None and self.queue.interleaved(queue_of(self.queue.get(rec["id"])))
+            person = self.queue.remove(rec["id"])
+            if person is None:
+                return None
+            if self._names is not None:
+                self._names.remove(person["name"], person["id"])
+            cancelled = {k: v for k, v in person.items() if k != "seat"}
+            cancelled["cancelled_at"] = rec["at"]
+            if "reason" in rec:
+                cancelled["reason"] = rec["reason"]
+            if self.events:
+                self.events.publish({
+                    "op": "cancel", "queue": queue_of(person), "id": rec["id"],
+                    "position": position, "ticket": dict(cancelled),
+                })
+                if resync:
+                    self.events.publish({"op": "sync", "queue": queue_of(person)})
+            return cancelled
+        if op == "requeue":
+            before = self.queue.position(rec["id"])
+            if before is None:
+                return None
+            # Seats stay below next_id, so whoever joins later is still behind.
+            entry = self.queue.move(rec["id"], rec["position"], self.next_id, _reseat_ticket)
+            moved = {k: v for k, v in entry.items() if k != "seat"}
+            if self.events:
+                self.events.publish({
+                    "op": "requeue", "queue": queue_of(entry), "id": rec["id"], "from": before,
+                    "position": self.queue.position(rec["id"]), "ticket": dict(moved),
+                })
+                if self.queue.interleaved(queue_of(entry)):
+                    self.events.publish({"op": "sync", "queue": queue_of(entry)})
+            return moved
+        if op == "reset":
+            self.next_id = 1
+            self._set_state([], [], seq)
+            return None
+        if op == "base":
+            return None
+        raise ValueError(f"Unknown log record: {op!r}")
+
+    def _serve(self, ticket_id: int, at: str, agent: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        # Take a waiting ticket out of the line: the one place a call is
+        # counted towards the service rate and announced as a "call" event.
+        person = self.queue.serve(ticket_id)
+        if person is None:
+            return None
+        rate = self.rates.get(queue_of(person))
+        if rate is None:
+            rate = self.rates[queue_of(person)] = ServiceRate()
+        rate.observe(at, person["joined_at"])
+        person_called = {k: v for k, v in person.items() if k != "seat"}
+        person_called["called_at"] = at
+        if agent is not None:
+            person_called["agent"] = agent
+        self._publish("call", person_called)
+        return person_called
+
+    def _publish(self, op: str, ticket: Dict[str, Any]) -> None:
+        if self.events:
+            self.events.publish({"op": op, "queue": queue_of(ticket), "id": ticket["id"], "ticket": dict(ticket)})
+
+    def _expired_lease(self, queue: str, now: float) -> Optional[Dict[str, Any]]:
+        # The lease that ran out first; a handful of agents, so a scan will do.
+        expired = [p for p in self.leases.values() if p["lease_until"] <= now and queue_of(p) == queue]
+        return min(expired, key=lambda p: (p["lease_until"], p["id"]), default=None)
+
+    # ---- mutations ----
+
+    def _append(self, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        rec["seq"] = self.seq + 1
+        line = json.dumps(rec, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._log.write(line)
+        self._log.flush()
+        count_written(len(line))
+        self._log_offset += len(line)
+        self._log_records += 1
+        return self._apply(rec)
+
+    def _compaction_due(self) -> bool:
+        # A checkpoint rewrites every waiting ticket, so with a long queue it
+        # waits for at least as many log records: a bulk load pays for each
+        # checkpoint once, not once per batch.
+        return bool(self.compact_every) and self._log_records >= max(self.compact_every, len(self.queue))
+
+    def _mutate(self, build: Callable[[], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        # build() sees caught-up state and returns the record to log, or None.
+        with self._mutex:
+            if not self._loaded:
+                self.open()
+            with self._locked(exclusive=True):
+                self._catch_up(repair=True)
+                rec = build()
+                if rec is None:
+                    return None
+                result = self._append(rec)
+                inode, offset = self._log_inode, self._log_offset
+                if self._compaction_due():
+                    self._compact()
+            self._commit(inode, offset)
+            return result
+
+    def _mutate_many(self, build: Callable[[], Iterator[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        # One lock, one write and one commit for a whole batch. build() is a
+        # generator: each record is applied before the next is built, so it
+        # sees the ids and heads the earlier ones left behind.
+        with self._mutex:
+            if not self._loaded:
+                self.open()
+            with self._locked(exclusive=True):
+                self._catch_up(repair=True)
+                start = self._log_offset
+                lines: List[bytes] = []
+                results = []
+                try:
+                    for rec in build():
+                        rec["seq"] = self.seq + 1
+                        lines.append(json.dumps(rec, separators=(",", ":")).encode("utf-8") + b"\n")
+                        results.append(self._apply(rec))
+                    if not lines:
+                        return []
+                    payload = b"".join(lines)
+                    self._log.write(payload)
+                    self._log.flush()
+                except BaseException:
+                    # Memory ran ahead of the log: cut off whatever part of
+                    # the batch reached it and rebuild from disk.
+                    self._log.truncate(start)
+                    self._recover()
+                    raise
+                count_written(len(payload))
+                self._log_offset += len(payload)
+                self._log_records += len(lines)
+                inode, offset = self._log_inode, self._log_offset
+                if self._compaction_due():
+                    self._compact()
+            self._commit(inode, offset)
+            return results
+
+    def append(self, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self._mutate(lambda: rec)
+
+    def _check_lane(self, lane: str) -> None:
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane: {lane!r} (lanes: {', '.join(self.lanes)})")
+
+    def _add_record(self, name: str, at: str, queue: str, lane: str) -> Dict[str, Any]:
+        rec = {"op": "add", "id": self.next_id, "name": name, "at": at}
+        # Defaults stay implicit, so single-queue logs look as they always did.
+        if queue != DEFAULT_QUEUE:
+            rec["queue"] = queue
+        if lane != DEFAULT_LANE:
+            rec["lane"] = lane
+        if self.numbering == "queue":
+            rec["number"] = self.next_numbers.get(queue, 1)
+        return rec
+
+    def add(self, name: str, at: str, queue: str = DEFAULT_QUEUE, lane: str = DEFAULT_LANE) -> Dict[str, Any]:
+        self._check_lane(lane)
+        return self._mutate(lambda: self._add_record(name, at, queue, lane))
+
+    def add_many(self, people: Iterable[Tuple[str, str, str, str]]) -> List[Dict[str, Any]]:
+        """Add (name, at, queue, lane) tuples in one write; all of them or none."""
+        people = list(people)
+        for _, _, _, lane in people:
+            self._check_lane(lane)
+        return self._mutate_many(lambda: (self._add_record(*person) for person in people))
+
+    def call(self, at: str, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        def build() -> Optional[Dict[str, Any]]:
+            head = self._expired_lease(queue, to_seconds(at)) if self.leases else None
+            head = head or self.queue.first(queue)
+            return None if head is None else {"op": "call", "id": head["id"], "at": at}
+        return self._mutate(build)
+
+    def call_many(self, n: int, at: str, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        """Call up to n tickets of queue, in call order, in one write."""
+        def build() -> Iterator[Dict[str, Any]]:
+            now = to_seconds(at)
+            for _ in range(n):
+                head = self._expired_lease(queue, now) if self.leases else None
+                head = head or self.queue.first(queue)
+                if head is None:
+                    return
+                yield {"op": "call", "id": head["id"], "at": at}
+        return self._mutate_many(build)
+
+    def claim(self, agent: str, at: str, lease_seconds: float, queue: str = DEFAULT_QUEUE) -> Optional[Dict[str, Any]]:
+        """Lease the next ticket of queue to agent until at + lease_seconds."""
+        def build() -> Optional[Dict[str, Any]]:
+            now = to_seconds(at)
+            head = self._expired_lease(queue, now) if self.leases else None
+            head = head or self.queue.first(queue)
+            if head is None:
+                return None
+            return {"op": "claim", "id": head["id"], "agent": agent, "at": at, "until": now + lease_seconds}
+        return self._mutate(build)
+
+    def _finish(self, ticket_id: int, agent: str, at: str, outcome: str) -> Optional[Dict[str, Any]]:
+        def build() -> Optional[Dict[str, Any]]:
+            # Only the lease holder may close it; an expired lease still
+            # counts as held until someone else claims the ticket.
+            lease = self.leases.get(ticket_id)
+            if lease is None or lease["agent"] != agent:
+                return None
+            return {"op": "finish", "id": ticket_id, "at": at, "outcome": outcome}
+        return self._mutate(build)
+
+    def complete(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        return self._finish(ticket_id, agent, at, "served")
+
+    def no_show(self, ticket_id: int, agent: str, at: str) -> Optional[Dict[str, Any]]:
+        return self._finish(ticket_id, agent, at, "no_show")
+
+    def cancel(self, ticket_id: int, at: str) -> Optional[Dict[str, Any]]:
+        """Take a waiting ticket out of the line; None if it is not waiting."""
+        def build() -> Optional[Dict[str, Any]]:
+            return {"op": "cancel", "id": ticket_id, "at": at} if ticket_id in self.queue else None
+        return self._mutate(build)
+
+    def requeue(self, ticket_id: int, position: int, at: str) -> Optional[Dict[str, Any]]:
+        """Move a waiting ticket to position (1 = next) of its queue, within its lane."""
+        def build() -> Optional[Dict[str, Any]]:
+            if ticket_id not in self.queue:
+                return None
+            return {"op": "requeue", "id": ticket_id, "position": max(int(position), 1), "at": at}
+        return self._mutate(build)
+
+    def expire(self, before: float, at: str) -> List[Dict[str, Any]]:
+        """Cancel every ticket still waiting that joined before `before` (epoch seconds), in one write."""
+        def build() -> Iterator[Dict[str, Any]]:
+            stale = self.queue.stale(lambda p: to_seconds(p["joined_at"]) < before)
+            for entry in sorted(stale, key=lambda p: p["id"]):
+                yield {"op": "cancel", "id": entry["id"], "at": at, "reason": "expired"}
+        return self._mutate_many(build)
+
+    def reset(self) -> None:
+        def build() -> Dict[str, Any]:
+            # Drop the archive first: a crash before the reset record lands
+            # leaves an empty history rather than resurrecting the old one.
+            self.archive.clear(self.seq)
+            self._forget_recent()
+            self._names = None
+            return {"op": "reset"}
+        self._mutate(build)
+
+    # ---- queries ----
+
+    def waiting(self, queue: str = DEFAULT_QUEUE) -> List[Dict[str, Any]]:
+        # In the order they will be called, lanes interleaved by weight.
+        return [p.to_dict() for p in self.iter_waiting(queue)]
+
+    def iter_waiting(self, queue: str = DEFAULT_QUEUE, start: int = 0,
+                     stop: Optional[int] = None) -> Iterator[Ticket]:
+        # The Tickets themselves (read-only mappings), taken under the mutex:
+        # a Ticket is never changed in place, so later writes do not show
+        # through. dict(ticket) or to_dict() for a plain copy.
+        with self._mutex:
+            return iter(self.queue.waiting(queue, start, stop))
+
+    def queues(self) -> Dict[str, int]:
+        return self.queue.counts()
+
+    def position(self, ticket_id: int) -> Optional[int]:
+        return self.queue.position(ticket_id)
+
+    def _name_index(self) -> NameIndex:
+        with self._locked(exclusive=False):
+            self.archive.load()
+            if self._names is None or self.archive.index_bytes < self._index_loaded:
+                self._names = NameIndex()
+                self._loc_seg = array("i")
+                self._loc_off = array("q")
+                self._index_loaded = 0
+                rows = self._load_locations()
+                for tid, _, _, name in rows:
+                    if tid not in self.called and tid not in self.queue:
+                        self._names.add(name, tid)
+                for p in self.queue:
+                    self._names.add(p["name"], p["id"])
+                for p in self.leases.values():
+                    self._names.add(p["name"], p["id"])
+                for _, p in self.recent:
+                    self._names.add(p["name"], p["id"])
+            else:
+                # Tickets archived since were already indexed while waiting
+                # or recent; only their locations are new.
+                self._load_locations()
+        return self._names
+
+    def _load_locations(self) -> List[Tuple[int, str, int, str]]:
+        rows, self._index_loaded = self.archive.read_index(self._index_loaded)
+        for tid, key, offset, _ in rows:
+            seg = self._seg_nums.get(key)
+            if seg is None:
+                seg = self._seg_nums[key] = len(self._seg_keys)
+                self._seg_keys.append(key)
+            if tid >= len(self._loc_seg):
+                grow = tid + 1 - len(self._loc_seg)
+                self._loc_seg.extend([-1] * grow)
+                self._loc_off.extend([0] * grow)
+            self._loc_seg[tid] = seg
+            self._loc_off[tid] = offset
+        return rows
+
+    def _called_record(self, ticket_id: int) -> Optional[Dict[str, Any]]:
+        person_called = self.called.get(ticket_id)
+        if person_called is not None:
+            return person_called
+        with self._locked(exclusive=False):
+            self.archive.load()
+            if self._names is None or self.archive.index_bytes < self._index_loaded:
+                return self.archive.find_id(ticket_id)
+            if self.archive.index_bytes > self._index_loaded:
+                self._load_locations()
+            if ticket_id < len(self._loc_seg) and self._loc_seg[ticket_id] >= 0:
+                key = self._seg_keys[self._loc_seg[ticket_id]]
+                return self.archive.read_at(key, self._loc_off[ticket_id])
+        return None
+
+    def _records(self, ticket_ids: List[int]) -> List[Dict[str, Any]]:
+        # Waiting tickets in queue order, then leased ones, then called ones in call order.
+        waiting = sorted((self.queue.position(tid), tid) for tid in ticket_ids if tid in self.queue)
+        results = [{"status": "waiting", **self.queue.get(tid)} for _, tid in waiting]
+        results += [{"status": "leased", **self.leases[tid]} for tid in sorted(ticket_ids) if tid in self.leases]
+        called = [self._called_record(tid) for tid in ticket_ids if tid not in self.queue and tid not in self.leases]
+        called = sorted((p for p in called if p is not None), key=lambda p: (p["called_at"], p["id"]))
+        results += [{"status": "called", **p} for p in called]
+        return results
+
+    def find_id(self, ticket_id: int) -> List[Dict[str, Any]]:
+        results = []
+        if ticket_id in self.queue:
+            results.append({"status": "waiting", **self.queue.get(ticket_id)})
+        if ticket_id in self.leases:
+            results.append({"status": "leased", **self.leases[ticket_id]})
+        person_called = self._called_record(ticket_id)
+        if person_called is not None:
+            results.append({"status": "called", **person_called})
+        return results
+
+    def find_name(self, name: str) -> List[Dict[str, Any]]:
+        return self._records(self._name_index().exact(name_key(name)))
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        index = self._name_index()
+        results: List[Dict[str, Any]] = []
+        for key, score, match in index.search(query, limit):
+            for record in self._records(index.exact(key)):
+                results.append({"match": match, "score": round(score, 3), **record})
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def _recent_window(self, start: int, end: int) -> List[int]:
+        called = self._recent_called
+        if self._recent_ordered:
+            return list(range(bisect_left(called, start), bisect_left(called, end)))
+        return [i for i, at in enumerate(called) if start <= at < end]
+
+    def called_between(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """Called tickets with start <= called_at < end (epoch seconds), in call order"""
+        with self._locked(exclusive=False):
+            entries = self.archive.called_between(start, end)
+        return entries + [self.recent[i][1] for i in self._recent_window(start, end)]
+
+    def wait_stats(self, start: int, end: int) -> Dict[str, Any]:
+        with self._locked(exclusive=False):
+            waits = self.archive.waits_between(start, end)
+        waits += [self._recent_called[i] - self._recent_joined[i] for i in self._recent_window(start, end)]
+        return summarize_waits(waits)
+
+    def service_rate(self, queue: str = DEFAULT_QUEUE) -> ServiceRate:
+        return self.rates.get(queue) or ServiceRate()
+
+    # ---- checkpoints ----
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "next_id": self.next_id,
+            "queue": [p.to_dict() for p in self.queue],
+            "leases": list(self.leases.values()),
+            "history": self.history(),
+        }
+
+    def _write_atomic(self, path: str, payload: bytes) -> None:
+        write_atomic(path, payload, self.fsync)
+
+    def _write_snapshot(self, data: Dict[str, Any], queue: Iterable[Ticket] = ()) -> None:
+        # The record file is named after the checkpoint's seq and written
+        # first, so queue.json never points at a missing or newer file.
+        queue = list(queue)
+        if self._snapshot_intact:
+            keep_previous(self.snapshot_path, self.previous_snapshot_path, self.fsync)
+        data = {**data, "archived_seq": self.archive.archived_seq}
+        if queue:
+            name = f"{RECORDS_PREFIX}{data['log_seq']}{RECORDS_SUFFIX}"
+            payload = encode_records(queue)
+            self._write_atomic(os.path.join(self.data_dir, name), payload)
+            data.update(queue=[], queue_file=name, queue_crc=zlib.crc32(payload))
+        else:
+            name = None
+        self._write_atomic(self.snapshot_path, encode_checked(data))
+        self._snapshot_intact = True
+        try:
+            keep = {name, read_checked(self.previous_snapshot_path).get("queue_file")}
+        except (OSError, ValueError):
+            keep = {name}
+        for old in os.listdir(self.data_dir):
+            if old.startswith(RECORDS_PREFIX) and old.endswith(RECORDS_SUFFIX) and old not in keep:
+                os.remove(os.path.join(self.data_dir, old))
+
+    def history(self) -> List[Dict[str, Any]]:
+        with self._locked(exclusive=False):
+            archived = list(self.archive)
+        return archived + [p for _, p in self.recent]
+
+    def _compact(self) -> None:
+        if self.recent:
+            self.archive.archive([p for _, p in self.recent], self.seq)
+            self._forget_recent()
+        self._write_snapshot({
+            "next_id": self.next_id, "queue": [], "history": [],
+            "leases": list(self.leases.values()),
+            "log_seq": self.seq, "schedule": self.queue.schedule(), "next_numbers": self.next_numbers,
+            "rates": {name: rate.to_dict() for name, rate in self.rates.items()},
+        }, self.queue)
+        # The snapshot records log_seq, so a crash before the log is swapped
+        # out only means the old records get skipped on the next replay.
+        base = json.dumps({"op": "base", "seq": self.seq}, separators=(",", ":")).encode("utf-8") + b"\n"
+        keep_previous(self.log_path, self.previous_log_path, self.fsync)
+        self._write_atomic(self.log_path, base)
+        self._open_log()
+        self._replay()
+
+    def compact(self) -> None:
+        with self._mutex:
+            if not self._loaded:
+                self.open()
+            with self._locked(exclusive=True):
+                self._catch_up(repair=True)
+                self._compact()
+
+    def replace(self, data: Dict[str, Any]) -> None:
+        with self._mutex:
+            if not self._loaded:
+                self.open()
+        with self._locked(exclusive=True):
+            self._catch_up(repair=True)
+            self.next_id = data.get("next_id", 1)
+            self.archive.clear(self.seq)
+            # Bump the sequence so other processes reload the new checkpoint.
+            self.seq += 1
+            self._set_state(data.get("queue", []), data.get("history", []), self.seq, data.get("leases", []))
+            self._compact()
+
+    def close(self) -> None:
+        with self._mutex:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            for fd in (self._lock_fd, self._sync_fd):
+                if fd is not None:
+                    os.close(fd)
+            self._lock_fd = None
+            self._sync_fd = None
+            self._loaded = False
@@ -0,0 +1,78 @@
+"""
+Tests for queue_server: a connection survives requests it cannot serve.
+
+Run: python -m pytest test_queue_server.py (or python -m unittest)
+"""
+
+import asyncio
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import queue_app
+import queue_server
+
+
+class MalformedRequestTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_dir, queue_app.DATA_DIR = queue_app.DATA_DIR, self.tmp.name
+        self.address = f"unix:{os.path.join(self.tmp.name, 'queue.sock')}"
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        path = self.address[len("unix:"):]
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.02)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.create_task(queue_server.serve(self.address))
+        try:
+            self.loop.run_until_complete(self.server)
+        except asyncio.CancelledError:
+            pass
+
+    def tearDown(self) -> None:
+        self.loop.call_soon_threadsafe(self.server.cancel)
+        self.thread.join(5)
+        self.loop.close()
+        queue_app.get_store().close()
+        queue_app.DATA_DIR = self.saved_dir
+        self.tmp.cleanup()
+
+    def test_errors_then_ping_on_one_connection(self) -> None:
+        lines = [
+            b'[1]',
+            b'"x"',
+            b'42',
+            b'null',
+            b'{"op":"add","name":5}',
+            b'{"op":["add"]}',
+            b'{"op":"position","id":{}}',
+            b'{"op":"subscribe"',
+            b'not json',
+        ]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(self.address[len("unix:"):])
+            stream = sock.makefile("rwb")
+            for line in lines:
+                stream.write(line + b"\n")
+                stream.flush()
+                reply = json.loads(stream.readline())
+                self.assertIs(reply["ok"], False, line)
+                self.assertTrue(reply["error"], line)
+            stream.write(b'{"op":"ping"}\n')
+            stream.flush()
+            self.assertEqual(json.loads(stream.readline()), {"ok": True, "result": "pong"})
+
+
+if __name__ == "__main__":
+    unittest.main()
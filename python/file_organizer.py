@@ -1,165 +1,1067 @@
 """
 File Organizer - A Python script to organize files in a directory
 Organizes files by type, date, and other criteria
+
+Every command starts from one os.scandir pass over the directory
+(scan_files). A DirEntry knows whether it is a file from the listing itself
+and caches its stat() result, so sizes and dates cost at most one stat per
+file. Each target folder is listed once and name conflicts are resolved
+against that list in memory, so a move is a single rename. Output is
+printed PRINT_BATCH lines at a time rather than one write per file.
+
+All the names are decided before anything moves; the moves themselves then
+run on a pool of MOVE_WORKERS threads, in batches that each go into a single
+folder, so a slow or network disk always has several requests in flight.
+A file bound for another filesystem is copied in the kernel
+(copy_file_range, or sendfile) and then removed. A file that cannot be moved
+is reported at the end and the rest carry on.
+
+Organizing is planned in full first (plan_moves) and then applied. Applying
+writes each batch of moves to a journal in the directory before carrying it
+out, and undo reads that journal back to front to put the files back. The
+plan can also be saved to a file, looked over, and applied later:
+
+    python file_organizer.py plan DIRECTORY PLAN_FILE [type|content|date]
+    python file_organizer.py apply PLAN_FILE
+    python file_organizer.py undo DIRECTORY
+
+A whole tree can be organized too, each directory in place, by a walker that
+holds one directory listing per level rather than the tree. Globs choose the
+files (--include) and leave files and whole subtrees out (--exclude), and
+subtrees can be shared out among processes:
+
+    python file_organizer.py tree DIRECTORY [type|content|date] [--include GLOB]
+        [--exclude GLOB] [--max-depth N] [--processes N]
+
+plan takes the same options, with --recursive, to plan a tree into a file.
+Organizing by content instead of type sorts files by what their first bytes
+say they are, where a signature recognizes them (see SIGNATURES).
 """
 
+import argparse
+import atexit
+import contextlib
+import errno
+import fnmatch
+import json
+import multiprocessing
 import os
+import re
 import shutil
+import sqlite3
+import sys
+import threading
 import datetime
-from pathlib import Path
-
-def get_file_type(file_path):
-    """Determine the file type based on extension"""
-    extension = Path(file_path).suffix.lower()
-    
-    # Common file type categories
-    file_types = {
-        '.txt': 'Text',
-        '.pdf': 'Documents',
-        '.doc': 'Documents',
-        '.docx': 'Documents',
-        '.xls': 'Documents',
-        '.xlsx': 'Documents',
-        '.ppt': 'Documents',
-        '.pptx': 'Documents',
-        '.jpg': 'Images',
-        '.jpeg': 'Images',
-        '.png': 'Images',
-        '.gif': 'Images',
-        '.bmp': 'Images',
-        '.mp4': 'Videos',
-        '.avi': 'Videos',
-        '.mov': 'Videos',
-        '.mkv': 'Videos',
-        '.mp3': 'Audio',
-        '.wav': 'Audio',
-        '.flac': 'Audio',
-        '.zip': 'Archives',
-        '.rar': 'Archives',
-        '.7z': 'Archives',
-        '.tar': 'Archives',
-        '.gz': 'Archives',
-        '.py': 'Python',
-        '.js': 'Code',
-        '.html': 'Code',
-        '.css': 'Code',
-        '.java': 'Code',
-        '.cpp': 'Code',
-        '.c': 'Code',
-        '.exe': 'Executables',
-        '.msi': 'Executables'
-    }
-    
-    return file_types.get(extension, 'Other')
-
-def get_file_date(file_path):
-    """Get the creation date of the file"""
-    creation_time = os.path.getctime(file_path)
-    return datetime.datetime.fromtimestamp(creation_time)
-
-def create_directory(directory_path):
-    """Create directory if it doesn't exist"""
-    if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
-        print(f"Created directory: {directory_path}")
-
-def organize_by_type(directory_path):
-    """Organize files by their type"""
-    print(f"Organizing files in: {directory_path}")
-    print("-" * 50)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from json.encoder import encode_basestring_ascii as encode_string
+from itertools import islice, zip_longest
+
+# Output lines collected before they are printed in one write.
+PRINT_BATCH = 1000
+
+# Threads moving files at once (FILE_ORGANIZER_WORKERS); 1 moves them inline.
+MOVE_WORKERS = int(os.environ.get("FILE_ORGANIZER_WORKERS", "4"))
+
+# Moves handed to a worker at a time, all into the same folder.
+MOVE_BATCH = 256
+
+# Bytes asked for per call when copying a file to another filesystem.
+COPY_CHUNK = 1 << 30
+
+# Moves planned and written per line batch of a plan file.
+PLAN_BATCH = 10000
+
+# Moves journaled (and fsynced) together before they are carried out.
+APPLY_BATCH = 10000
+
+PLAN_VERSION = 1
+JOURNAL_VERSION = 1
+
+# Kept in each organized directory: what undo needs to put files back.
+JOURNAL_NAME = ".file_organizer_journal"
+
+# Files of ours that organizing leaves where they are.
+OWN_FILES = {JOURNAL_NAME}
+
+# Errors meaning "this copy call does not work here", not "the copy failed".
+UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Common file type categories
+FILE_TYPES = {
+    '.txt': 'Text',
+    '.pdf': 'Documents',
+    '.doc': 'Documents',
+    '.docx': 'Documents',
+    '.xls': 'Documents',
+    '.xlsx': 'Documents',
+    '.ppt': 'Documents',
+    '.pptx': 'Documents',
+    '.jpg': 'Images',
+    '.jpeg': 'Images',
+    '.png': 'Images',
+    '.gif': 'Images',
+    '.bmp': 'Images',
+    '.mp4': 'Videos',
+    '.avi': 'Videos',
+    '.mov': 'Videos',
+    '.mkv': 'Videos',
+    '.mp3': 'Audio',
+    '.wav': 'Audio',
+    '.flac': 'Audio',
+    '.zip': 'Archives',
+    '.rar': 'Archives',
+    '.7z': 'Archives',
+    '.tar': 'Archives',
+    '.gz': 'Archives',
+    '.py': 'Python',
+    '.js': 'Code',
+    '.html': 'Code',
+    '.css': 'Code',
+    '.java': 'Code',
+    '.cpp': 'Code',
+    '.c': 'Code',
+    '.exe': 'Executables',
+    '.msi': 'Executables'
+}
+
+# Every folder organizing by type can produce.
+CATEGORIES = frozenset(FILE_TYPES.values()) | {'Other'}
+
+# ---- content sniffing ----
+#
+# With sniff=True, get_file_type reads a file's first SNIFF_BYTES into a
+# buffer each thread reuses and matches them against SIGNATURES, compiled
+# into one regular expression, so a misnamed file still goes where its
+# contents belong. Files no signature fits (text, source code) still go by
+# extension. What each file turned out to be is kept in an SQLite cache by
+# (device, inode, mtime, size), so an unchanged file is read once per run,
+# even if it has been moved since; across runs too, when a cache file is
+# named.
+
+# Bytes read from the start of a file to recognize it.
+SNIFF_BYTES = 512
+
+# A file to keep the cache in between runs (FILE_ORGANIZER_SNIFF_CACHE, e.g.
+# ~/.cache/file_organizer/sniffed.sqlite3); unset, it is kept in memory for
+# this run only and nothing is written outside the organized directory.
+SNIFF_CACHE = os.path.expanduser(os.environ.get("FILE_ORGANIZER_SNIFF_CACHE", ""))
+
+# Sniffed files written to the cache per transaction.
+SNIFF_COMMIT = 1000
+
+# (category, signature) in the order they are tried. A signature is a
+# regular expression over the first bytes, with no capturing groups: .{n}
+# skips to an offset, and ZIP based documents are told from other ZIPs by
+# the name of their first member. Signatures in SNIFF_CHECKS only count if
+# their check of the bytes agrees as well.
+SIGNATURES = (
+    ('Images', rb'\x89PNG\r\n\x1a\n'),
+    ('Images', rb'\xff\xd8\xff'),
+    ('Images', rb'GIF8[79]a'),
+    ('Images', rb'BM.{4}\x00\x00\x00\x00'),
+    ('Images', rb'RIFF.{4}WEBP'),
+    ('Images', rb'II\*\x00|MM\x00\*'),
+    ('Documents', rb'%PDF-'),
+    ('Documents', rb'PK\x03\x04.{26}(?:\[Content_Types\]\.xml|_rels/|docProps/|word/|xl/|ppt/)'),
+    ('Documents', rb'PK\x03\x04.{26}mimetypeapplication/vnd\.oasis\.opendocument'),
+    ('Archives', rb'PK(?:\x03\x04|\x05\x06|\x07\x08)'),
+    ('Archives', rb'\x1f\x8b'),
+    ('Archives', rb'7z\xbc\xaf\x27\x1c'),
+    ('Archives', rb'Rar!\x1a\x07'),
+    ('Archives', rb'BZh[1-9]1AY&SY'),
+    ('Archives', rb'\xfd7zXZ\x00'),
+    ('Archives', rb'.{257}ustar'),
+    ('Audio', rb'.{4}ftypM4[AB] '),
+    ('Videos', rb'.{4}ftyp'),
+    ('Videos', rb'\x1a\x45\xdf\xa3'),
+    ('Videos', rb'RIFF.{4}AVI '),
+    ('Audio', rb'RIFF.{4}WAVE'),
+    ('Audio', rb'fLaC|OggS|ID3|\xff[\xfb\xf3\xf2]'),
+    ('Executables', rb'\x7fELF'),
+    ('Executables', rb'MZ.{58}'),
+    ('Executables', rb'\xfe\xed\xfa[\xce\xcf]|[\xce\xcf]\xfa\xed\xfe'),
+    ('Python', rb'#![^\n]{0,64}python'),
+)
+
+def is_pe(head):
+    """A DOS header whose e_lfanew points at a PE signature, not just a file
+    starting with MZ"""
+    offset = int.from_bytes(head[0x3c:0x40], "little")
+    return head[offset:offset + 4] == b"PE\0\0"
+
+SNIFF_CHECKS = {rb'MZ.{58}': is_pe}
+
+# One alternative per signature, so the group that matched says which.
+SNIFFER = re.compile(b"|".join(b"(" + signature + b")" for _, signature in SIGNATURES), re.DOTALL)
+SNIFFED = [(category, SNIFF_CHECKS.get(signature)) for category, signature in SIGNATURES]
+
+class SniffBuffer(threading.local):
+    def __init__(self):
+        self.view = memoryview(bytearray(SNIFF_BYTES))
+
+sniff_buffer = SniffBuffer()
+
+def read_head(file_path):
+    """Up to SNIFF_BYTES from the start of a file, as a view of this
+    thread's buffer (good until its next read_head)"""
+    view = sniff_buffer.view
+    if hasattr(os, "readv"):
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            count = os.readv(fd, [view])
+        finally:
+            os.close(fd)
+    else:
+        with open(file_path, "rb", buffering=0) as f:
+            count = f.readinto(view)
+    return view[:count]
+
+class SniffCache:
+    """Sniffed categories by (device, inode, mtime, size); '' for a file no
+    signature fits"""
     
-    # Get all files in the directory
-    files = [f for f in os.listdir(directory_path) 
-             if os.path.isfile(os.path.join(directory_path, f))]
+    def __init__(self, path):
+        self.path = path
+        self.db = None
+        self.pid = None
+        self.pending = []
     
-    if not files:
-        print("No files found to organize!")
+    def connect(self):
+        # A process made by fork opens its own connection.
+        if self.pid != os.getpid():
+            if self.path:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self.db = sqlite3.connect(self.path or ":memory:", timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS sniffed (dev INTEGER, ino INTEGER, mtime INTEGER,"
+                " size INTEGER, category TEXT, PRIMARY KEY (dev, ino, mtime, size)) WITHOUT ROWID")
+            self.pid = os.getpid()
+            self.pending = []
+        return self.db
+    
+    def get(self, key):
+        row = self.connect().execute(
+            "SELECT category FROM sniffed WHERE dev=? AND ino=? AND mtime=? AND size=?", key).fetchone()
+        return None if row is None else row[0]
+    
+    def put(self, key, category):
+        self.pending.append(key + (category,))
+        if len(self.pending) >= SNIFF_COMMIT:
+            self.flush()
+    
+    def flush(self):
+        if self.pending and self.pid == os.getpid():
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO sniffed VALUES (?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+
+sniff_cache = SniffCache(SNIFF_CACHE)
+atexit.register(lambda: sniff_cache.flush())
+
+def sniff_file_type(file_path, stat=None):
+    """The category a file's first bytes say it is, or None if they do not
+    say (or the file cannot be read); stat: the file's, if already known"""
+    try:
+        if stat is None:
+            stat = os.stat(file_path)
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        category = sniff_cache.get(key)
+        if category is None:
+            head = read_head(file_path)
+            match = SNIFFER.match(head)
+            category = ''
+            if match:
+                category, check = SNIFFED[match.lastindex - 1]
+                if check is not None and not check(head):
+                    category = ''
+            sniff_cache.put(key, category)
+    except OSError:
+        return None
+    return category or None
+
+def get_file_type(file_path, sniff=False):
+    """Determine the file type based on extension (or, with sniff, on the
+    file's contents where they are recognized)"""
+    if sniff:
+        category = sniff_file_type(file_path)
+        if category is not None:
+            return category
+    extension = os.path.splitext(file_path)[1].lower()
+    return FILE_TYPES.get(extension, 'Other')
+
+class Report:
+    """Output lines, printed PRINT_BATCH at a time"""
+    
+    def __init__(self):
+        self.lines = []
+    
+    def line(self, text):
+        self.lines.append(text)
+        if len(self.lines) >= PRINT_BATCH:
+            self.flush()
+    
+    def flush(self):
+        if self.lines:
+            print("\n".join(self.lines))
+            self.lines = []
+
+def scan_files(directory_path):
+    """The regular files in a directory, as os.DirEntry objects"""
+    # is_file() is answered from the listing (no stat, except for symlinks),
+    # and each entry's stat() runs at most once and is cached.
+    with os.scandir(directory_path) as entries:
+        return [entry for entry in entries if entry.is_file() and entry.name not in OWN_FILES]
+
+def existing_names(target_dir):
+    """The names already in a target folder (none if it is not there yet)"""
+    try:
+        return set(os.listdir(target_dir))
+    except FileNotFoundError:
+        return set()
+
+def make_folder(target_dir, report):
+    """Create a target folder; True if it was not there before"""
+    try:
+        os.mkdir(target_dir)
+    except FileExistsError:
+        return False
+    report.line(f"Created directory: {target_dir}")
+    return True
+
+def free_name(file, taken):
+    """file, or file_1, file_2, ... (before the extension): the first not taken"""
+    if file not in taken:
+        return file
+    name, ext = os.path.splitext(file)
+    counter = 1
+    while f"{name}_{counter}{ext}" in taken:
+        counter += 1
+    return f"{name}_{counter}{ext}"
+
+def copy_file_range(source_fd, target_fd):
+    return os.copy_file_range(source_fd, target_fd, COPY_CHUNK)
+
+def sendfile(source_fd, target_fd):
+    return os.sendfile(target_fd, source_fd, None, COPY_CHUNK)
+
+def read_write(source_fd, target_fd):
+    data = memoryview(os.read(source_fd, 1 << 20))
+    copied = len(data)
+    while data:
+        data = data[os.write(target_fd, data):]
+    return copied
+
+# Ways to copy between file descriptors, best first: the kernel ones never
+# bring the bytes into Python. All of them continue from the current offsets.
+COPIERS = []
+if hasattr(os, "copy_file_range"):
+    COPIERS.append(copy_file_range)
+if sys.platform.startswith("linux"):
+    COPIERS.append(sendfile)
+COPIERS.append(read_write)
+
+def copy_contents(source_fd, target_fd):
+    """Copy everything left in source_fd to target_fd"""
+    for copier in COPIERS:
+        try:
+            while copier(source_fd, target_fd):
+                pass
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED or copier is read_write:
+                raise
+
+def move_across(source, target):
+    """Move a file to another filesystem: copy it, then remove the original"""
+    if os.path.islink(source):
+        shutil.move(source, target)
         return
+    with open(source, "rb") as src:
+        with open(target, "xb") as dst:
+            try:
+                copy_contents(src.fileno(), dst.fileno())
+            except BaseException:
+                dst.close()
+                os.unlink(target)
+                raise
+    shutil.copystat(source, target)
+    os.unlink(source)
+
+def move_file(source, target):
+    """Move a file; a plain rename unless target is on another filesystem"""
+    try:
+        os.rename(source, target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        move_across(source, target)
+
+def move_batch(folder, moves, check_target=False):
+    """Carry out (name, source, target) moves into one folder; returns the
+    output lines for those that worked, and (name, line) for those that
+    failed"""
+    # check_target: the names were planned a while ago, so make sure nothing
+    # has taken one since (a rename would replace it).
+    moved, failed = [], []
+    for name, source, target in moves:
+        try:
+            if check_target and os.path.lexists(target):
+                raise FileExistsError(errno.EEXIST, "target already exists", target)
+            move_file(source, target)
+        except OSError as e:
+            failed.append((name, f"Failed: {name} -> {folder}/ ({e})"))
+        else:
+            moved.append(f"Moved: {name} -> {folder}/")
+    return moved, failed
+
+def restore_batch(folder, moves):
+    """Undo (name, source, target) moves out of one folder, skipping files
+    that never moved; returns output lines as move_batch does"""
+    restored, failed = [], []
+    for name, source, target in moves:
+        try:
+            if not os.path.lexists(target):
+                continue
+            if os.path.lexists(source):
+                raise FileExistsError(errno.EEXIST, "name taken again", source)
+            move_file(target, source)
+        except OSError as e:
+            failed.append((name, f"Not restored: {folder}/{os.path.basename(target)} ({e})"))
+        else:
+            restored.append(f"Restored: {folder}/{os.path.basename(target)} -> {name}")
+    return restored, failed
+
+def move_batches(planned):
+    """The planned moves in MOVE_BATCH slices, taking the folders in turn"""
+    # Taking turns keeps the workers busy in different folders at once, out
+    # of each other's way on the directory locks.
+    slices = [
+        [(folder, moves[i:i + MOVE_BATCH]) for i in range(0, len(moves), MOVE_BATCH)]
+        for folder, moves in planned.items()
+    ]
+    for turn in zip_longest(*slices):
+        for batch in turn:
+            if batch is not None:
+                yield batch
+
+def run_moves(planned, pool, report, mover=move_batch):
+    """Move everything planned (folder -> moves) with mover, on pool if there
+    is one; returns (moved, failures)"""
+    if pool is None:
+        results = (mover(folder, moves) for folder, moves in move_batches(planned))
+    else:
+        futures = [pool.submit(mover, folder, moves) for folder, moves in move_batches(planned)]
+        results = (future.result() for future in as_completed(futures))
     
+    # Results come back here, to one thread, so the counts and the output
+    # never race.
     moved_count = 0
+    failures = []
+    for moved, failed in results:
+        for line in moved:
+            report.line(line)
+        moved_count += len(moved)
+        failures += failed
+    return moved_count, failures
+
+def move_pool(workers):
+    """A pool for run_moves, or None to move inline"""
+    workers = MOVE_WORKERS if workers is None else workers
+    if workers <= 1:
+        return None
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="file-mover")
+
+def type_folder(entry):
+    return get_file_type(entry.name)
+
+def content_folder(entry):
+    category = sniff_file_type(entry.path, entry.stat())
+    return category if category is not None else get_file_type(entry.name)
+
+def is_type_folder(name):
+    return name in CATEGORIES
+
+def date_folder(date_format="%Y-%m"):
+    """folder_of for organizing by creation date"""
+    def folder_of(entry):
+        file_date = datetime.datetime.fromtimestamp(entry.stat().st_ctime)
+        return file_date.strftime(date_format)
+    return folder_of
+
+def folder_rule(by="type", date_format="%Y-%m"):
+    """(folder_of, is_folder) for organizing by type, by content or by date:
+    where a file goes, and whether a subfolder name is one of those folders"""
+    if by == "type":
+        return type_folder, is_type_folder
+    if by == "content":
+        return content_folder, is_type_folder
     
-    for file in files:
-        file_path = os.path.join(directory_path, file)
-        file_type = get_file_type(file_path)
-        
-        # Create target directory
-        target_dir = os.path.join(directory_path, file_type)
-        create_directory(target_dir)
-        
-        # Move file
-        target_path = os.path.join(target_dir, file)
+    def is_date_folder(name):
+        try:
+            datetime.datetime.strptime(name, date_format)
+        except ValueError:
+            return False
+        return True
+    return date_folder(date_format), is_date_folder
+
+def plan_moves(directory_path, files, folder_of):
+    """(source, folder, target) names for each scanned file, moving nothing"""
+    # Names are checked against each target folder's listing, taken once, so
+    # nothing else should be writing into those folders meanwhile.
+    taken_in = {}
+    for entry in files:
+        folder = folder_of(entry)
+        taken = taken_in.get(folder)
+        if taken is None:
+            taken = taken_in[folder] = existing_names(os.path.join(directory_path, folder))
         
         # Handle file name conflicts
-        counter = 1
-        while os.path.exists(target_path):
-            name, ext = os.path.splitext(file)
-            target_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
-            counter += 1
-        
-        shutil.move(file_path, target_path)
-        print(f"Moved: {file} -> {file_type}/")
-        moved_count += 1
+        target = free_name(entry.name, taken)
+        taken.add(target)
+        yield entry.name, folder, target
+
+# ---- whole trees ----
+#
+# Organizing a tree organizes each directory in it in place, as if it were
+# the only one: its files go into category folders of its own. Category
+# folders that a journal in the tree has moved files into are not walked
+# into, so running it twice does not sort Images into Images/Images; a
+# folder of the same name that this tool did not fill is organized like any
+# other directory.
+
+def glob_matcher(globs):
+    """Whether a file or directory (relative path, name) matches any glob"""
+    match = re.compile("|".join(fnmatch.translate(glob) for glob in globs)).match
+    def matches(relative, name):
+        return match(name) is not None or match(relative) is not None
+    return matches
+
+def walk_tree(root, max_depth=None, prune=None):
+    """(path, relative path, depth) for root and each directory under it
+    (not through symlinks), parents first, skipping any prune(relative, name)
+    holds for"""
+    # One open scandir per level, so memory follows the depth of the tree,
+    # never its size. A directory is only read for subdirectories when the
+    # caller asks for the next one, once it is done with the directory.
+    yield root, "", 0
+    if max_depth == 0:
+        return
+    stack = [(os.scandir(root), "", 1)]
+    try:
+        while stack:
+            entries, parent, depth = stack[-1]
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    relative = os.path.join(parent, entry.name)
+                    if prune is None or not prune(relative, entry.name):
+                        break
+            else:
+                stack.pop()
+                entries.close()
+                continue
+            yield entry.path, relative, depth
+            if max_depth is None or depth < max_depth:
+                try:
+                    stack.append((os.scandir(entry.path), relative, depth + 1))
+                except OSError:
+                    # Gone, or not ours to read: nothing to organize there.
+                    pass
+    finally:
+        for entries, _, _ in stack:
+            entries.close()
+
+def journal_folders(directory_path):
+    """Folders, relative to a directory, that its journal moved files into"""
+    folders = set()
+    try:
+        journal = open(os.path.join(directory_path, JOURNAL_NAME), "rb")
+    except OSError:
+        return folders
+    with journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, list):
+                folders.add(record[1])
+            elif isinstance(record, dict) and "mkdir" in record:
+                folders.add(record["mkdir"])
+    return folders
+
+def tree_pruner(root, is_folder, exclude, base="", planned=()):
+    """prune for walk_tree: category folders organizing made, and
+    directories excluded"""
+    # planned: (relative path, folder names) of each directory being walked,
+    # by depth, filled as it is planned; its new folders may show up in its
+    # listing before any journal has them.
+    excluded = glob_matcher(exclude) if exclude else None
+    # Journals sit in the directories organized, anywhere from the top of
+    # the tree (above root by base, for a subtree) down; each is read once,
+    # the first time a category-named folder below it comes up.
+    top = root
+    for _ in base.split(os.sep) if base else ():
+        top = os.path.dirname(top)
+    journals = {}
+    
+    def made(path):
+        parent = path
+        while parent:
+            parent = os.path.dirname(parent)
+            folders = journals.get(parent)
+            if folders is None:
+                folders = journals[parent] = journal_folders(os.path.join(top, parent))
+            if os.path.relpath(path, parent or os.curdir) in folders:
+                return True
+        return False
+    
+    def prune(relative, name):
+        glob_path = os.path.join(base, relative)
+        if is_folder(name):
+            parent = os.path.dirname(relative)
+            depth = parent.count(os.sep) + 1 if parent else 0
+            if depth < len(planned) and planned[depth][0] == parent and name in planned[depth][1]:
+                return True
+            if made(glob_path):
+                return True
+        return excluded is not None and excluded(glob_path, name)
+    return prune
+
+def tree_moves(root, folder_of, is_folder, include=(), exclude=(), max_depth=None, base=""):
+    """Planned moves for every directory of a tree, a directory at a time,
+    with sources and folders relative to root"""
+    # base: where root sits in the tree the globs were written for.
+    included = glob_matcher(include) if include else None
+    excluded = glob_matcher(exclude) if exclude else None
+    planned = []
+    prune = tree_pruner(root, is_folder, exclude, base, planned)
+    for path, relative, depth in walk_tree(root, max_depth, prune):
+        folders = set()
+        del planned[depth:]
+        planned.append((relative, folders))
+        files = []
+        for entry in scan_files(path):
+            glob_path = os.path.join(base, relative, entry.name)
+            if included is not None and not included(glob_path, entry.name):
+                continue
+            if excluded is not None and excluded(glob_path, entry.name):
+                continue
+            files.append(entry)
+        for source, folder, target in plan_moves(path, files, folder_of):
+            folders.add(folder)
+            yield os.path.join(relative, source), os.path.join(relative, folder), target
+
+# ---- plans and the journal ----
+#
+# A plan file and a journal are both JSON lines: a header object, then one
+# move per line as [source, folder] or, when a conflict renamed it, [source,
+# folder, target]. Source and folder are relative to the organized directory
+# (a tree's files carry their subdirectory), target is a name. Either can be
+# written and read a line at a time, whatever its size.
+
+def encode_move(source, folder, target):
+    # The same text json.dumps gives, from its string encoder alone, in a
+    # fraction of the time: this runs once per file.
+    if target == os.path.basename(source):
+        return f"[{encode_string(source)},{encode_string(folder)}]"
+    return f"[{encode_string(source)},{encode_string(folder)},{encode_string(target)}]"
+
+def decode_move(row):
+    if len(row) == 2:
+        return row[0], row[1], os.path.basename(row[0])
+    return row[0], row[1], row[2]
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def write_plan(plan_path, directory_path, moves, by):
+    """Save planned moves to plan_path; returns (moves, renamed ones)"""
+    count = renamed = 0
+    with open(plan_path, "w", encoding="utf-8") as f:
+        header = {"plan": PLAN_VERSION, "directory": os.path.abspath(directory_path), "by": by}
+        f.write(json.dumps(header) + "\n")
+        for batch in batched(moves, PLAN_BATCH):
+            f.write("\n".join([encode_move(*move) for move in batch]) + "\n")
+            count += len(batch)
+            renamed += sum(1 for source, _, target in batch if target != os.path.basename(source))
+    return count, renamed
+
+def read_plan(plan_path):
+    """A saved plan's header, and its moves as an iterator that reads the
+    file as it goes"""
+    f = open(plan_path, encoding="utf-8")
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("plan") != PLAN_VERSION:
+        f.close()
+        raise ValueError(f"Not a move plan: {plan_path}")
+    
+    def moves():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield decode_move(json.loads(line))
+    return header, moves()
+
+def apply_moves(directory_path, moves, workers=None, check_target=False, shards=()):
+    """Carry out planned moves APPLY_BATCH at a time, each batch written to
+    the directory's journal (and fsynced) before it moves; returns (moved,
+    failure lines)"""
+    # shards: subdirectories organized with journals of their own in this
+    # run, which undoing this session undoes as well.
+    report = Report()
+    journal_path = os.path.join(directory_path, JOURNAL_NAME)
+    mover = partial(move_batch, check_target=check_target)
+    # Folders known to exist, in the directory being organized: a tree's
+    # moves come a directory at a time, so only the current one's are kept.
+    made = set()
+    made_in = ""
+    moved_count = 0
+    failures = []
+    pool = move_pool(workers)
+    journal = None
+    session_start = 0
     
+    def open_journal():
+        journal = open(journal_path, "a", encoding="utf-8")
+        start = journal.tell()
+        at = datetime.datetime.now().isoformat(timespec="seconds")
+        journal.write(json.dumps({"journal": JOURNAL_VERSION, "at": at}) + "\n")
+        return journal, start
+    
+    try:
+        if shards:
+            journal, session_start = open_journal()
+            journal.write(json.dumps({"shards": list(shards)}) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        for batch in batched(moves, APPLY_BATCH):
+            if journal is None:
+                journal, session_start = open_journal()
+            lines = []
+            planned = {}
+            for source, folder, target in batch:
+                moves_in = planned.get(folder)
+                if moves_in is None:
+                    target_dir = os.path.join(directory_path, folder)
+                    parent = os.path.dirname(folder)
+                    if parent != made_in:
+                        made.clear()
+                        made_in = parent
+                    if folder not in made:
+                        if make_folder(target_dir, report):
+                            lines.append(json.dumps({"mkdir": folder}))
+                        made.add(folder)
+                    moves_in = planned[folder] = []
+                moves_in.append((source, os.path.join(directory_path, source),
+                                 os.path.join(directory_path, folder, target)))
+                lines.append(encode_move(source, folder, target))
+            journal.write("\n".join(lines) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+            
+            moved, failed = run_moves(planned, pool, report, mover)
+            moved_count += moved
+            failures += failed
+            if failed:
+                # So that undo leaves alone what this batch did not move.
+                journal.write(json.dumps({"failed": [name for name, _ in failed]}) + "\n")
+                journal.flush()
+    finally:
+        if journal is not None:
+            nothing_done = not moved_count and not shards
+            if nothing_done:
+                # Nothing moved, so nothing to undo either.
+                journal.truncate(session_start)
+            journal.close()
+            if nothing_done and not session_start:
+                os.remove(journal_path)
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    
+    failure_lines = [line for _, line in failures]
+    for line in failure_lines:
+        report.line(line)
+    report.flush()
+    return moved_count, failure_lines
+
+def read_backwards(f, block_size=1 << 16):
+    """(offset, line) for each line of a binary file, last line first"""
+    position = f.seek(0, os.SEEK_END)
+    pending = b""
+    while position > 0:
+        start = max(0, position - block_size)
+        f.seek(start)
+        pending = f.read(position - start) + pending
+        position = start
+        if start > 0:
+            # Up to the first newline may be the end of a line that starts
+            # further back: keep it for the next block.
+            head, newline, complete = pending.partition(b"\n")
+            if not newline:
+                continue
+            offset = start + len(head) + 1
+            pending = head
+        else:
+            complete, offset, pending = pending, 0, b""
+        lines = []
+        for line in complete.split(b"\n"):
+            lines.append((offset, line))
+            offset += len(line) + 1
+        for offset, line in reversed(lines):
+            if line:
+                yield offset, line
+
+def undo_last(directory_path, workers=None):
+    """Put back the files the last organize or apply moved; returns
+    (restored, failed), or None when there is nothing to undo"""
+    journal_path = os.path.join(directory_path, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return None
+    report = Report()
+    restored_count = 0
+    failures = []
+    made = []
+    not_moved = set()
+    shards = []
+    session_start = None
+    pool = move_pool(workers)
+    try:
+        with open(journal_path, "rb+") as journal:
+            pending = {}
+            count = 0
+            for offset, line in read_backwards(journal):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash: its batch never moved.
+                    continue
+                if isinstance(record, dict):
+                    if "journal" in record:
+                        session_start = offset
+                        break
+                    if "failed" in record:
+                        not_moved.update(record["failed"])
+                    elif "shards" in record:
+                        shards = record["shards"]
+                    else:
+                        made.append(record["mkdir"])
+                    continue
+                source, folder, target = decode_move(record)
+                if source in not_moved:
+                    continue
+                pending.setdefault(folder, []).append(
+                    (source, os.path.join(directory_path, source), os.path.join(directory_path, folder, target)))
+                count += 1
+                if count >= APPLY_BATCH:
+                    restored, failed = run_moves(pending, pool, report, restore_batch)
+                    restored_count += restored
+                    failures += failed
+                    pending = {}
+                    count = 0
+            restored, failed = run_moves(pending, pool, report, restore_batch)
+            restored_count += restored
+            failures += failed
+            if session_start is None:
+                session_start = 0
+            journal.truncate(session_start)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+    
+    # Folders the session created go again once they are empty.
+    for folder in made:
+        try:
+            os.rmdir(os.path.join(directory_path, folder))
+        except OSError:
+            pass
+    if session_start == 0:
+        os.remove(journal_path)
+    
+    for _, line in failures:
+        report.line(line)
+    report.flush()
+    failed_count = len(failures)
+    
+    for shard in shards:
+        result = undo_last(os.path.join(directory_path, shard), workers)
+        if result is not None:
+            restored_count += result[0]
+            failed_count += result[1]
+    return restored_count, failed_count
+
+def organize(directory_path, folder_of, workers=None):
+    """Plan and apply moves for every file in a directory; (moved, failed),
+    or None if there were no files"""
+    files = scan_files(directory_path)
+    if not files:
+        return None
+    return apply_moves(directory_path, plan_moves(directory_path, files, folder_of), workers)
+
+def organize_by_type(directory_path, workers=None, sniff=False):
+    """Organize files by their type (with sniff, by their contents where
+    those are recognized)"""
+    print(f"Organizing files in: {directory_path}")
+    print("-" * 50)
+    
+    result = organize(directory_path, content_folder if sniff else type_folder, workers)
+    
+    if result is None:
+        print("No files found to organize!")
+        return
+    
+    moved_count, failures = result
     print("-" * 50)
     print(f"Organization complete! Moved {moved_count} files.")
+    if failures:
+        print(f"{len(failures)} files could not be moved (see above).")
 
-def organize_by_date(directory_path, date_format="%Y-%m"):
+def organize_by_date(directory_path, date_format="%Y-%m", workers=None):
     """Organize files by creation date"""
     print(f"Organizing files by date in: {directory_path}")
     print("-" * 50)
     
-    files = [f for f in os.listdir(directory_path) 
-             if os.path.isfile(os.path.join(directory_path, f))]
+    result = organize(directory_path, date_folder(date_format), workers)
     
-    if not files:
+    if result is None:
         print("No files found to organize!")
         return
     
+    moved_count, failures = result
+    print("-" * 50)
+    print(f"Date organization complete! Moved {moved_count} files.")
+    if failures:
+        print(f"{len(failures)} files could not be moved (see above).")
+
+def apply_tree(directory_path, by="type", date_format="%Y-%m", include=(), exclude=(),
+               max_depth=None, workers=None, processes=1, base=""):
+    """Organize every directory of a tree in place; returns (moved, failure
+    lines)"""
+    folder_of, is_folder = folder_rule(by, date_format)
+    if processes <= 1 or max_depth == 0:
+        moves = tree_moves(directory_path, folder_of, is_folder, include, exclude, max_depth, base)
+        return apply_moves(directory_path, moves, workers)
+    
+    # Each subdirectory's subtree in a worker process with a journal of its
+    # own, then the top directory here. Its session lists the subtrees that
+    # moved something, for undo; the others journaled nothing this time.
+    prune = tree_pruner(directory_path, is_folder, exclude, base)
+    shards = [relative for _, relative, depth in walk_tree(directory_path, 1, prune) if depth == 1]
+    top_moves = tree_moves(directory_path, folder_of, is_folder, include, exclude, 0, base)
     moved_count = 0
+    failures = []
+    moved_shards = []
     
-    for file in files:
-        file_path = os.path.join(directory_path, file)
-        file_date = get_file_date(file_path)
-        date_folder = file_date.strftime(date_format)
-        
-        # Create date directory
-        target_dir = os.path.join(directory_path, date_folder)
-        create_directory(target_dir)
-        
-        # Move file
-        target_path = os.path.join(target_dir, file)
-        
-        # Handle file name conflicts
-        counter = 1
-        while os.path.exists(target_path):
-            name, ext = os.path.splitext(file)
-            target_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
-            counter += 1
-        
-        shutil.move(file_path, target_path)
-        print(f"Moved: {file} -> {date_folder}/")
-        moved_count += 1
+    below = None if max_depth is None else max_depth - 1
+    shard_of = {os.path.join(base, shard): shard for shard in shards}
+    jobs = [
+        (os.path.join(directory_path, shard), by, date_format, include, exclude, below, workers, shard_base)
+        for shard_base, shard in shard_of.items()
+    ]
+    with multiprocessing.Pool(processes) as pool:
+        for shard, shard_moved, shard_failures in pool.imap_unordered(organize_shard, jobs):
+            for line in shard_failures:
+                print(line)
+            print(f"Organized subtree: {shard} ({shard_moved} files moved)")
+            if shard_moved:
+                moved_shards.append(shard_of[shard])
+            moved_count += shard_moved
+            failures += shard_failures
     
+    top_moved, top_failures = apply_moves(directory_path, top_moves, workers, shards=sorted(moved_shards))
+    return moved_count + top_moved, failures + top_failures
+
+def organize_shard(job):
+    """apply_tree for one subtree, in a worker process; its per-file output
+    is dropped and the failures go back to the parent"""
+    path, by, date_format, include, exclude, max_depth, workers, base = job
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        moved_count, failures = apply_tree(path, by, date_format, include, exclude, max_depth, workers, 1, base)
+    # Pool workers leave without running atexit.
+    sniff_cache.flush()
+    return base, moved_count, failures
+
+def organize_tree(directory_path, by="type", date_format="%Y-%m", include=(), exclude=(),
+                  max_depth=None, workers=None, processes=1):
+    """Organize every directory of a tree by type or date"""
+    print(f"Organizing the tree under: {directory_path}")
     print("-" * 50)
-    print(f"Date organization complete! Moved {moved_count} files.")
+    
+    moved_count, failures = apply_tree(directory_path, by, date_format, include, exclude,
+                                       max_depth, workers, processes)
+    
+    print("-" * 50)
+    print(f"Tree organization complete! Moved {moved_count} files.")
+    if failures:
+        print(f"{len(failures)} files could not be moved (see above).")
+
+def save_plan(directory_path, plan_path, by="type", date_format="%Y-%m",
+              include=(), exclude=(), max_depth=0):
+    """Plan organizing a directory (or, given a max_depth other than 0, its
+    tree) into a file, moving nothing"""
+    folder_of, is_folder = folder_rule(by, date_format)
+    moves = tree_moves(directory_path, folder_of, is_folder, include, exclude, max_depth)
+    count, renamed = write_plan(plan_path, directory_path, moves, by)
+    print(f"Planned {count} moves ({renamed} renamed to avoid a clash) in: {plan_path}")
+
+def apply_plan(plan_path, workers=None):
+    """Carry out a saved plan"""
+    header, moves = read_plan(plan_path)
+    directory_path = header["directory"]
+    print(f"Applying {plan_path} to: {directory_path}")
+    print("-" * 50)
+    
+    moved_count, failures = apply_moves(directory_path, moves, workers, check_target=True)
+    
+    print("-" * 50)
+    print(f"Plan applied! Moved {moved_count} files.")
+    if failures:
+        print(f"{len(failures)} files could not be moved (see above).")
+
+def undo(directory_path, workers=None):
+    """Undo the last organization of a directory"""
+    print(f"Undoing the last organization of: {directory_path}")
+    print("-" * 50)
+    
+    result = undo_last(directory_path, workers)
+    
+    if result is None:
+        print("Nothing to undo!")
+        return
+    
+    restored_count, failed_count = result
+    print("-" * 50)
+    print(f"Undo complete! Restored {restored_count} files.")
+    if failed_count:
+        print(f"{failed_count} files could not be restored (see above).")
 
 def list_files(directory_path):
     """List all files in the directory with their types"""
     print(f"Files in: {directory_path}")
     print("-" * 50)
     
-    files = [f for f in os.listdir(directory_path) 
-             if os.path.isfile(os.path.join(directory_path, f))]
+    files = scan_files(directory_path)
     
     if not files:
         print("No files found!")
         return
     
-    for file in files:
-        file_path = os.path.join(directory_path, file)
-        file_type = get_file_type(file_path)
-        file_size = os.path.getsize(file_path)
-        print(f"{file:<30} | {file_type:<15} | {file_size:>8} bytes")
+    report = Report()
+    for entry in files:
+        file_type = get_file_type(entry.name)
+        file_size = entry.stat().st_size
+        report.line(f"{entry.name:<30} | {file_type:<15} | {file_size:>8} bytes")
+    report.flush()
     
     print("-" * 50)
     print(f"Total files: {len(files)}")
@@ -173,7 +1075,8 @@ def show_menu():
     print("2. Organize files by date (Year-Month folders)")
     print("3. List all files in current directory")
     print("4. Change directory")
-    print("5. Exit")
+    print("5. Undo the last organization")
+    print("6. Exit")
     print("="*60)
 
 def main():
@@ -184,7 +1087,7 @@ def main():
         show_menu()
         
         try:
-            choice = input("\nEnter your choice (1-5): ").strip()
+            choice = input("\nEnter your choice (1-6): ").strip()
             
             if choice == '1':
                 organize_by_type(current_directory)
@@ -200,10 +1103,12 @@ def main():
                 else:
                     print("Invalid directory path!")
             elif choice == '5':
+                undo(current_directory)
+            elif choice == '6':
                 print("Thank you for using File Organizer!")
                 break
             else:
-                print("Invalid choice! Please enter 1-5.")
+                print("Invalid choice! Please enter 1-6.")
             
             input("\nPress Enter to continue...")
             
@@ -214,7 +1119,61 @@ def main():
             print(f"An error occurred: {e}")
             input("Press Enter to continue...")
 
+def run_command(args):
+    """The plan, apply, undo and tree commands; returns the exit status"""
+    parser = argparse.ArgumentParser(prog="file_organizer.py")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    def add_tree_options(command):
+        command.add_argument("by", nargs="?", choices=("type", "content", "date"), default="type")
+        command.add_argument("--include", action="append", default=[], metavar="GLOB",
+                             help="only organize files matching GLOB (repeatable)")
+        command.add_argument("--exclude", action="append", default=[], metavar="GLOB",
+                             help="leave files and directories matching GLOB alone (repeatable)")
+    
+    plan = commands.add_parser("plan", help="plan organizing a directory into PLAN_FILE")
+    plan.add_argument("directory")
+    plan.add_argument("plan_file")
+    add_tree_options(plan)
+    plan.add_argument("--recursive", action="store_true", help="plan the whole tree")
+    plan.add_argument("--max-depth", type=int, help="plan this many levels down (implies --recursive)")
+    
+    apply = commands.add_parser("apply", help="carry out a saved plan")
+    apply.add_argument("plan_file")
+    
+    undo_command = commands.add_parser("undo", help="undo the last organization of a directory")
+    undo_command.add_argument("directory")
+    
+    tree = commands.add_parser(
+        "tree", help="organize every directory of a tree in place",
+        description="Organize every directory of a tree in place. Category folders that an earlier run "
+                    "(still in the journal) filled are skipped; any other directory is organized.",
+    )
+    tree.add_argument("directory")
+    add_tree_options(tree)
+    tree.add_argument("--max-depth", type=int, help="go at most this many levels down")
+    tree.add_argument("--processes", type=int, default=1, help="organize subtrees in this many processes")
+    
+    options = parser.parse_args(args)
+    if options.command == "plan":
+        max_depth = options.max_depth
+        if max_depth is None:
+            max_depth = None if options.recursive else 0
+        save_plan(options.directory, options.plan_file, options.by,
+                  include=options.include, exclude=options.exclude, max_depth=max_depth)
+    elif options.command == "apply":
+        apply_plan(options.plan_file)
+    elif options.command == "undo":
+        undo(options.directory)
+    else:
+        organize_tree(options.directory, options.by, include=options.include, exclude=options.exclude,
+                      max_depth=options.max_depth, processes=options.processes)
+    return 0
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
+    
     print("Welcome to File Organizer!")
     print(f"Current working directory: {os.getcwd()}")
     
@@ -0,0 +1,526 @@
+"""
+File Organizer Benchmarks - timing for file_organizer on large directories
+
+Run: python file_organizer_bench.py scan [file counts...]
+     python file_organizer_bench.py moves [worker counts...]
+     python file_organizer_bench.py cross [file sizes in KB...]
+     python file_organizer_bench.py plan [file counts...]
+     python file_organizer_bench.py tree [file counts...] [processes N]
+     python file_organizer_bench.py sniff [file counts...]
+
+scan fills a temporary directory with that many empty files and runs
+list_files, organize_by_type and organize_by_date over it twice: as the code
+stood before the scandir engine (legacy_*) and as it is now. For each it
+reports wall time and the filesystem calls made, counted where Python makes
+them: os.stat and friends, os.path helpers (which call os.stat), directory
+listings, renames and mkdirs, and the first stat() of each DirEntry (later
+ones are cached). DirEntry.is_file() is answered from the listing on Linux
+filesystems, so it only counts for symlinks. Output goes to os.devnull.
+
+The default sizes stop at 100000; the engine is meant for 1000000:
+
+    python file_organizer_bench.py scan 1000000
+
+moves organizes MOVES_FILES files by type with each number of move workers.
+cross moves CROSS_FILES files of each size to another filesystem
+(FILE_ORGANIZER_BENCH_OTHER_FS, /dev/shm by default) with shutil.move and
+with file_organizer.move_file, and back between runs.
+plan times the three phases of organizing by type apart: planning into a
+file (one scan, no moves), applying that file, and undoing it.
+tree spreads the files over a tree of directories holding TREE_FILES_PER_DIR
+each, TREE_FANOUT subdirectories per directory, and reports the peak memory
+(tracemalloc) of planning the whole tree into a file and of organizing it,
+which should not grow with the tree, and the time organizing takes.
+sniff fills a directory with files of known kinds (SNIFF_SAMPLES) under a
+meaningless extension and classifies them by extension, by content with an
+empty cache, and by content again with the cache warm: files/s, files read,
+and how many came out as the kind they are.
+"""
+
+import contextlib
+import datetime
+import gzip
+import io
+import os
+import shutil
+import sys
+import tempfile
+import tarfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+import file_organizer
+
+# Extensions the seeded files cycle through: most categories, and 'Other'.
+EXTENSIONS = ('.txt', '.pdf', '.jpg', '.png', '.mp4', '.mp3', '.zip', '.py', '.js', '.dat')
+
+# Files per run of the moves and cross modes.
+MOVES_FILES = 100000
+CROSS_FILES = 200
+
+# A directory on a filesystem other than the temporary one, for cross.
+OTHER_FS = os.environ.get("FILE_ORGANIZER_BENCH_OTHER_FS", "/dev/shm")
+
+# Shape of the trees the tree mode builds.
+TREE_FILES_PER_DIR = 200
+TREE_FANOUT = 8
+
+# os functions that each make one system call (or one directory read).
+COUNTED = ('stat', 'lstat', 'listdir', 'rename', 'replace', 'mkdir', 'makedirs', 'rmdir', 'unlink')
+
+
+# ---- the code as it was ----
+
+def legacy_get_file_type(file_path):
+    extension = Path(file_path).suffix.lower()
+    file_types = dict(file_organizer.FILE_TYPES)
+    return file_types.get(extension, 'Other')
+
+
+def legacy_get_file_date(file_path):
+    creation_time = os.path.getctime(file_path)
+    return datetime.datetime.fromtimestamp(creation_time)
+
+
+def legacy_create_directory(directory_path):
+    if not os.path.exists(directory_path):
+        os.makedirs(directory_path)
+        print(f"Created directory: {directory_path}")
+
+
+def legacy_files(directory_path):
+    return [f for f in os.listdir(directory_path)
+            if os.path.isfile(os.path.join(directory_path, f))]
+
+
+def legacy_move_all(directory_path, folder_of):
+    for file in legacy_files(directory_path):
+        file_path = os.path.join(directory_path, file)
+        folder = folder_of(file_path)
+        target_dir = os.path.join(directory_path, folder)
+        legacy_create_directory(target_dir)
+        target_path = os.path.join(target_dir, file)
+        counter = 1
+        while os.path.exists(target_path):
+            name, ext = os.path.splitext(file)
+            target_path = os.path.join(target_dir, f"{name}_{counter}{ext}")
+            counter += 1
+        shutil.move(file_path, target_path)
+        print(f"Moved: {file} -> {folder}/")
+
+
+def legacy_organize_by_type(directory_path):
+    legacy_move_all(directory_path, legacy_get_file_type)
+
+
+def legacy_organize_by_date(directory_path, date_format="%Y-%m"):
+    legacy_move_all(directory_path, lambda path: legacy_get_file_date(path).strftime(date_format))
+
+
+def legacy_list_files(directory_path):
+    for file in legacy_files(directory_path):
+        file_path = os.path.join(directory_path, file)
+        file_type = legacy_get_file_type(file_path)
+        file_size = os.path.getsize(file_path)
+        print(f"{file:<30} | {file_type:<15} | {file_size:>8} bytes")
+
+
+# ---- counting filesystem calls ----
+
+class CountedEntry:
+    """An os.DirEntry that counts the stat() calls it really makes"""
+
+    def __init__(self, entry, counts):
+        self._entry = entry
+        self._counts = counts
+        self._statted = False
+        self.name = entry.name
+        self.path = entry.path
+
+    def _stat_once(self):
+        if not self._statted:
+            self._statted = True
+            self._counts['stat'] = self._counts.get('stat', 0) + 1
+
+    def is_file(self, follow_symlinks=True):
+        if follow_symlinks and self._entry.is_symlink():
+            self._stat_once()
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, follow_symlinks=True):
+        if follow_symlinks and self._entry.is_symlink():
+            self._stat_once()
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def inode(self):
+        return self._entry.inode()
+
+    def stat(self, follow_symlinks=True):
+        self._stat_once()
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+
+class CountedScandir:
+    def __init__(self, scandir, path, counts):
+        self._iterator = scandir(path)
+        self._counts = counts
+
+    def __iter__(self):
+        for entry in self._iterator:
+            yield CountedEntry(entry, self._counts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._iterator.close()
+
+
+@contextlib.contextmanager
+def counting_syscalls():
+    """Count calls of the COUNTED os functions (and os.scandir) meanwhile"""
+    counts = {}
+    originals = {name: getattr(os, name) for name in COUNTED + ('scandir',)}
+
+    def counted(name, func):
+        def call(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return func(*args, **kwargs)
+        return call
+
+    for name in COUNTED:
+        setattr(os, name, counted(name, originals[name]))
+    scandir = originals['scandir']
+
+    def counted_scandir(path='.'):
+        counts['scandir'] = counts.get('scandir', 0) + 1
+        return CountedScandir(scandir, path, counts)
+
+    os.scandir = counted_scandir
+    try:
+        yield counts
+    finally:
+        for name, func in originals.items():
+            setattr(os, name, func)
+
+
+# ---- workloads ----
+
+def _zip_bytes(names):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name in names:
+            archive.writestr(name, 'x' * 100)
+    return buffer.getvalue()
+
+
+def _tar_bytes():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 3
+        archive.addfile(info, io.BytesIO(b'abc'))
+    return buffer.getvalue()
+
+
+def sniff_samples():
+    """(category the contents belong to, contents) of each kind of file the
+    sniff mode writes"""
+    return [
+        ('Images', b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + bytes(600)),
+        ('Images', b'\xff\xd8\xff\xe0\x00\x10JFIF\x00' + bytes(600)),
+        ('Documents', b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n' + bytes(600)),
+        ('Documents', _zip_bytes(['[Content_Types].xml', 'word/document.xml'])),
+        ('Archives', _zip_bytes(['notes.txt'])),
+        ('Archives', gzip.compress(b'hello' * 200)),
+        ('Archives', _tar_bytes()),
+        ('Videos', b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom' + bytes(600)),
+        ('Audio', b'ID3\x04\x00\x00\x00\x00\x00\x00' + bytes(600)),
+        ('Executables', b'\x7fELF\x02\x01\x01\x00' + bytes(600)),
+        ('Executables', b'MZ' + bytes(58) + (64).to_bytes(4, 'little') + b'PE\0\0' + bytes(600)),
+        ('Other', b'MZ is not enough to make this an executable\n' * 20),
+        ('Other', b'just some text that no signature knows\n' * 20),
+    ]
+
+
+def seed_files(directory_path, count, first=0):
+    for i in range(first, first + count):
+        fd = os.open(os.path.join(directory_path, f"file{i:07d}{EXTENSIONS[i % len(EXTENSIONS)]}"),
+                     os.O_CREAT | os.O_WRONLY, 0o644)
+        os.close(fd)
+
+
+def flatten(directory_path):
+    """Move files back out of the subfolders organizing made, and drop those
+    and the journal"""
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(os.path.join(directory_path, file_organizer.JOURNAL_NAME))
+    with os.scandir(directory_path) as entries:
+        folders = [entry.path for entry in entries if entry.is_dir()]
+    for folder in folders:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                os.rename(entry.path, os.path.join(directory_path, entry.name))
+        os.rmdir(folder)
+
+
+def run_quietly(func, directory_path):
+    """Seconds func(directory_path) takes, with its output thrown away"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func(directory_path)
+        return time.perf_counter() - start
+
+
+def bench_scan(count):
+    """Wall time and filesystem calls per command, legacy and current"""
+    commands = (
+        ('list', legacy_list_files, file_organizer.list_files),
+        ('type', legacy_organize_by_type, file_organizer.organize_by_type),
+        ('date', legacy_organize_by_date, file_organizer.organize_by_date),
+    )
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_files(tmp, count)
+        for command, legacy, current in commands:
+            for label, func in (('legacy', legacy), ('scandir', current)):
+                seconds = run_quietly(func, tmp)
+                flatten(tmp)
+                with counting_syscalls() as counts:
+                    run_quietly(func, tmp)
+                flatten(tmp)
+                results.append({
+                    'command': command, 'code': label, 'seconds': seconds,
+                    'files_per_sec': count / seconds if seconds else None,
+                    'calls': dict(counts), 'total_calls': sum(counts.values()),
+                })
+    return results
+
+
+def bench_moves(workers, count=MOVES_FILES):
+    """organize_by_type over count files with that many move workers"""
+    with tempfile.TemporaryDirectory() as tmp:
+        seed_files(tmp, count)
+        seconds = run_quietly(lambda path: file_organizer.organize_by_type(path, workers=workers), tmp)
+    return {'workers': workers, 'seconds': seconds, 'files_per_sec': count / seconds}
+
+
+def bench_cross(size_kb, count=CROSS_FILES):
+    """Moving count files of size_kb to another filesystem and back: MB/s"""
+    payload = os.urandom(size_kb * 1024)
+    megabytes = count * len(payload) / 1e6
+    results = {}
+    with tempfile.TemporaryDirectory() as here, tempfile.TemporaryDirectory(dir=OTHER_FS) as there:
+        if os.stat(here).st_dev == os.stat(there).st_dev:
+            return None
+        names = [f"file{i:05d}.bin" for i in range(count)]
+        for name in names:
+            with open(os.path.join(here, name), 'wb') as f:
+                f.write(payload)
+        for label, move in (('shutil.move', shutil.move), ('move_file', file_organizer.move_file)):
+            start = time.perf_counter()
+            for name in names:
+                move(os.path.join(here, name), os.path.join(there, name))
+            seconds = time.perf_counter() - start
+            results[label] = megabytes / seconds
+            for name in names:
+                os.rename(os.path.join(there, name), os.path.join(there, name + '.x'))
+                file_organizer.move_file(os.path.join(there, name + '.x'), os.path.join(here, name))
+    return results
+
+
+def bench_plan(count):
+    """Seconds to plan, apply and undo organizing count files by type"""
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as plans:
+        seed_files(tmp, count)
+        plan_path = os.path.join(plans, 'plan.jsonl')
+        phases = (
+            ('plan', lambda: file_organizer.save_plan(tmp, plan_path)),
+            ('apply', lambda: file_organizer.apply_plan(plan_path)),
+            ('undo', lambda: file_organizer.undo(tmp)),
+        )
+        row = {}
+        for phase, run in phases:
+            row[phase] = run_quietly(lambda _: run(), tmp)
+            if phase == 'plan':
+                row['plan_bytes'] = os.path.getsize(plan_path)
+    return row
+
+
+def seed_tree(root, count):
+    """count files, TREE_FILES_PER_DIR to a directory, in a tree under root"""
+    directories = [root]
+    made = 0
+    while made < count:
+        directory = directories[made // TREE_FILES_PER_DIR]
+        if made % TREE_FILES_PER_DIR == 0:
+            for i in range(TREE_FANOUT):
+                child = os.path.join(directory, f"dir{i}")
+                os.mkdir(child)
+                directories.append(child)
+        seed_files(directory, min(TREE_FILES_PER_DIR, count - made), made)
+        made += TREE_FILES_PER_DIR
+
+
+def peak_memory(func):
+    """(seconds, peak bytes Python allocated) for one call of func; tracing
+    slows it down, so time things apart"""
+    tracemalloc.start()
+    try:
+        seconds = run_quietly(lambda _: func(), None)
+        return seconds, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_tree(count, processes=1):
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as plans:
+        seed_tree(tmp, count)
+        plan_path = os.path.join(plans, 'plan.jsonl')
+        plan = lambda: file_organizer.save_plan(tmp, plan_path, max_depth=None)
+        plan_seconds = run_quietly(lambda _: plan(), None)
+        _, plan_peak = peak_memory(plan)
+        organize_seconds = run_quietly(lambda path: file_organizer.organize_tree(path, processes=processes), tmp)
+        run_quietly(file_organizer.undo_last, tmp)
+        _, organize_peak = peak_memory(lambda: file_organizer.organize_tree(tmp, processes=1))
+    return {
+        'plan_seconds': plan_seconds, 'plan_peak': plan_peak,
+        'organize_seconds': organize_seconds, 'organize_peak': organize_peak,
+    }
+
+
+def bench_sniff(count):
+    samples = sniff_samples()
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as caches:
+        expected = {}
+        for i in range(count):
+            category, contents = samples[i % len(samples)]
+            name = f"file{i:07d}.dat"
+            with open(os.path.join(tmp, name), 'wb') as f:
+                f.write(contents)
+            expected[name] = category
+        saved_cache = file_organizer.sniff_cache
+        file_organizer.sniff_cache = file_organizer.SniffCache(os.path.join(caches, 'sniffed.sqlite3'))
+        read_head = file_organizer.read_head
+        reads = [0]
+
+        def counted_read_head(path):
+            reads[0] += 1
+            return read_head(path)
+
+        file_organizer.read_head = counted_read_head
+        rows = []
+        try:
+            runs = (
+                ('extension', file_organizer.type_folder),
+                ('sniff cold', file_organizer.content_folder),
+                ('sniff warm', file_organizer.content_folder),
+            )
+            for label, folder_of in runs:
+                entries = file_organizer.scan_files(tmp)
+                reads[0] = 0
+                start = time.perf_counter()
+                found = [(entry.name, folder_of(entry)) for entry in entries]
+                file_organizer.sniff_cache.flush()
+                seconds = time.perf_counter() - start
+                right = sum(1 for name, category in found if category == expected[name])
+                rows.append({'run': label, 'seconds': seconds, 'files_per_sec': count / seconds,
+                             'reads': reads[0], 'right': right})
+        finally:
+            file_organizer.read_head = read_head
+            file_organizer.sniff_cache = saved_cache
+    return rows
+
+
+def report_moves(counts):
+    print(f"organize_by_type, {MOVES_FILES} files")
+    print(f"{'workers':>8} {'seconds':>9} {'files/s':>10}")
+    for workers in counts:
+        row = bench_moves(workers)
+        print(f"{workers:>8} {row['seconds']:>9.3f} {row['files_per_sec']:>10.0f}")
+
+
+def report_cross(sizes):
+    print(f"{CROSS_FILES} files to {OTHER_FS} and back")
+    print(f"{'size KB':>8} {'shutil MB/s':>12} {'move_file MB/s':>15}")
+    for size_kb in sizes:
+        row = bench_cross(size_kb)
+        if row is None:
+            print(f"{OTHER_FS} is on the same filesystem as {tempfile.gettempdir()}: nothing to compare")
+            return
+        print(f"{size_kb:>8} {row['shutil.move']:>12.0f} {row['move_file']:>15.0f}")
+
+
+def report_plan(sizes):
+    print(f"{'files':>9} {'plan s':>8} {'apply s':>8} {'undo s':>8} {'plan files/s':>13} {'bytes/move':>11}")
+    for count in sizes:
+        row = bench_plan(count)
+        print(f"{count:>9} {row['plan']:>8.2f} {row['apply']:>8.2f} {row['undo']:>8.2f}"
+              f" {count / row['plan']:>13.0f} {row['plan_bytes'] / count:>11.1f}")
+
+
+def report_tree(args):
+    processes = 1
+    if 'processes' in args:
+        at = args.index('processes')
+        processes = int(args[at + 1])
+        args = args[:at] + args[at + 2:]
+    sizes = [int(a) for a in args] or [10000, 100000]
+    print(f"{TREE_FILES_PER_DIR} files per directory, {TREE_FANOUT} subdirectories each,"
+          f" organized in {processes} process(es)")
+    print(f"{'files':>9} {'plan s':>8} {'plan peak MB':>13} {'organize s':>11} {'files/s':>9}"
+          f" {'organize peak MB':>17}")
+    for count in sizes:
+        row = bench_tree(count, processes)
+        print(f"{count:>9} {row['plan_seconds']:>8.2f} {row['plan_peak'] / 1e6:>13.2f}"
+              f" {row['organize_seconds']:>11.2f} {count / row['organize_seconds']:>9.0f}"
+              f" {row['organize_peak'] / 1e6:>17.2f}")
+
+
+def report_sniff(sizes):
+    for count in sizes:
+        print(f"\n{count} files, {len(sniff_samples())} kinds, all named .dat")
+        print(f"{'run':<11} {'seconds':>8} {'files/s':>10} {'files read':>11} {'right':>7}")
+        for row in bench_sniff(count):
+            print(f"{row['run']:<11} {row['seconds']:>8.3f} {row['files_per_sec']:>10.0f}"
+                  f" {row['reads']:>11} {row['right'] / count:>7.1%}")
+
+
+def report_scan(sizes):
+    for count in sizes:
+        print(f"\n{count} files")
+        print(f"{'command':<8} {'code':<8} {'seconds':>9} {'files/s':>10} {'calls':>9} {'per file':>9}  breakdown")
+        for row in bench_scan(count):
+            breakdown = ' '.join(f"{name}={n}" for name, n in sorted(row['calls'].items()))
+            print(f"{row['command']:<8} {row['code']:<8} {row['seconds']:>9.3f} {row['files_per_sec']:>10.0f}"
+                  f" {row['total_calls']:>9} {row['total_calls'] / count:>9.2f}  {breakdown}")
+
+
+def main(argv):
+    mode = argv[0] if argv else 'scan'
+    if mode == 'tree':
+        report_tree(argv[1:])
+        return
+    sizes = [int(a) for a in argv[1:]]
+    if mode == 'scan':
+        report_scan(sizes or [10000, 100000])
+    elif mode == 'moves':
+        report_moves(sizes or [1, 2, 4, 8, 16])
+    elif mode == 'cross':
+        report_cross(sizes or [4, 256, 4096])
+    elif mode == 'sniff':
+        report_sniff(sizes or [10000, 100000])
+    elif mode == 'plan':
+        report_plan(sizes or [10000, 100000])
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])